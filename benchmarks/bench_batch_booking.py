@@ -0,0 +1,69 @@
+'''
+Benchmark for batch booking.
+
+Books the same number of tickets once through a loop over
+RacingCarEvent.add_ticket_sale and once through RacingCarEvent.book_tickets
+in batches, for both ticket ledgers, and reports tickets per second.
+
+Usage: python benchmarks/bench_batch_booking.py [--tickets N] [--batch N]
+'''
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import racing_event_ticket_booking as racing
+
+
+def new_event(racing, tickets, columnar):
+    ledger = racing.ColumnarTicketLedger() if columnar else None
+    event = racing.RacingCarEvent("Benchmark Event", "UAE", "05/09/2025", tickets, ledger=ledger)
+    event.set_discount_policy(racing.DiscountPolicy(10, True))
+    return event
+
+
+def book_one_by_one(racing, event, customer, tickets):
+    for _ in range(tickets):
+        ticket = racing.SingleRaceTicket(100, event.allocate_seat())
+        customer.add_purchase(event.add_ticket_sale(ticket, customer))
+
+
+def book_in_batches(racing, event, customer, tickets, batch):
+    booked = 0
+    while booked < tickets:
+        quantity = min(batch, tickets - booked)
+        event.book_tickets(racing.SingleRaceTicket, 100, quantity, customer)
+        booked += quantity
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tickets", type=int, default=200000, help="tickets booked per run")
+    parser.add_argument("--batch", type=int, default=1000, help="tickets per batch")
+    args = parser.parse_args()
+
+    print("{:>10}  {:>14}  {:>14}  {:>8}".format("ledger", "loop tix/s", "batch tix/s", "speedup"))
+    for columnar in (False, True):
+        event = new_event(racing, args.tickets, columnar)
+        customer = racing.Customer("1", "Loop", "loop@example.com", "0500000000")
+        start = time.perf_counter()
+        book_one_by_one(racing, event, customer, args.tickets)
+        loop_rate = args.tickets / (time.perf_counter() - start)
+
+        batch_event = new_event(racing, args.tickets, columnar)
+        batch_customer = racing.Customer("2", "Batch", "batch@example.com", "0500000000")
+        start = time.perf_counter()
+        book_in_batches(racing, batch_event, batch_customer, args.tickets, args.batch)
+        batch_rate = args.tickets / (time.perf_counter() - start)
+
+        assert event.get_total_tickets_sold() == batch_event.get_total_tickets_sold() == args.tickets
+        assert abs(event.get_total_sales() - batch_event.get_total_sales()) < 1e-6 * event.get_total_sales()
+        print("{:>10}  {:>14.0f}  {:>14.0f}  {:>7.2f}x".format(
+            "columnar" if columnar else "list", loop_rate, batch_rate, batch_rate / loop_rate))
+
+
+if __name__ == "__main__":
+    main()
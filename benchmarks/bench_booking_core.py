@@ -0,0 +1,225 @@
+'''
+Benchmark suite for the booking core, with scaling curves.
+
+Drives the hot paths of RacingCarEvent and Customer headlessly (no Tk) at
+growing numbers of customers and tickets: register_customer,
+get_customer_by_id, sell_ticket, cancel_ticket, unregister_customer and
+Customer.save_to_file. Every operation is timed call by call and reported as
+ops/sec with latency percentiles; the peak memory of an event holding n
+customers and n tickets is measured in a separate pass with tracemalloc so
+that tracing does not slow down the timed runs.
+
+Results can be saved as JSON and compared with an earlier run; the script
+exits with status 1 when an operation got slower than the allowed tolerance.
+
+Usage: python benchmarks/bench_booking_core.py [--sizes 1000 10000 100000 1000000]
+           [--ledger list|columnar] [--output results.json] [--compare baseline.json]
+'''
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import racing_event_ticket_booking as racing
+
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))
+    return sorted_values[index]
+
+
+def summarize(operation, size, latencies_ns):
+    latencies_ns.sort()
+    total = sum(latencies_ns)
+    result = {
+        "operation": operation,
+        "size": size,
+        "calls": len(latencies_ns),
+        "ops_per_sec": len(latencies_ns) / (total / 1e9) if total else float("inf"),
+        "latency_us": {"p{:g}".format(pct): percentile(latencies_ns, pct) / 1000 for pct in PERCENTILES},
+    }
+    result["latency_us"]["max"] = latencies_ns[-1] / 1000
+    return result
+
+
+def timed(calls):
+    '''
+    Runs every call of an iterable of zero-argument callables and returns their latencies in ns.
+    '''
+    clock = time.perf_counter_ns
+    latencies = []
+    append = latencies.append
+    for call in calls:
+        start = clock()
+        call()
+        append(clock() - start)
+    return latencies
+
+
+def new_event(size, ledger):
+    event = racing.RacingCarEvent("Benchmark Event", "UAE", "05/09/2025", size,
+                                  ledger=racing.ColumnarTicketLedger() if ledger == "columnar" else None)
+    event.set_discount_policy(racing.DiscountPolicy(10, True))
+    return event
+
+
+def new_customers(size):
+    return [racing.Customer(str(i), "Customer {}".format(i), "c{}@example.com".format(i),
+                            "05{:08d}".format(i)) for i in range(size)]
+
+
+def run_size(size, ledger, sample, seed, workdir):
+    '''
+    Benchmarks every operation with `size` customers and tickets.
+    :param sample: number of calls timed for the operations that are not run `size` times
+    :return: list of result dictionaries
+    '''
+    rng = random.Random(seed)
+    event = new_event(size, ledger)
+    customers = new_customers(size)
+    results = []
+
+    register = event.register_customer
+    results.append(summarize("register_customer", size,
+                             timed(lambda customer=customer: register(customer) for customer in customers)))
+
+    lookup = event.get_customer_by_id
+    ids = [str(rng.randrange(size)) for _ in range(sample)]
+    results.append(summarize("get_customer_by_id", size, timed(lambda id=id: lookup(id) for id in ids)))
+
+    sell = event.sell_ticket
+    buyers = [customers[rng.randrange(size)] for _ in range(size)]
+    tickets = []
+    results.append(summarize("sell_ticket", size, timed(
+        lambda customer=customer: tickets.append(
+            (sell(racing.SingleRaceTicket, racing.single_race_ticket_price, customer), customer))
+        for customer in buyers)))
+    assert event.get_total_tickets_sold() == size
+
+    cancel = event.cancel_ticket
+    cancelled = rng.sample(tickets, min(sample, size))
+    results.append(summarize("cancel_ticket", size, timed(
+        lambda ticket=ticket, customer=customer: cancel(ticket, customer) for ticket, customer in cancelled)))
+    assert event.get_sales_aggregates().get_tickets_sold() == size - len(cancelled)
+
+    unregister = event.unregister_customer
+    leaving = rng.sample(customers, min(sample, size))
+    results.append(summarize("unregister_customer", size,
+                             timed(lambda customer=customer: unregister(customer) for customer in leaving)))
+    assert event.get_total_customers() == size - len(leaving)
+
+    journal = racing.CustomerJournal(os.path.join(workdir, "customers-{}.pkl".format(size)),
+                                     os.path.join(workdir, "customers-{}.journal".format(size)))
+    try:
+        results.append(summarize("save_to_file", size, timed(
+            lambda customer=customer: customer.save_to_file(journal) for customer in customers)))
+        journal.wait_for_compaction()
+    finally:
+        journal.close()
+    return results
+
+
+def measure_memory(size, ledger):
+    '''
+    Returns the peak traced memory in MB of building an event with `size`
+    customers who bought one ticket each.
+    '''
+    tracemalloc.start()
+    try:
+        event = new_event(size, ledger)
+        for customer in new_customers(size):
+            event.register_customer(customer)
+            event.sell_ticket(racing.SingleRaceTicket, racing.single_race_ticket_price, customer)
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Compares ops/sec with a baseline run.
+    :return: list of (operation, size, baseline ops/sec, ops/sec) that got slower than the tolerance
+    '''
+    before = {(result["operation"], result["size"]): result["ops_per_sec"] for result in baseline["results"]}
+    slower = []
+    for result in results:
+        key = (result["operation"], result["size"])
+        if key in before and result["ops_per_sec"] < before[key] * (1 - tolerance):
+            slower.append(key + (before[key], result["ops_per_sec"]))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                        help="numbers of customers and tickets, e.g. 1000 10000 100000 1000000")
+    parser.add_argument("--ledger", choices=("list", "columnar"), default="list")
+    parser.add_argument("--sample", type=int, default=10000,
+                        help="calls timed for lookups, cancellations and unregistrations")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-memory", action="store_true", help="skip the peak memory pass")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON results of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="allowed drop in ops/sec against the baseline, 0.2 is 20%%")
+    args = parser.parse_args()
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "numpy": racing._load_numpy() is not None,
+            "ledger": args.ledger,
+            "seed": args.seed,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": [],
+        "memory": [],
+    }
+
+    print("{:>20}  {:>8}  {:>12}  {:>9}  {:>9}  {:>9}  {:>9}".format(
+        "operation", "size", "ops/s", "p50 us", "p99 us", "p99.9 us", "max us"))
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.sizes:
+            for result in run_size(size, args.ledger, args.sample, args.seed, workdir):
+                report["results"].append(result)
+                latency = result["latency_us"]
+                print("{:>20}  {:>8}  {:>12.0f}  {:>9.2f}  {:>9.2f}  {:>9.2f}  {:>9.1f}".format(
+                    result["operation"], size, result["ops_per_sec"], latency["p50"], latency["p99"],
+                    latency["p99.9"], latency["max"]))
+
+    if not args.no_memory:
+        for size in args.sizes:
+            peak = measure_memory(size, args.ledger)
+            report["memory"].append({"size": size, "peak_mb": peak})
+            print("peak memory with {} customers and tickets: {:.1f} MB".format(size, peak))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+        print("results written to {}".format(args.output))
+
+    if args.compare:
+        with open(args.compare) as file:
+            slower = compare(report["results"], json.load(file), args.tolerance)
+        for operation, size, before, after in slower:
+            print("REGRESSION {} at {}: {:.0f} -> {:.0f} ops/s".format(operation, size, before, after))
+        if slower:
+            sys.exit(1)
+        print("no regression against {}".format(args.compare))
+
+
+if __name__ == "__main__":
+    main()
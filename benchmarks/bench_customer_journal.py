@@ -0,0 +1,117 @@
+'''
+Benchmark for saving customers.
+
+Inserts customers one at a time through Customer.save_to_file and reports the
+average cost of an insert around 1k, 10k, 100k and 1M stored customers. The
+old implementation rewrote the whole pickle file on every save, so it is only
+measured at the small sizes and over a shorter window.
+
+Usage: python benchmarks/bench_customer_journal.py [--max N] [--window N]
+'''
+
+import argparse
+import os
+import pickle
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def legacy_save_to_file(customer, path):
+    # The pickle rewrite Customer.save_to_file used before the journal.
+    try:
+        with open(path, "rb") as file:
+            customers = pickle.load(file)
+    except (FileNotFoundError, EOFError):
+        customers = []
+
+    customers.append(customer)
+
+    with open(path, "wb") as file:
+        pickle.dump(customers, file)
+
+
+def legacy_prefill(path, count):
+    # Writing the list in one go stands in for `count` earlier rewrites.
+    from racing_event_ticket_booking import Customer
+
+    try:
+        with open(path, "rb") as file:
+            customers = pickle.load(file)
+    except (FileNotFoundError, EOFError):
+        customers = []
+
+    start = len(customers)
+    customers.extend(Customer(str(i), "name", "name@example.com", "0500000000")
+                     for i in range(start, start + count))
+    with open(path, "wb") as file:
+        pickle.dump(customers, file)
+
+
+def measure(save, checkpoints, window, prefill=None):
+    '''
+    Inserts customers up to the largest checkpoint and times the last
+    `window` inserts before each checkpoint.
+    :param prefill: optional bulk loader used for the untimed inserts
+    :return: dict of checkpoint -> microseconds per insert
+    '''
+    from racing_event_ticket_booking import Customer
+
+    results = {}
+    inserted = 0
+    for checkpoint in checkpoints:
+        start_timed = max(inserted, checkpoint - window)
+        if prefill is not None and start_timed > inserted:
+            prefill(start_timed - inserted)
+            inserted = start_timed
+        while inserted < start_timed:
+            save(Customer(str(inserted), "name", "name@example.com", "0500000000"))
+            inserted += 1
+
+        start = time.perf_counter()
+        while inserted < checkpoint:
+            save(Customer(str(inserted), "name", "name@example.com", "0500000000"))
+            inserted += 1
+        elapsed = time.perf_counter() - start
+        results[checkpoint] = elapsed / (checkpoint - start_timed) * 1e6
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--max", type=int, default=1000000, help="largest customer count")
+    parser.add_argument("--window", type=int, default=1000, help="inserts timed per checkpoint")
+    parser.add_argument("--legacy-max", type=int, default=10000,
+                        help="largest customer count for the old full rewrite")
+    args = parser.parse_args()
+
+    checkpoints = [n for n in (1000, 10000, 100000, 1000000) if n <= args.max]
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        from racing_event_ticket_booking import CustomerJournal
+
+        journal = CustomerJournal(os.path.join(directory, "bench.pkl"),
+                                  os.path.join(directory, "bench.journal"))
+        journal_results = measure(lambda customer: customer.save_to_file(journal),
+                                  checkpoints, args.window)
+        journal.close()
+
+        legacy_path = os.path.join(directory, "legacy.pkl")
+        legacy_results = measure(lambda customer: legacy_save_to_file(customer, legacy_path),
+                                 [n for n in checkpoints if n <= args.legacy_max],
+                                 min(args.window, 100),
+                                 prefill=lambda count: legacy_prefill(legacy_path, count))
+
+    print("{:>10}  {:>16}  {:>16}".format("customers", "journal us/op", "rewrite us/op"))
+    for checkpoint in checkpoints:
+        legacy = legacy_results.get(checkpoint)
+        print("{:>10}  {:>16.2f}  {:>16}".format(
+            checkpoint, journal_results[checkpoint],
+            "{:.2f}".format(legacy) if legacy is not None else "-"))
+
+
+if __name__ == "__main__":
+    main()
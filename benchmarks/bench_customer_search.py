@@ -0,0 +1,92 @@
+'''
+Benchmark for the prefix search of the customer browser.
+
+Fills a CustomerDirectory with n customers, builds its search indexes with the
+first search, then types queries one character at a time the way the browser
+does on every keystroke: count the matches and read the first page of
+results. Reports the keystroke latency percentiles, the cost of a page deep
+into a large result, and the cost of registering and removing customers once
+the indexes exist.
+
+Usage: python benchmarks/bench_customer_search.py [--customers 1000000] [--page 20]
+'''
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import racing_event_ticket_booking as racing
+
+
+FIRST_NAMES = ("Zayed", "Ahmed", "Umar", "Sara", "Fatima", "Omar", "Layla", "Yusuf", "Mariam", "Khalid", "Noor",
+               "Hassan", "Aisha", "Ali", "Huda", "Karim")
+
+LAST_NAMES = ("Al Mansoori", "Haddad", "Khan", "Rahman", "Saleh", "Nasser", "Farouk", "Qasim", "Aziz", "Hamdan")
+
+
+def new_customer(rng, number):
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    return racing.Customer(str(number), "{} {} {}".format(first, last, number),
+                           "{}.{}{}@example.com".format(first.lower(), last.split()[-1].lower(), number),
+                           "+971 5{:08d}".format(rng.randrange(10 ** 8)))
+
+
+def percentile(sorted_values, pct):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--customers", type=int, default=1000000)
+    parser.add_argument("--page", type=int, default=20, help="rows read per keystroke")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    directory = racing.CustomerDirectory()
+    for number in range(args.customers):
+        directory.add(new_customer(rng, number))
+
+    start = time.perf_counter()
+    directory.count_matches("")
+    print("{} customers, search indexes built in {:.2f} s".format(args.customers, time.perf_counter() - start))
+
+    queries = [rng.choice(FIRST_NAMES) + " " + rng.choice(LAST_NAMES) for _ in range(50)]
+    queries += ["{}.".format(rng.choice(FIRST_NAMES).lower()) + "{}".format(rng.randrange(1000)) for _ in range(50)]
+    queries += ["+971 5{}".format(rng.randrange(10 ** 6)) for _ in range(50)]
+    latencies = []
+    for query in queries:
+        for length in range(1, len(query) + 1):
+            text = query[:length]
+            begin = time.perf_counter()
+            directory.count_matches(text)
+            directory.search(text, 0, args.page)
+            latencies.append(time.perf_counter() - begin)
+    latencies.sort()
+    print("keystroke (count + first page of {}), {} keystrokes: p50 {:.3f} ms, p99 {:.3f} ms, max {:.3f} ms".format(
+        args.page, len(latencies), percentile(latencies, 50) * 1e3, percentile(latencies, 99) * 1e3,
+        latencies[-1] * 1e3))
+
+    total = directory.count_matches("")
+    begin = time.perf_counter()
+    for _ in range(100):
+        directory.search("", rng.randrange(total), args.page)
+    print("page at a random position of all {} customers: {:.3f} ms".format(total, (time.perf_counter() - begin) * 10))
+
+    added = [new_customer(rng, args.customers + number) for number in range(10000)]
+    begin = time.perf_counter()
+    for customer in added:
+        directory.add(customer)
+    print("add with the indexes built: {:.1f} us".format((time.perf_counter() - begin) / len(added) * 1e6))
+    begin = time.perf_counter()
+    for customer in added:
+        directory.remove(customer)
+    print("remove with the indexes built: {:.1f} us".format((time.perf_counter() - begin) / len(added) * 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+'''
+Benchmark for the event write-ahead log.
+
+Sells tickets to an event attached to an EventLog, with group commit in
+synchronous mode (every sale waits for its fsync) and in asynchronous mode,
+from several threads, and reports sales per second next to an event without
+a log. Then simulates a crash by recovering from the files left behind and
+reports the recovery time for growing numbers of sales: with snapshots it
+stays bounded by the snapshot threshold instead of growing with the history.
+
+Usage: python benchmarks/bench_event_log.py [--sales 20000] [--threads 4]
+           [--snapshot-threshold 50000] [--history 10000 100000 400000]
+'''
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import racing_event_ticket_booking as racing
+
+
+def new_event(capacity, customers):
+    event = racing.RacingCarEvent("Benchmark Event", "UAE", "05/09/2025", capacity)
+    event.set_discount_policy(racing.DiscountPolicy(10, True))
+    event.register_customers(customers)
+    return event
+
+
+def new_customers(count):
+    return [racing.Customer(str(i), "Customer {}".format(i), "c{}@example.com".format(i), "05{:08d}".format(i))
+            for i in range(count)]
+
+
+def sell(event, customers, sales, threads):
+    def worker(offset):
+        for number in range(offset, sales, threads):
+            event.sell_ticket(racing.SingleRaceTicket, racing.single_race_ticket_price,
+                              customers[number % len(customers)], payment_method="Credit Card")
+
+    workers = [threading.Thread(target=worker, args=(offset,)) for offset in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return sales / (time.perf_counter() - start)
+
+
+def logged_sales(workdir, sales, threads, synchronous, threshold):
+    customers = new_customers(1000)
+    event = new_event(sales, customers)
+    event_log = racing.EventLog(os.path.join(workdir, "event.log"), os.path.join(workdir, "event.snapshot"),
+                                synchronous=synchronous, snapshot_threshold=threshold)
+    event_log.attach(event)
+    try:
+        rate = sell(event, customers, sales, threads)
+        event_log.flush()
+    finally:
+        event_log.close()
+    return rate
+
+
+def recovery_time(workdir, history, threshold):
+    customers = new_customers(1000)
+    event = new_event(history, customers)
+    event_log = racing.EventLog(os.path.join(workdir, "event.log"), os.path.join(workdir, "event.snapshot"),
+                                snapshot_threshold=threshold)
+    event_log.attach(event)
+    sell(event, customers, history, 1)
+    event_log.wait_for_snapshot()
+    event_log.close()
+
+    start = time.perf_counter()
+    recovered = racing.EventLog(os.path.join(workdir, "event.log"),
+                                os.path.join(workdir, "event.snapshot")).recover()
+    elapsed = time.perf_counter() - start
+    assert recovered.get_total_tickets_sold() == history
+    assert recovered.get_total_sales() == event.get_total_sales()
+    return elapsed, os.path.getsize(os.path.join(workdir, "event.log"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sales", type=int, default=20000, help="tickets sold per throughput run")
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--snapshot-threshold", type=int, default=50000)
+    parser.add_argument("--history", type=int, nargs="+", default=[10000, 100000, 400000],
+                        help="numbers of sales before the simulated crash")
+    args = parser.parse_args()
+
+    customers = new_customers(1000)
+    print("{:>24}  {:>10}".format("mode", "sales/s"))
+    print("{:>24}  {:>10.0f}".format("no log", sell(new_event(args.sales, customers), customers, args.sales,
+                                                      args.threads)))
+    for synchronous in (False, True):
+        with tempfile.TemporaryDirectory() as workdir:
+            rate = logged_sales(workdir, args.sales, args.threads, synchronous, args.snapshot_threshold)
+        print("{:>24}  {:>10.0f}".format("synchronous log" if synchronous else "group commit log", rate))
+
+    print("{:>10}  {:>12}  {:>12}".format("sales", "recovery ms", "log KB"))
+    for history in args.history:
+        with tempfile.TemporaryDirectory() as workdir:
+            elapsed, log_size = recovery_time(workdir, history, args.snapshot_threshold)
+        print("{:>10}  {:>12.1f}  {:>12.0f}".format(history, elapsed * 1000, log_size / 1024))
+
+
+if __name__ == "__main__":
+    main()
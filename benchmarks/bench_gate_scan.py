@@ -0,0 +1,99 @@
+'''
+Benchmark for the gate scan-in of gate_validation.py.
+
+Sells n tickets of an event, cancels one in fifty and issues the gate codes,
+then has a number of gate threads scan a shuffled stream holding every code
+twice (the second scan of a ticket must be refused), the cancelled codes and
+made-up codes, half of them with a valid checksum. Reports the cost of
+issuing a code, the scans per second over all gates, the outcome counts and
+how many of the unknown codes the Bloom filter stopped, and checks that every
+valid ticket was let in exactly once.
+
+Usage: python benchmarks/bench_gate_scan.py [--tickets 1000000] [--gates 16] [--forged 100000]
+'''
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gate_validation
+import racing_event_ticket_booking as racing
+
+
+BATCH = 8  # tickets per booking
+
+
+def sold_out_event(tickets):
+    event = racing.RacingCarEvent("Benchmark Event", "UAE", "05/09/2025", tickets,
+                                  ledger=racing.ColumnarTicketLedger(), event_id=1)
+    customer = racing.Customer("1", "Gate Benchmark", "gate@example.com", "0500000000")
+    for start in range(0, tickets, BATCH):
+        event.book_tickets(racing.SingleRaceTicket, racing.single_race_ticket_price, min(BATCH, tickets - start))
+    ledger = event.get_ledger()
+    for ticket_id in range(0, tickets, 50):
+        ledger.get_ticket(ticket_id).invalidate()
+    return event
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tickets", type=int, default=1000000)
+    parser.add_argument("--gates", type=int, default=16, help="threads scanning at the same time")
+    parser.add_argument("--forged", type=int, default=100000, help="made-up codes in the stream")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    event = sold_out_event(args.tickets)
+    validator = gate_validation.GateValidator(event, b"benchmark secret")
+    start = time.perf_counter()
+    validator.issue_codes()
+    elapsed = time.perf_counter() - start
+    bloom = validator.get_bloom_filter()
+    print("{} codes issued: {:.1f} us per code, Bloom filter of {:.1f} MB with {} hashes".format(
+        args.tickets, elapsed / args.tickets * 1e6, bloom.get_size() / 8e6, bloom.get_hash_count()))
+
+    ledger = event.get_ledger()
+    codes = [validator.get_code(ledger.get_ticket(ticket_id)) for ticket_id in range(args.tickets)]
+    forged = [gate_validation.format_code(rng.getrandbits(gate_validation.SERIAL_BITS))
+              for _ in range(args.forged // 2)]
+    forged += ["".join(rng.choice(gate_validation.CROCKFORD_ALPHABET) for _ in range(12))
+               for _ in range(args.forged - len(forged))]
+    stream = codes + codes + forged
+    rng.shuffle(stream)
+
+    # the forged codes with a valid checksum that got past the Bloom filter
+    past_bloom = sum(1 for code in forged if (gate_validation.parse_code(code) or -1) in bloom)
+
+    results = []
+
+    def gate(scans):
+        scan = validator.scan
+        results.append(Counter(scan(code) for code in scans))
+
+    gates = [threading.Thread(target=gate, args=(stream[number::args.gates],)) for number in range(args.gates)]
+    start = time.perf_counter()
+    for thread in gates:
+        thread.start()
+    for thread in gates:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    outcomes = sum(results, Counter())
+    print("{} scans at {} gates: {:.0f} scans/s, {:.1f} us per scan".format(
+        len(stream), args.gates, len(stream) / elapsed, elapsed / len(stream) * 1e6))
+    print(", ".join("{} {}".format(outcome, count) for outcome, count in sorted(outcomes.items())))
+    print("{} of {} forged codes got past the checksum and the Bloom filter".format(past_bloom, args.forged))
+
+    valid = sum(1 for ticket_id in range(args.tickets) if ledger.is_valid(ticket_id))
+    assert outcomes[gate_validation.ADMITTED] == valid == validator.get_admitted_count(), "a ticket was let in twice"
+    assert outcomes[gate_validation.ALREADY_ADMITTED] == valid
+
+
+if __name__ == "__main__":
+    main()
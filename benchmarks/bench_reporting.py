@@ -0,0 +1,127 @@
+'''
+Benchmark for the sales reports of reporting.py.
+
+Fills a ticket ledger with n tickets sold over half a year to many customers,
+with a mix of ticket types, payment methods, discounts and cancellations,
+then times build_report() over it with NumPy and with the pure-Python
+fallback and checks that both give the same figures. With --memory the peak
+memory of the report itself is traced in a separate pass; it depends on the
+chunk size and the number of customers, not on n.
+
+Usage: python benchmarks/bench_reporting.py [--tickets 1000000] [--ledger columnar|mapped|list]
+           [--chunk-size 262144] [--memory]
+'''
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import racing_event_ticket_booking as racing
+import reporting
+
+
+TICKET_TYPES = (
+    (racing.SingleRaceTicket, racing.single_race_ticket_price),
+    (racing.WeekendPackageTicket, racing.weekend_package_ticket_price),
+    (racing.SeasonMembershipTicket, racing.season_membership_ticket_price),
+)
+
+PAYMENT_METHODS = (None, "Credit Card", "Debit Card")
+
+BATCH = 8  # tickets per purchase
+
+DAYS = 180
+
+
+def new_ledger(kind, workdir):
+    if kind == "mapped":
+        return racing.MappedTicketLedger(os.path.join(workdir, "tickets.dat"))
+    if kind == "columnar":
+        return racing.ColumnarTicketLedger()
+    return racing.TicketList()
+
+
+def fill(ledger, tickets, customers, seed):
+    '''
+    Appends `tickets` tickets in purchases of BATCH tickets, then cancels one in fifty.
+    '''
+    rng = random.Random(seed)
+    first_day = int(time.time()) - DAYS * 86400
+    for start in range(0, tickets, BATCH):
+        ticket_class, price = rng.choice(TICKET_TYPES)
+        count = min(BATCH, tickets - start)
+        paid = price * 0.9 if rng.random() < 0.3 else price
+        ledger.append_many([ticket_class(price, start + offset) for offset in range(count)], [paid] * count,
+                           str(rng.randrange(customers)), rng.choice(PAYMENT_METHODS),
+                           first_day + rng.randrange(DAYS * 86400))
+    for index in range(0, tickets, 50):
+        ledger.get_ticket(index).invalidate()
+
+
+def event_with(ledger):
+    return racing.RacingCarEvent("Benchmark Event", "UAE", "05/09/2025", len(ledger), ledger=ledger)
+
+
+def timed_report(event, chunk_size, use_numpy):
+    load_numpy = racing._load_numpy
+    if not use_numpy:
+        racing._load_numpy = reporting._load_numpy = lambda: None
+    try:
+        start = time.perf_counter()
+        report = reporting.build_report(event, chunk_size=chunk_size)
+        return time.perf_counter() - start, report
+    finally:
+        racing._load_numpy = reporting._load_numpy = load_numpy
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tickets", type=int, default=1000000, help="tickets in the ledger, e.g. 10000000")
+    parser.add_argument("--customers", type=int, default=100000)
+    parser.add_argument("--ledger", choices=("columnar", "mapped", "list"), default="columnar")
+    parser.add_argument("--chunk-size", type=int, default=reporting.DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--memory", action="store_true", help="trace the peak memory of the report")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        ledger = new_ledger(args.ledger, workdir)
+        start = time.perf_counter()
+        fill(ledger, args.tickets, args.customers, args.seed)
+        print("{} tickets in a {} ledger filled in {:.1f} s".format(args.tickets, args.ledger,
+                                                                  time.perf_counter() - start))
+        event = event_with(ledger)
+
+        runs = [True, False] if racing._load_numpy() is not None else [False]
+        figures = []
+        for use_numpy in runs:
+            elapsed, report = timed_report(event, args.chunk_size, use_numpy)
+            figures.append(json.dumps(report.to_dict(), sort_keys=True))
+            print("{:>8}  {:>8.2f} s  {:>12.0f} tickets/s".format("numpy" if use_numpy else "python", elapsed,
+                                                                  args.tickets / elapsed))
+        assert len(set(figures)) == 1, "NumPy and pure-Python reports differ"
+
+        if args.memory:
+            tracemalloc.start()
+            try:
+                reporting.build_report(event, chunk_size=args.chunk_size)
+                print("peak memory of the report: {:.1f} MB".format(tracemalloc.get_traced_memory()[1] / 1e6))
+            finally:
+                tracemalloc.stop()
+
+        totals = report.to_dict()["totals"]
+        print("revenue ${:,.2f}, {} tickets, {} cancelled, {:.0%} discounted".format(
+            totals["revenue"], totals["tickets"], totals["cancelled"], totals["discounted_share"]))
+        if args.ledger == "mapped":
+            ledger.close()
+
+
+if __name__ == "__main__":
+    main()
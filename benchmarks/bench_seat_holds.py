@@ -0,0 +1,79 @@
+'''
+Benchmark for seat holds and their expiry.
+
+Takes n concurrent one-seat holds on an event, confirms a share of them,
+lets the rest expire and reports the cost per hold and per confirmation, the
+memory held per active hold (measured in a separate pass with tracemalloc)
+and how many holds the HoldExpiryTimer released on time. Customers on the waitlist are then served from the seats
+freed by the expiry.
+
+Usage: python benchmarks/bench_seat_holds.py [--holds 300000] [--confirm 0.3] [--ttl 10]
+'''
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import racing_event_ticket_booking as racing
+
+
+def take_holds(event, count, ttl):
+    hold = event.hold_seats
+    return [hold(racing.SingleRaceTicket, racing.single_race_ticket_price, ttl=ttl).get_hold_id()
+            for _ in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--holds", type=int, default=300000)
+    parser.add_argument("--confirm", type=float, default=0.3, help="share of the holds confirmed")
+    parser.add_argument("--ttl", type=float, default=10.0, help="seconds the holds last, longer than taking them all")
+    parser.add_argument("--waitlist", type=int, default=10000, help="customers joining the waitlist")
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    event = racing.RacingCarEvent("Benchmark Event", "UAE", "05/09/2025", args.holds)
+    before = tracemalloc.get_traced_memory()[0]
+    take_holds(event, args.holds, 3600)
+    per_hold = (tracemalloc.get_traced_memory()[0] - before) / args.holds
+    tracemalloc.stop()
+    del event
+
+    event = racing.RacingCarEvent("Benchmark Event", "UAE", "05/09/2025", args.holds)
+    start = time.perf_counter()
+    hold_ids = take_holds(event, args.holds, args.ttl)
+    elapsed = time.perf_counter() - start
+    print("{} holds: {:.1f} us per hold, {:.0f} bytes per active hold".format(
+        args.holds, elapsed / args.holds * 1e6, per_hold))
+
+    confirmed = hold_ids[:int(args.holds * args.confirm)]
+    start = time.perf_counter()
+    for hold_id in confirmed:
+        event.confirm_hold(hold_id, payment_method="Credit Card")
+    if confirmed:
+        print("{} confirmations: {:.1f} us each".format(
+            len(confirmed), (time.perf_counter() - start) / len(confirmed) * 1e6))
+
+    customer = racing.Customer("1", "Waiting", "wait@example.com", "0500000000")
+    served = []
+    for _ in range(args.waitlist):
+        event.join_waitlist(racing.WeekendPackageTicket, racing.weekend_package_ticket_price, customer,
+                            on_hold=served.append)
+
+    # the HoldExpiryTimer releases the holds at their deadline, expire_holds() picks up any it has not reached yet
+    last = event.get_hold(hold_ids[-1])
+    time.sleep(last.get_remaining_time() if last else 0)
+    start = time.perf_counter()
+    expired = event.expire_holds()
+    print("{} holds expired by the timer, {} by expire_holds() in {:.2f} s; {} waitlist entries served".format(
+        args.holds - len(confirmed) - expired, expired, time.perf_counter() - start, len(served)))
+    print("tickets sold {}, active holds {}, free seats {}".format(
+        event.get_total_tickets_sold(), event.get_active_holds(), event.get_seat_map().get_free_seats()))
+
+
+if __name__ == "__main__":
+    main()
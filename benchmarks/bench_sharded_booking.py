@@ -0,0 +1,71 @@
+'''
+Throughput benchmark for sharded booking.
+
+Spreads the same events over ShardedBookingPool instances with a growing
+number of worker processes and books every seat through pipelined batches of
+requests, then reports tickets per second per worker count and checks the
+merged totals. Scaling needs as many free CPU cores as workers.
+
+Usage: python benchmarks/bench_sharded_booking.py [--workers 1 2 4] [--events N]
+           [--capacity N] [--batch N]
+'''
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from racing_event_ticket_booking import Customer, single_race_ticket_price
+from sharded_booking import ShardedBookingPool
+
+
+def run(workers, events, capacity, batch):
+    with ShardedBookingPool(workers) as pool:
+        event_ids = [pool.add_event("Round {}".format(number), "Circuit {}".format(number % 8),
+                                    "05/09/2025", capacity) for number in range(events)]
+        customer = Customer("1", "Benchmark", "bench@example.com", "0500000000")
+        for event_id in event_ids:
+            pool.register_customer(event_id, customer)
+
+        # interleave the events so every batch keeps all shards busy
+        requests = [(event_id, "book", ("1", "SINGLE_RACE")) for _ in range(capacity) for event_id in event_ids]
+        start = time.perf_counter()
+        in_flight = []
+        for first in range(0, len(requests), batch):
+            in_flight.append(pool.submit_many(requests[first:first + batch]))
+            if len(in_flight) > 4:
+                for future in in_flight.pop(0):
+                    future.result()
+        for futures in in_flight:
+            for future in futures:
+                future.result()
+        elapsed = time.perf_counter() - start
+
+        totals = pool.get_totals()
+        assert totals["tickets_sold"] == events * capacity, totals
+        assert totals["total_sales"] == events * capacity * single_race_ticket_price, totals
+        assert totals["events"] == events
+        return len(requests) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--events", type=int, default=16)
+    parser.add_argument("--capacity", type=int, default=5000, help="seats per event")
+    parser.add_argument("--batch", type=int, default=512, help="requests per message to the pool")
+    args = parser.parse_args()
+
+    print("CPU cores: {}".format(os.cpu_count()))
+    print("{:>8}  {:>12}  {:>8}".format("workers", "tickets/s", "scaling"))
+    baseline = None
+    for workers in args.workers:
+        rate = run(workers, args.events, args.capacity, args.batch)
+        baseline = baseline or rate
+        print("{:>8}  {:>12.0f}  {:>7.2f}x".format(workers, rate, rate / baseline))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+'''
+Import-time budget check for racing_event_ticket_booking.
+
+Imports the module in fresh interpreters with `python -X importtime` and fails
+(exit status 1) when the median cumulative import time exceeds the budget,
+when the import touches the working directory, creates an event or other demo
+objects, or pulls in tkinter, NumPy or pickle.
+
+Usage: python benchmarks/check_import_time.py [--budget-ms 25] [--runs 7]
+'''
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULE = "racing_event_ticket_booking"
+FORBIDDEN_MODULES = ("tkinter", "numpy", "pickle")
+FORBIDDEN_GLOBALS = ("event", "policy", "c4", "c5", "c6")
+
+
+def run_python(code, cwd, env, *options):
+    return subprocess.run([sys.executable, *options, "-c", code], cwd=cwd, env=env,
+                          capture_output=True, text=True, check=True)
+
+
+def import_time_us(cwd, env):
+    code = "import sys; sys.path.insert(0, {!r}); import {}".format(ROOT, MODULE)
+    result = run_python(code, cwd, env, "-X", "importtime")
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == MODULE:
+            return int(fields[1])
+    raise RuntimeError("no import time reported for " + MODULE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=25.0, help="allowed cumulative import time")
+    parser.add_argument("--runs", type=int, default=7)
+    args = parser.parse_args()
+
+    failures = []
+    with tempfile.TemporaryDirectory() as cwd, tempfile.TemporaryDirectory() as cache:
+        env = dict(os.environ, PYTHONPYCACHEPREFIX=cache)
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+
+        # the first import compiles the module, later ones measure a cached import
+        code = ("import json, sys; sys.path.insert(0, {!r}); import {} as module; "
+                "print(json.dumps({{'modules': [name for name in {!r} if name in sys.modules], "
+                "'globals': [name for name in {!r} if hasattr(module, name)]}}))"
+                ).format(ROOT, MODULE, FORBIDDEN_MODULES, FORBIDDEN_GLOBALS)
+        report = json.loads(run_python(code, cwd, env).stdout)
+        if report["modules"]:
+            failures.append("import loads {}".format(", ".join(report["modules"])))
+        if report["globals"]:
+            failures.append("import creates {}".format(", ".join(report["globals"])))
+
+        timings = [import_time_us(cwd, env) for _ in range(args.runs)]
+        created = os.listdir(cwd)
+        if created:
+            failures.append("import created {}".format(", ".join(sorted(created))))
+
+    median_ms = statistics.median(timings) / 1000
+    print("{} import: median {:.1f} ms, min {:.1f} ms, budget {:.1f} ms".format(
+        MODULE, median_ms, min(timings) / 1000, args.budget_ms))
+    if median_ms > args.budget_ms:
+        failures.append("import takes {:.1f} ms, over the {:.1f} ms budget".format(median_ms, args.budget_ms))
+
+    for failure in failures:
+        print("FAIL: " + failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+'''
+Multi-threaded stress test and throughput benchmark for booking.
+
+Worker threads sell tickets of one event through RacingCarEvent.sell_ticket
+and book_tickets until it is sold out, while another thread keeps registering
+customers. Afterwards the run is checked for overselling, double-sold seats
+and lost revenue. The thread switch interval is lowered to force contention.
+A customer buying the same ticket id from two events without an id is
+checked to keep both purchases and to be refunded by each event.
+
+Usage: python benchmarks/stress_concurrent_booking.py [--capacity N] [--threads 1 4 16]
+'''
+
+import argparse
+import math
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import racing_event_ticket_booking as racing
+
+
+def run(racing, capacity, thread_count, customers_count, seed):
+    event = racing.RacingCarEvent("Stress Event", "UAE", "05/09/2025", capacity)
+    event.set_discount_policy(racing.DiscountPolicy(10, True))
+    customers = [racing.Customer(str(i), "Customer", "c{}@example.com".format(i), "0500000000")
+                 for i in range(customers_count)]
+    for customer in customers:
+        event.register_customer(customer)
+
+    ticket_classes = [
+        (racing.SingleRaceTicket, 100),
+        (racing.WeekendPackageTicket, 200),
+        (racing.SeasonMembershipTicket, 1000),
+    ]
+    results = [[] for _ in range(thread_count)]
+    start_barrier = threading.Barrier(thread_count + 1)
+    done = threading.Event()
+
+    def sell(worker):
+        generator = random.Random(seed + worker)
+        sold = results[worker]
+        start_barrier.wait()
+        while True:
+            customer = customers[generator.randrange(customers_count)]
+            ticket_class, price = ticket_classes[generator.randrange(len(ticket_classes))]
+            choice = generator.random()
+            if choice < 0.1:
+                tickets = event.book_tickets(ticket_class, price, 5, customer)
+                if tickets:
+                    sold.extend(tickets)
+                    continue
+            elif choice < 0.2:
+                ticket = event.sell_ticket(ticket_class, price, customer,
+                                           seat=generator.randint(1, capacity))
+                if ticket:
+                    sold.append(ticket)
+                continue
+
+            ticket = event.sell_ticket(ticket_class, price, customer)
+            if ticket:
+                sold.append(ticket)
+            elif event.get_seat_map().get_free_seats() == 0:
+                return
+
+    def register():
+        next_id = customers_count
+        while not done.is_set():
+            event.register_customer(racing.Customer(str(next_id), "Late", "late@example.com", "0500000000"))
+            event.register_customer(customers[next_id % customers_count])  # duplicate, rejected
+            next_id += 1
+
+    threads = [threading.Thread(target=sell, args=(worker,)) for worker in range(thread_count)]
+    registrar = threading.Thread(target=register)
+    for thread in threads:
+        thread.start()
+    registrar.start()
+    start_barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    registrar.join()
+
+    sold = [ticket for worker_sold in results for ticket in worker_sold]
+    seats = [ticket.get_seat_number() for ticket in sold]
+    ledger = event.get_ledger()
+    paid = math.fsum(ledger.get_paid_price(index) for index in range(len(ledger)))
+    expected = math.fsum(ticket.get_price() * 0.9 for ticket in sold)
+
+    assert len(sold) == capacity, "sold {} tickets for {} seats".format(len(sold), capacity)
+    assert event.get_total_tickets_sold() == capacity
+    assert len(set(seats)) == capacity and min(seats) == 1 and max(seats) == capacity, "seat sold twice"
+    assert event.get_seat_map().get_free_seats() == 0
+    assert math.isclose(event.get_total_sales(), paid, rel_tol=1e-9), "total sales drifted from the ledger"
+    assert math.isclose(paid, expected, rel_tol=1e-9), "revenue lost"
+    assert event.get_total_customers() >= customers_count
+    return capacity / elapsed
+
+
+def check_events_without_id(racing):
+    customer = racing.Customer("1", "Customer", "c1@example.com", "0500000000")
+    first, second = (racing.RacingCarEvent(name, "UAE", "05/09/2025", 1) for name in ("First", "Second"))
+    tickets = [event.sell_ticket(racing.SingleRaceTicket, racing.single_race_ticket_price, customer)
+               for event in (first, second)]
+    assert tickets[0].get_ticket_id() == tickets[1].get_ticket_id() == 0
+    assert customer.get_purchase_count() == 2, "purchases of two events without an id collided"
+    assert first.cancel_ticket(tickets[0], customer) and second.cancel_ticket(tickets[1], customer)
+    assert customer.get_purchase_count() == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--capacity", type=int, default=50000, help="seats of the event")
+    parser.add_argument("--customers", type=int, default=1000, help="customers registered up front")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    check_events_without_id(racing)
+    sys.setswitchinterval(1e-5)
+    print("{:>8}  {:>14}".format("threads", "tickets/s"))
+    for thread_count in args.threads:
+        rate = run(racing, args.capacity, thread_count, args.customers, args.seed)
+        print("{:>8}  {:>14.0f}".format(thread_count, rate))
+    print("no overselling, no double-sold seats, no lost revenue, no purchases mixed up between events")
+
+
+if __name__ == "__main__":
+    main()
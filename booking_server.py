@@ -0,0 +1,570 @@
+'''
+
+Headless booking server for RacingCarEvent
+
+Speaks a line protocol over TCP: every request is one JSON object on its own
+line and gets exactly one JSON response line, in the order the requests were
+sent. Clients may pipeline as many requests as they like without waiting.
+
+Request:  {"id": 7, "op": "book", "customer_id": "4", "ticket_type": "SINGLE_RACE",
+           "payment_method": "Credit Card", "promo_code": "PITLANE"}
+Response: {"id": 7, "ok": true, "result": {...}}
+          {"id": 7, "ok": false, "error": "Customer not found"}
+
+Operations: register, lookup, book, cancel, history, stats, and hold, confirm
+and release to set seats aside while the customer pays
+
+BookingServer
+
+BookingClient
+
+'''
+
+
+
+import argparse
+import asyncio
+import json
+import signal
+
+import instrumentation
+
+from racing_event_ticket_booking import (DEFAULT_HOLD_TTL, Customer, DiscountPolicy, EventLog, RacingCarEvent,
+                                         PAYMENT_METHOD_CODES, SingleRaceTicket, WeekendPackageTicket,
+                                         SeasonMembershipTicket, get_customer_journal,
+                                         load_customers, single_race_ticket_price,
+                                         weekend_package_ticket_price,
+                                         season_membership_ticket_price)
+
+
+TICKET_TYPES = {
+    "SINGLE_RACE": (SingleRaceTicket, single_race_ticket_price),
+    "WEEKEND_PACKAGE": (WeekendPackageTicket, weekend_package_ticket_price),
+    "SEASON_MEMBERSHIP": (SeasonMembershipTicket, season_membership_ticket_price),
+}
+
+# longest request line in bytes, the default limit of asyncio streams
+MAX_REQUEST_SIZE = 1 << 16
+
+
+class RequestError(Exception):
+    '''
+    Raised by a request handler to send an error response to the client.
+    '''
+
+
+def _get_field(request, name, types, default=None):
+    '''
+    Returns a field of the request, default if it is missing or null.
+    :raises RequestError: if the field is not of one of the given types
+    '''
+    value = request.get(name)
+    if value is None:
+        return default
+    # JSON true and false are not numbers here
+    if not isinstance(value, types) or isinstance(value, bool):
+        raise RequestError("Invalid {}".format(name))
+    return value
+
+
+async def _skip_line(reader, consumed):
+    '''
+    Drops a line longer than the limit of the reader, up to and with its
+    newline or to the end of the stream.
+    :param consumed: bytes of the line in the buffer, from the LimitOverrunError
+    '''
+    while True:
+        await reader.read(consumed)
+        try:
+            await reader.readuntil(b"\n")
+            return
+        except asyncio.IncompleteReadError:
+            return
+        except asyncio.LimitOverrunError as error:
+            consumed = error.consumed
+
+
+def customer_to_dict(customer):
+    return {
+        "id": customer.get_id(),
+        "name": customer.get_name(),
+        "email": customer.get_email(),
+        "phone": customer.get_phone(),
+        "tickets": customer.get_purchase_count(),
+    }
+
+
+def hold_to_dict(hold):
+    return {
+        "hold_id": hold.get_hold_id(),
+        "ticket_type": hold.get_ticket_class().TICKET_TYPE,
+        "seats": list(hold.get_seats()),
+        "expires_in": round(hold.get_remaining_time(), 3),
+    }
+
+
+def ticket_to_dict(ticket):
+    return {
+        "ticket_id": ticket.get_ticket_id(),
+        "ticket_type": ticket.get_ticket_type(),
+        "seat_number": ticket.get_seat_number(),
+        "price": ticket.get_price(),
+        "valid": ticket.is_valid(),
+    }
+
+
+class BookingServer:
+    '''
+    asyncio server exposing register/lookup/book/cancel/history/stats and hold/confirm/release for one event.
+
+    Each connection reads requests as they arrive and starts a task for every
+    one of them, so pipelined requests overlap; the responses are still written
+    back in request order. At most max_concurrency requests run at once over
+    all connections, and a connection stops reading once max_pipeline of its
+    requests are waiting for their response, which pushes back on the client
+    through TCP. A request line longer than max_request_size bytes is answered
+    with an error and skipped. Customer saves go to the journal on a worker
+    thread so that file I/O never blocks the loop. shutdown() stops accepting,
+    lets in-flight requests finish and then flushes the journal.
+
+    Given the EventLog of the event, a request is only answered once its
+    operations are on disk. The waiting happens on worker threads, so the
+    operations of concurrent requests are committed together.
+    '''
+    def __init__(self, event, host="127.0.0.1", port=0, max_concurrency=64, max_pipeline=32,
+                 journal=None, event_log=None, max_request_size=MAX_REQUEST_SIZE):
+        self.__event = event
+        self.__event_log = event_log
+        self.__host = host
+        self.__port = port
+        self.__max_pipeline = max_pipeline
+        self.__max_request_size = max_request_size
+        self.__semaphore = asyncio.Semaphore(max_concurrency)
+        self.__journal = journal if journal is not None else get_customer_journal()
+        self.__server = None
+        self.__connections = set()
+        self.__readers = set()
+        self.__handlers = {
+            "register": self.__register,
+            "lookup": self.__lookup,
+            "book": self.__book,
+            "cancel": self.__cancel,
+            "history": self.__history,
+            "stats": self.__stats,
+            "hold": self.__hold,
+            "confirm": self.__confirm,
+            "release": self.__release,
+        }
+
+    def get_event(self):
+        return self.__event
+
+    def get_port(self):
+        '''
+        Returns the port the server listens on, useful when it was started on port 0.
+        '''
+        return self.__server.sockets[0].getsockname()[1]
+
+    async def start(self):
+        self.__server = await asyncio.start_server(self.__handle_connection, self.__host, self.__port,
+                                                   limit=self.__max_request_size)
+
+    async def serve_forever(self):
+        if self.__server is None:
+            await self.start()
+        try:
+            await self.__server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+
+    async def shutdown(self, timeout=10):
+        '''
+        Stops accepting connections and requests, waits up to `timeout` seconds
+        for in-flight requests to be answered and then flushes the journal.
+        :param timeout:
+        :return:
+        '''
+        if self.__server is not None:
+            self.__server.close()
+        for reading in list(self.__readers):
+            reading.cancel()
+
+        connections = list(self.__connections)
+        if connections:
+            _, pending = await asyncio.wait(connections, timeout=timeout)
+            for task in pending:
+                task.cancel()
+        if self.__server is not None:
+            await self.__server.wait_closed()
+
+        await asyncio.get_running_loop().run_in_executor(None, self.__journal.close)
+
+    async def __handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self.__connections.add(task)
+        responses = asyncio.Queue(self.__max_pipeline)
+        sender = asyncio.create_task(self.__send_responses(responses, writer))
+        reading = asyncio.create_task(self.__read_requests(reader, responses))
+        self.__readers.add(reading)
+        try:
+            # shutdown cancels the reading task only, answered requests still go out
+            await asyncio.wait([reading])
+            self.__readers.discard(reading)
+            await responses.put(None)
+            await sender
+        finally:
+            writer.close()
+            self.__connections.discard(task)
+
+    async def __read_requests(self, reader, responses):
+        try:
+            while True:
+                try:
+                    line = await reader.readuntil(b"\n")
+                except asyncio.IncompleteReadError as error:
+                    # the last request may end without a newline
+                    line = error.partial
+                    if not line:
+                        return
+                except asyncio.LimitOverrunError as error:
+                    # answered without being parsed, the requests behind it are read as usual
+                    await _skip_line(reader, error.consumed)
+                    line = None
+                if line is None:
+                    request = asyncio.get_running_loop().create_future()
+                    request.set_result(self.__encode({
+                        "id": None, "ok": False,
+                        "error": "Request is longer than {} bytes".format(self.__max_request_size)}))
+                else:
+                    request = asyncio.create_task(self.__process(line))
+                # blocks while the pipeline is full, which stops reading from the socket
+                await responses.put(request)
+        except ConnectionError:
+            pass
+
+    async def __send_responses(self, responses, writer):
+        broken = False
+        while True:
+            request = await responses.get()
+            if request is None:
+                return
+            response = await request
+            if broken:
+                continue
+            try:
+                writer.write(response)
+                await writer.drain()
+            except ConnectionError:
+                broken = True
+
+    async def __process(self, line):
+        request_id = None
+        try:
+            request = json.loads(line.decode("utf-8"))
+            if not isinstance(request, dict):
+                raise RequestError("Request must be a JSON object")
+            request_id = request.get("id")
+            op = _get_field(request, "op", str)
+            handler = self.__handlers.get(op)
+            if handler is None:
+                raise RequestError("Unknown operation {}".format(op))
+            async with self.__semaphore:
+                result = await handler(request)
+                await self.__wait_durable()
+            response = {"id": request_id, "ok": True, "result": result}
+        except RequestError as error:
+            response = {"id": request_id, "ok": False, "error": str(error)}
+        except json.JSONDecodeError:
+            response = {"id": None, "ok": False, "error": "Invalid JSON"}
+        except UnicodeDecodeError:
+            response = {"id": None, "ok": False, "error": "Request must be UTF-8"}
+        except Exception as error:
+            # one failing request must not take the connection and the requests pipelined behind it down
+            response = {"id": request_id, "ok": False, "error": "Internal error: {}".format(error)}
+        return self.__encode(response)
+
+    @staticmethod
+    def __encode(response):
+        return (json.dumps(response) + "\n").encode()
+
+    async def __wait_durable(self):
+        event_log = self.__event_log
+        if event_log is None:
+            return
+        seq = event_log.get_last_seq()
+        if event_log.get_durable_seq() < seq:
+            await asyncio.get_running_loop().run_in_executor(None, event_log.wait_durable, seq)
+
+    def __get_customer(self, request):
+        customer = self.__event.get_customer_by_id(str(_get_field(request, "customer_id", (str, int))))
+        if not customer:
+            raise RequestError("Customer not found")
+        return customer
+
+    async def __register(self, request):
+        fields = [_get_field(request, field, (str, int)) for field in ("customer_id", "name", "email", "phone")]
+        if any(field in (None, "") for field in fields):
+            raise RequestError("Missing Information!")
+
+        customer = Customer(*(str(field) for field in fields))
+        if not self.__event.register_customer(customer):
+            raise RequestError("Customer with ID {} already exists.".format(customer.get_id()))
+        await asyncio.get_running_loop().run_in_executor(None, customer.save_to_file, self.__journal)
+        return customer_to_dict(customer)
+
+    async def __history(self, request):
+        customer = self.__get_customer(request)
+        page = _get_field(request, "page", int, 0)
+        page_size = _get_field(request, "page_size", int, 50)
+        if page < 0 or not 0 < page_size <= 500:
+            raise RequestError("Invalid page")
+        return {
+            "total": customer.get_purchase_count(),
+            "tickets": [ticket_to_dict(ticket) for ticket in customer.get_purchase_history_page(page, page_size)],
+        }
+
+    async def __lookup(self, request):
+        if "email" in request:
+            customers = self.__event.get_customers_by_email(_get_field(request, "email", str))
+        elif "phone" in request:
+            customers = self.__event.get_customers_by_phone(_get_field(request, "phone", str))
+        else:
+            customers = [self.__get_customer(request)]
+        return [customer_to_dict(customer) for customer in customers]
+
+    @staticmethod
+    def __get_ticket_type(request):
+        name = _get_field(request, "ticket_type", str)
+        ticket_type = TICKET_TYPES.get(name)
+        if ticket_type is None:
+            raise RequestError("Unknown ticket type {}".format(name))
+        quantity = _get_field(request, "quantity", int, 1)
+        if quantity < 1:
+            raise RequestError("Quantity must be a positive integer")
+        return ticket_type + (quantity,)
+
+    @staticmethod
+    def __get_payment_method(request):
+        payment_method = _get_field(request, "payment_method", str)
+        if payment_method is not None and payment_method not in PAYMENT_METHOD_CODES:
+            raise RequestError("Unknown payment method {}".format(payment_method))
+        return payment_method
+
+    def __get_hold(self, request, customer):
+        hold = self.__event.get_hold(_get_field(request, "hold_id", int))
+        if not hold or hold.get_customer() is not customer:
+            raise RequestError("Hold not found or expired")
+        return hold
+
+    async def __book(self, request):
+        customer = self.__get_customer(request)
+        ticket_class, price, quantity = self.__get_ticket_type(request)
+        payment_method = self.__get_payment_method(request)
+        promo_code = _get_field(request, "promo_code", str)
+
+        try:
+            if quantity == 1:
+                tickets = self.__event.sell_ticket(ticket_class, price, customer, payment_method=payment_method,
+                                                   promo_code=promo_code)
+                tickets = [tickets] if tickets else False
+            else:
+                tickets = self.__event.book_tickets(ticket_class, price, quantity, customer,
+                                                    payment_method=payment_method, promo_code=promo_code)
+        except ValueError as error:
+            raise RequestError(str(error))
+        if not tickets:
+            raise RequestError("Sorry, the event is sold out")
+        return [ticket_to_dict(ticket) for ticket in tickets]
+
+    async def __hold(self, request):
+        customer = self.__get_customer(request)
+        ticket_class, price, quantity = self.__get_ticket_type(request)
+        ttl = _get_field(request, "ttl", (int, float), DEFAULT_HOLD_TTL)
+        if not 0 < ttl <= DEFAULT_HOLD_TTL:
+            raise RequestError("ttl must be a number of seconds up to {}".format(DEFAULT_HOLD_TTL))
+        hold = self.__event.hold_seats(ticket_class, price, quantity, customer, ttl=ttl)
+        if not hold:
+            raise RequestError("Sorry, the event is sold out")
+        return hold_to_dict(hold)
+
+    async def __confirm(self, request):
+        customer = self.__get_customer(request)
+        hold = self.__get_hold(request, customer)
+        payment_method = self.__get_payment_method(request)
+        try:
+            tickets = self.__event.confirm_hold(hold.get_hold_id(), customer, payment_method=payment_method,
+                                                promo_code=_get_field(request, "promo_code", str))
+        except ValueError as error:
+            raise RequestError(str(error))
+        if not tickets:
+            raise RequestError("Hold not found or expired")
+        return [ticket_to_dict(ticket) for ticket in tickets]
+
+    async def __release(self, request):
+        customer = self.__get_customer(request)
+        hold = self.__get_hold(request, customer)
+        if not self.__event.release_hold(hold.get_hold_id()):
+            raise RequestError("Hold not found or expired")
+        return hold_to_dict(hold)
+
+    async def __cancel(self, request):
+        customer = self.__get_customer(request)
+        if "ticket_id" in request:
+            ticket = self.__event.cancel_ticket_by_id(_get_field(request, "ticket_id", int), customer)
+            if ticket:
+                return ticket_to_dict(ticket)
+            raise RequestError("Ticket not found")
+
+        seat = _get_field(request, "seat_number", int)
+        for ticket in customer.get_purchase_history():
+            if ticket.get_seat_number() == seat and self.__event.cancel_ticket(ticket, customer):
+                return ticket_to_dict(ticket)
+        raise RequestError("Ticket not found")
+
+    async def __stats(self, request):
+        event = self.__event
+        policy = event.get_discount_policy()
+        return {
+            "event": event.get_name(),
+            "total_sales": event.get_total_sales(),
+            "tickets_sold": event.get_total_tickets_sold(),
+            "customers": event.get_total_customers(),
+            "free_seats": event.get_seat_map().get_free_seats(),
+            "discount_policy": policy.get_policy_details() if policy else "No discount",
+            "sales": event.get_sales_aggregates().get_summary(),
+        }
+
+
+class BookingClient:
+    '''
+    Client for BookingServer. request() may be called concurrently from many
+    tasks; the requests are pipelined over the one connection.
+    '''
+    def __init__(self):
+        self.__reader = None
+        self.__writer = None
+        self.__pending = {}
+        self.__next_id = 0
+        self.__receiver = None
+
+    async def connect(self, host, port):
+        self.__reader, self.__writer = await asyncio.open_connection(host, port)
+        self.__receiver = asyncio.create_task(self.__receive())
+
+    async def request(self, op, **params):
+        '''
+        Sends one request and waits for its response.
+        :return: the result of the request
+        :raises RequestError: if the server answered with an error
+        '''
+        self.__next_id += 1
+        request_id = self.__next_id
+        future = asyncio.get_running_loop().create_future()
+        self.__pending[request_id] = future
+        params.update(id=request_id, op=op)
+        self.__writer.write((json.dumps(params) + "\n").encode())
+        await self.__writer.drain()
+        response = await future
+        if not response["ok"]:
+            raise RequestError(response["error"])
+        return response["result"]
+
+    async def close(self):
+        self.__writer.close()
+        await self.__writer.wait_closed()
+        await self.__receiver
+
+    async def __receive(self):
+        while True:
+            line = await self.__reader.readline()
+            if not line:
+                break
+            response = json.loads(line)
+            future = self.__pending.pop(response["id"], None)
+            if future is not None and not future.done():
+                future.set_result(response)
+        for future in self.__pending.values():
+            if not future.done():
+                future.set_exception(ConnectionError("Connection closed"))
+        self.__pending.clear()
+
+
+async def serve(event, host, port, **options):
+    '''
+    Runs a BookingServer until SIGINT or SIGTERM, then shuts it down gracefully.
+    '''
+    server = BookingServer(event, host, port, **options)
+    await server.start()
+    print("Serving {} on {}:{}".format(event.get_name(), host, server.get_port()))
+
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signal_number, stop.set)
+        except NotImplementedError:
+            pass
+
+    serving = asyncio.create_task(server.serve_forever())
+    await stop.wait()
+    await server.shutdown()
+    serving.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless booking server for a racing event")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--name", default="Racing Car Event")
+    parser.add_argument("--location", default="UAE")
+    parser.add_argument("--date", default="05/09/2025")
+    parser.add_argument("--capacity", type=int, default=300)
+    parser.add_argument("--discount", type=float, default=10, help="discount percentage, 0 for none")
+    parser.add_argument("--max-concurrency", type=int, default=64)
+    parser.add_argument("--max-pipeline", type=int, default=32)
+    parser.add_argument("--max-request-size", type=int, default=MAX_REQUEST_SIZE,
+                        help="longest request line in bytes, longer ones are answered with an error")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port")
+    parser.add_argument("--metrics-file", help="write Prometheus metrics to this file on shutdown")
+    parser.add_argument("--profile", help="run the sampling profiler and write collapsed stacks to this file")
+    parser.add_argument("--event-log", help="log every operation to this file and recover the event from it "
+                                            "on start, with the snapshot next to it")
+    parser.add_argument("--sync", action="store_true",
+                        help="with --event-log, answer a request only once its operations are on disk")
+    args = parser.parse_args()
+
+    if args.metrics_port is not None or args.metrics_file:
+        instrumentation.enable()
+    if args.metrics_port is not None:
+        instrumentation.start_http_server(args.metrics_port, args.host)
+    if args.profile:
+        instrumentation.start_profiler()
+
+    event_log = None
+    event = False
+    if args.event_log:
+        event_log = EventLog(args.event_log, args.event_log + ".snapshot")
+        event = event_log.recover()
+    if not event:
+        event = RacingCarEvent(args.name, args.location, args.date, args.capacity)
+        event.set_discount_policy(DiscountPolicy(args.discount, args.discount > 0))
+        for customer in load_customers():
+            event.register_customer(customer)
+    if event_log:
+        event_log.attach(event)
+
+    try:
+        asyncio.run(serve(event, args.host, args.port, max_concurrency=args.max_concurrency,
+                          max_pipeline=args.max_pipeline, event_log=event_log if args.sync else None,
+                          max_request_size=args.max_request_size))
+    finally:
+        if event_log:
+            event_log.close()
+        if args.metrics_file:
+            instrumentation.write_metrics_file(args.metrics_file)
+        if args.profile:
+            instrumentation.stop_profiler().write_collapsed(args.profile)
+
+
+if __name__ == "__main__":
+    main()
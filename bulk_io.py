@@ -0,0 +1,433 @@
+'''
+
+Streaming bulk import and export of customers and tickets, in CSV or JSONL
+
+Rows are read and written one at a time through generators and handled in
+chunks, so memory use depends on the chunk size and not on the file size.
+Every chunk is validated, registered in one go and persisted with a single
+flush: one journal write or one SQLite transaction.
+
+ImportReport
+
+import_customers, import_tickets
+
+export_customers, export_saved_customers, export_tickets
+
+'''
+
+
+
+import argparse
+import csv
+import itertools
+import json
+import math
+
+from racing_event_ticket_booking import (Customer, PAYMENT_METHOD_CODES, TICKET_CLASSES,
+                                         TICKET_TYPE_CODES, get_customer_journal)
+
+
+CUSTOMER_FIELDS = ("id", "name", "email", "phone")
+TICKET_FIELDS = ("ticket_id", "ticket_type", "seat_number", "price", "paid", "customer_id",
+                 "payment_method", "valid")
+
+FORMATS = ("csv", "jsonl")
+
+DEFAULT_CHUNK_SIZE = 10000
+
+# rejected rows are counted, only the first ones are kept with their reason
+MAX_REPORTED_ERRORS = 100
+
+# spellings of the valid flag of a ticket row
+FLAG_VALUES = {"1": True, "true": True, "yes": True, "0": False, "false": False, "no": False}
+
+
+class RowError(Exception):
+    '''
+    Raised when a row of an import file is not valid.
+    '''
+
+
+class ImportReport:
+    '''
+    Progress and outcome of an import, passed to the progress callback after
+    every chunk.
+    '''
+    def __init__(self):
+        self.__rows = 0
+        self.__imported = 0
+        self.__rejected = 0
+        self.__chunks = 0
+        self.__errors = []  # (row number, reason)
+
+    def get_rows(self):
+        return self.__rows
+
+    def get_imported(self):
+        return self.__imported
+
+    def get_rejected(self):
+        return self.__rejected
+
+    def get_chunks(self):
+        return self.__chunks
+
+    def get_errors(self):
+        '''
+        Returns the first MAX_REPORTED_ERRORS rejected rows as (row number, reason).
+        '''
+        return list(self.__errors)
+
+    def add_rows(self, count):
+        self.__rows += count
+
+    def add_imported(self, count):
+        self.__imported += count
+
+    def add_chunk(self):
+        self.__chunks += 1
+
+    def reject(self, row_number, reason):
+        self.__rejected += 1
+        if len(self.__errors) < MAX_REPORTED_ERRORS:
+            self.__errors.append((row_number, reason))
+
+    def __str__(self):
+        return "{} rows read, {} imported, {} rejected".format(self.__rows, self.__imported, self.__rejected)
+
+
+def _file_format(path, file_format):
+    if file_format is None:
+        file_format = path.rsplit(".", 1)[-1].lower()
+    if file_format not in FORMATS:
+        raise ValueError("Unknown file format {}, use one of {}".format(file_format, ", ".join(FORMATS)))
+    return file_format
+
+
+def read_rows(path, file_format=None):
+    '''
+    Reads the rows of a CSV file with a header line, or of a JSONL file with
+    one JSON object per line.
+    :param path:
+    :param file_format: "csv" or "jsonl", taken from the file extension if None
+    :return: generator of (row number, dict), the dict is None for a row that cannot be parsed
+    '''
+    file_format = _file_format(path, file_format)
+    with open(path, newline="", encoding="utf-8") as file:
+        if file_format == "csv":
+            for row_number, row in enumerate(csv.DictReader(file), 1):
+                yield row_number, row
+            return
+
+        for row_number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield row_number, row if isinstance(row, dict) else None
+
+
+def write_rows(path, rows, fields, file_format=None):
+    '''
+    Writes rows, given as tuples in the order of `fields`, to a CSV or JSONL file.
+    :return: generator yielding the number of rows written after each row
+    '''
+    file_format = _file_format(path, file_format)
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        if file_format == "csv":
+            writer = csv.writer(file)
+            writer.writerow(fields)
+            write = writer.writerow
+        else:
+            def write(row):
+                file.write(json.dumps(dict(zip(fields, row))) + "\n")
+
+        for count, row in enumerate(rows, 1):
+            write(row)
+            yield count
+
+
+def chunks(iterable, size):
+    '''
+    Splits an iterable into lists of at most `size` items, reading it lazily.
+    '''
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _text(row, field):
+    value = row.get(field)
+    value = value.strip() if isinstance(value, str) else "" if value is None else str(value).strip()
+    if not value:
+        raise RowError("Missing {}".format(field))
+    return value
+
+
+def _number(row, field, convert, default=None):
+    value = row.get(field)
+    if value is None or value == "":
+        if default is None:
+            raise RowError("Missing {}".format(field))
+        return default
+    # JSON true is not a number, and an int field does not round a fraction away
+    if isinstance(value, bool) or (convert is int and isinstance(value, float) and not value.is_integer()):
+        raise RowError("Invalid {} {!r}".format(field, value))
+    try:
+        return convert(value)
+    except (TypeError, ValueError, OverflowError):
+        raise RowError("Invalid {} {!r}".format(field, value)) from None
+
+
+
+
+def _flag(row, field):
+    value = row.get(field)
+    if isinstance(value, bool):
+        return value
+    # a missing column and an empty cell both mean a valid ticket
+    text = "" if value is None else str(value).strip().lower()
+    if not text:
+        return True
+    if text not in FLAG_VALUES:
+        raise RowError("Invalid {} {!r}".format(field, value))
+    return FLAG_VALUES[text]
+
+
+def parse_customer(row):
+    '''
+    Validates a customer row and creates the customer.
+    :raises RowError: if a field is missing
+    '''
+    return Customer(_text(row, "id"), _text(row, "name"), _text(row, "email"), _text(row, "phone"))
+
+
+def parse_ticket(row, event):
+    '''
+    Validates a ticket row against an event.
+    :return: (ticket, paid price, customer or None, payment method or None)
+    :raises RowError: if the row is not valid
+    '''
+    ticket_type = _text(row, "ticket_type")
+    if ticket_type not in TICKET_TYPE_CODES:
+        raise RowError("Unknown ticket type {}".format(ticket_type))
+    seat = _number(row, "seat_number", int)
+    if not 1 <= seat <= event.get_capacity():
+        raise RowError("Seat {} is outside the event".format(seat))
+    price = _number(row, "price", float)
+    paid = _number(row, "paid", float, price)
+    if not (math.isfinite(price) and math.isfinite(paid)):
+        raise RowError("Invalid price")
+    if price < 0 or paid < 0:
+        raise RowError("Negative price")
+
+    customer = None
+    customer_id = row.get("customer_id")
+    if customer_id not in (None, ""):
+        customer = event.get_customer_by_id(str(customer_id))
+        if not customer:
+            raise RowError("Customer {} is not registered".format(customer_id))
+
+    payment_method = row.get("payment_method") or None
+    if payment_method is not None and (not isinstance(payment_method, str)
+                                       or payment_method not in PAYMENT_METHOD_CODES):
+        raise RowError("Unknown payment method {}".format(payment_method))
+
+    ticket = TICKET_CLASSES[TICKET_TYPE_CODES[ticket_type]](price, seat)
+    if not _flag(row, "valid"):
+        ticket.invalidate()
+    return ticket, paid, customer, payment_method
+
+
+def _validate(rows, parse, report):
+    items = []
+    for row_number, row in rows:
+        if row is None:
+            report.reject(row_number, "Row cannot be parsed")
+            continue
+        try:
+            items.append((row_number, parse(row)))
+        except RowError as error:
+            report.reject(row_number, str(error))
+    return items
+
+
+def import_customers(path, event=None, journal=None, storage=None, file_format=None,
+                     chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    '''
+    Imports customers from a CSV or JSONL file with the columns id, name, email, phone.
+
+    Each chunk is validated, registered with the event (if given) in one call
+    and persisted once: to the storage backend if one is given (registering
+    them for the event when the event is stored), otherwise with one write to
+    the customer journal. Customers already registered with the event are rejected.
+    :param path:
+    :param event: optional event to register the customers with
+    :param journal: customer journal, the default one if neither a journal nor a storage is given
+    :param storage: optional storage backend, see storage.py
+    :param file_format: "csv" or "jsonl", taken from the file extension if None
+    :param chunk_size: number of rows handled at a time
+    :param progress: optional callback called with the ImportReport after every chunk
+    :return: the ImportReport
+    '''
+    if journal is None and storage is None:
+        journal = get_customer_journal()
+    report = ImportReport()
+
+    for chunk in chunks(read_rows(path, file_format), chunk_size):
+        report.add_rows(len(chunk))
+        customers = _validate(chunk, parse_customer, report)
+
+        if event is not None:
+            registered = {id(customer) for customer in event.register_customers(
+                customer for _, customer in customers)}
+            for row_number, customer in customers:
+                if id(customer) not in registered:
+                    report.reject(row_number, "Customer with ID {} already exists.".format(customer.get_id()))
+            customers = [(row_number, customer) for row_number, customer in customers
+                         if id(customer) in registered]
+
+        customers = [customer for _, customer in customers]
+        if storage is not None and event is not None and event.get_event_id() is not None:
+            storage.save_registrations(event.get_event_id(), customers)
+        elif storage is not None:
+            storage.save_customers(customers)
+        else:
+            journal.append_many(customers)
+
+        report.add_imported(len(customers))
+        report.add_chunk()
+        if progress is not None:
+            progress(report)
+    return report
+
+
+def import_tickets(path, event, storage=None, file_format=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                   progress=None):
+    '''
+    Imports sold tickets into an event from a CSV or JSONL file with the
+    columns of TICKET_FIELDS (ticket_id is ignored, the ledger assigns it).
+
+    The tickets are recorded as sold earlier: the paid price is taken as given
+    (the price if missing) and a valid ticket takes its seat, which must be
+    free. The customers must already be registered with the event. After
+    every chunk the new tickets are saved in one transaction if a storage
+    backend is given and the event is stored.
+    :param path:
+    :param event:
+    :param storage: optional storage backend, see storage.py
+    :param file_format: "csv" or "jsonl", taken from the file extension if None
+    :param chunk_size: number of rows handled at a time
+    :param progress: optional callback called with the ImportReport after every chunk
+    :return: the ImportReport
+    '''
+    report = ImportReport()
+    seat_map = event.get_seat_map()
+
+    for chunk in chunks(read_rows(path, file_format), chunk_size):
+        report.add_rows(len(chunk))
+        imported = 0
+        for row_number, (ticket, paid, customer, payment_method) in _validate(
+                chunk, lambda row: parse_ticket(row, event), report):
+            if ticket.is_valid() and seat_map.is_seat_taken(ticket.get_seat_number()):
+                report.reject(row_number, "Seat {} is already taken".format(ticket.get_seat_number()))
+                continue
+            if ticket.is_valid() and event.get_sales_aggregates().get_remaining_capacity() < 1:
+                report.reject(row_number, "The event is sold out")
+                continue
+            event.restore_ticket_sale(ticket, paid, customer, payment_method)
+            imported += 1
+
+        if storage is not None and event.get_event_id() is not None:
+            storage.save_new_tickets(event)
+
+        report.add_imported(imported)
+        report.add_chunk()
+        if progress is not None:
+            progress(report)
+    return report
+
+
+def export_customers(customers, path, file_format=None, progress=None, progress_every=DEFAULT_CHUNK_SIZE):
+    '''
+    Writes customers to a CSV or JSONL file with the columns id, name, email, phone.
+    :param customers: iterable of customers, e.g. event.get_registered_customers()
+    :param progress: optional callback called with the number of rows written
+    :return: the number of customers written
+    '''
+    rows = ((customer.get_id(), customer.get_name(), customer.get_email(), customer.get_phone())
+            for customer in customers)
+    return _export(path, rows, CUSTOMER_FIELDS, file_format, progress, progress_every)
+
+
+def export_saved_customers(journal, path, file_format=None, progress=None, progress_every=DEFAULT_CHUNK_SIZE):
+    '''
+    Writes the customers saved in a CustomerJournal to a CSV or JSONL file,
+    streaming the journal records instead of loading the customers.
+    :param progress: optional callback called with the number of rows written
+    :return: the number of customers written
+    '''
+    return _export(path, journal.iter_records(), CUSTOMER_FIELDS, file_format, progress, progress_every)
+
+
+def export_tickets(event, path, file_format=None, progress=None, progress_every=DEFAULT_CHUNK_SIZE):
+    '''
+    Writes every ticket in the ledger of an event, cancelled ones included, to
+    a CSV or JSONL file with the columns of TICKET_FIELDS.
+    :param progress: optional callback called with the number of rows written
+    :return: the number of tickets written
+    '''
+    ledger = event.get_ledger()
+
+    def rows():
+        for index in range(len(ledger)):
+            ticket = ledger.get_ticket(index)
+            yield (index, ticket.get_ticket_type(), ticket.get_seat_number(), ticket.get_price(),
+                   ledger.get_paid_price(index), ledger.get_customer_id(index),
+                   ledger.get_payment_method(index), ticket.is_valid())
+
+    return _export(path, rows(), TICKET_FIELDS, file_format, progress, progress_every)
+
+
+def _export(path, rows, fields, file_format, progress, progress_every):
+    written = 0
+    for written in write_rows(path, rows, fields, file_format):
+        if progress is not None and written % progress_every == 0:
+            progress(written)
+    if progress is not None and written % progress_every:
+        progress(written)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import and export of the saved customers")
+    parser.add_argument("command", choices=("import-customers", "export-customers"))
+    parser.add_argument("path", help="CSV or JSONL file")
+    parser.add_argument("--format", choices=FORMATS, help="file format, taken from the extension by default")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    journal = get_customer_journal()
+    try:
+        if args.command == "import-customers":
+            report = import_customers(args.path, journal=journal, file_format=args.format,
+                                      chunk_size=args.chunk_size,
+                                      progress=lambda report: print(report, flush=True))
+            for row_number, reason in report.get_errors():
+                print("row {}: {}".format(row_number, reason))
+        else:
+            written = export_saved_customers(journal, args.path, file_format=args.format,
+                                             progress=lambda count: print("{} customers written".format(count),
+                                                                          flush=True))
+            print("{} customers exported".format(written))
+    finally:
+        journal.close()
+
+
+if __name__ == "__main__":
+    main()
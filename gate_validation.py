@@ -0,0 +1,378 @@
+'''
+
+Gate scan-in validation for the tickets of an event
+
+Every ticket in the ledger of an event gets a compact gate code of twelve
+characters, e.g. "7KQ2-M9XD-4HBA": a 50-bit serial and a 10-bit checksum of
+it, written in Crockford base 32 so that it reads well on paper and forgives
+O for 0 and I or L for 1. The serial is a keyed hash of the event id and the
+ticket id, so the codes cannot be guessed without the secret of the event and
+are the same every time they are issued from the ledger; nothing but the
+secret has to be kept.
+
+A scan goes through cheapest first:
+
+1. the checksum, which rejects typos and most made-up codes
+2. a Bloom filter of the issued serials, which rejects the rest of the codes
+   that were never issued without touching the index
+3. the index from serial to ticket id, a dict
+4. the ticket in the ledger, which must not have been cancelled
+5. the admission bitmap, one bit per ticket id, tested and set under a lock
+   so a ticket is let in once however many gates scan it at the same time
+
+The bitmap is guarded by striped locks, so gates scanning different tickets
+rarely wait for each other. The admissions are kept in memory only.
+
+BloomFilter
+
+GateValidator
+
+'''
+
+
+
+import argparse
+import hashlib
+import math
+import struct
+import sys
+import threading
+import zlib
+from array import array
+
+import instrumentation
+
+from racing_event_ticket_booking import ColumnarTicketLedger, EventLog
+
+
+# scan results
+ADMITTED = "admitted"
+MALFORMED = "malformed"  # not a gate code, or a checksum that does not match
+UNKNOWN = "unknown"  # a well-formed code never issued for this event
+CANCELLED = "cancelled"
+ALREADY_ADMITTED = "already_admitted"
+
+SERIAL_BITS = 50
+CHECK_BITS = 10
+CODE_LENGTH = 12
+
+DEFAULT_FALSE_POSITIVE_RATE = 0.01
+
+DEFAULT_STRIPES = 64
+
+CROCKFORD_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+
+# characters a typed code may hold, the look-alike letters included
+_CODE_CHARACTERS = frozenset(CROCKFORD_ALPHABET + "OIL")
+
+# Crockford base 32 to the digits int(text, 32) reads, with the look-alike letters read as digits
+_FROM_CROCKFORD = str.maketrans(dict(zip(CROCKFORD_ALPHABET + "OIL", "0123456789ABCDEFGHIJKLMNOPQRSTUV" + "011")))
+
+_SERIAL_MASK = (1 << SERIAL_BITS) - 1
+_CHECK_MASK = (1 << CHECK_BITS) - 1
+_MASK_64 = (1 << 64) - 1
+
+
+def _checksum(serial):
+    return zlib.crc32(serial.to_bytes(7, "big")) & _CHECK_MASK
+
+
+def format_code(serial):
+    '''
+    :param serial: serial of a ticket, SERIAL_BITS bits
+    :return: the gate code of the serial, e.g. "7KQ2-M9XD-4HBA"
+    '''
+    value = serial << CHECK_BITS | _checksum(serial)
+    digits = []
+    for _ in range(CODE_LENGTH):
+        digits.append(CROCKFORD_ALPHABET[value & 31])
+        value >>= 5
+    text = "".join(reversed(digits))
+    return "{}-{}-{}".format(text[:4], text[4:8], text[8:])
+
+
+def parse_code(code):
+    '''
+    Reads a gate code as typed or scanned: case, dashes and spaces do not matter.
+    :return: the serial of the code, otherwise None if it is not a gate code
+             or its checksum does not match
+    '''
+    text = code.replace("-", "").replace(" ", "").upper()
+    # int() also reads U and other digits that are not Crockford's
+    if len(text) != CODE_LENGTH or not _CODE_CHARACTERS.issuperset(text):
+        return None
+    value = int(text.translate(_FROM_CROCKFORD), 32)
+    serial = value >> CHECK_BITS
+    if value & _CHECK_MASK != _checksum(serial):
+        return None
+    return serial
+
+
+class BloomFilter:
+    '''
+    Bloom filter of integer keys, sized for a number of keys and a false
+    positive rate. The bit positions are drawn from the key by double hashing
+    a 64-bit mix of it.
+    '''
+    def __init__(self, capacity, false_positive_rate=DEFAULT_FALSE_POSITIVE_RATE):
+        '''
+        :param capacity: number of keys the false positive rate holds for
+        :param false_positive_rate: share of the keys never added that are found anyway
+        '''
+        if not 0 < false_positive_rate < 1:
+            raise ValueError("The false positive rate must be between 0 and 1")
+        capacity = max(1, capacity)
+        self.__capacity = capacity
+        self.__false_positive_rate = false_positive_rate
+        self.__size = max(8, math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2))
+        self.__hashes = max(1, round(self.__size / capacity * math.log(2)))
+        self.__bits = bytearray((self.__size + 7) // 8)
+        self.__count = 0
+
+    def get_capacity(self):
+        return self.__capacity
+
+    def get_false_positive_rate(self):
+        return self.__false_positive_rate
+
+    def get_size(self):
+        '''
+        Returns the number of bits of the filter.
+        '''
+        return self.__size
+
+    def get_hash_count(self):
+        return self.__hashes
+
+    def __len__(self):
+        return self.__count
+
+    def __positions(self, key):
+        mixed = (key * 0x9E3779B97F4A7C15) & _MASK_64
+        first, step = mixed & 0xFFFFFFFF, mixed >> 32 | 1
+        size = self.__size
+        return [(first + index * step) % size for index in range(self.__hashes)]
+
+    def add(self, key):
+        bits = self.__bits
+        for position in self.__positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.__count += 1
+
+    def __contains__(self, key):
+        bits = self.__bits
+        for position in self.__positions(key):
+            if not bits[position >> 3] & 1 << (position & 7):
+                return False
+        return True
+
+
+class GateValidator:
+    '''
+    Issues the gate codes of the tickets of an event and lets them in at the
+    gates, each ticket once. scan() may be called from any number of gate
+    threads at the same time.
+    '''
+    def __init__(self, event, secret, expected_tickets=None, false_positive_rate=DEFAULT_FALSE_POSITIVE_RATE,
+                 stripes=DEFAULT_STRIPES):
+        '''
+        :param event: the RacingCarEvent whose tickets are let in, it must have an id
+        :param secret: bytes the codes are derived from, at most 64; keep them to issue the same codes again
+        :param expected_tickets: number of tickets the Bloom filter is sized for, the capacity of the event
+                                 by default; the filter is rebuilt larger if more are issued
+        :param false_positive_rate: share of the unknown codes the Bloom filter lets through to the index
+        :param stripes: number of locks guarding the admission bitmap
+        '''
+        if not secret or len(secret) > 64:
+            raise ValueError("The secret must be 1 to 64 bytes")
+        if stripes < 1:
+            raise ValueError("At least one lock stripe is needed")
+        # the codes are derived from the event id, events without one would share their codes
+        if event.get_event_id() is None:
+            raise ValueError("The event needs an id to issue gate codes")
+        self.__event = event
+        self.__ledger = event.get_ledger()
+        self.__hasher = hashlib.blake2b(key=secret, digest_size=8)
+        self.__event_number = event.get_event_id()
+        self.__false_positive_rate = false_positive_rate
+        self.__bloom = BloomFilter(expected_tickets or event.get_capacity(), false_positive_rate)
+        self.__index = {}  # serial -> ticket id
+        self.__serials = array("q")  # ticket id -> serial
+        self.__admitted = bytearray()  # one bit per ticket id
+        # Eight tickets share a byte of the bitmap, so the stripe is picked by byte, not by ticket id
+        self.__locks = [threading.Lock() for _ in range(stripes)]
+        self.__admitted_counts = [0] * stripes
+        self.__issue_lock = threading.Lock()
+
+    def get_event(self):
+        return self.__event
+
+    def get_issued_count(self):
+        return len(self.__serials)
+
+    def get_admitted_count(self):
+        return sum(self.__admitted_counts)
+
+    def get_bloom_filter(self):
+        return self.__bloom
+
+    def issue_codes(self):
+        '''
+        Issues the codes of the tickets sold since the last call, in the order
+        of the ledger. Cancelled tickets get a code too, it is refused at the
+        gate.
+        :return: number of codes issued
+        '''
+        with self.__issue_lock:
+            start, stop = len(self.__serials), len(self.__ledger)
+            if start == stop:
+                return 0
+            # the bitmap grows first, a gate may scan a new code as soon as it is in the index
+            self.__admitted.extend(bytes((stop + 7) // 8 - len(self.__admitted)))
+            index = self.__index
+            if stop > self.__bloom.get_capacity():
+                bloom = BloomFilter(max(stop, 2 * self.__bloom.get_capacity()), self.__false_positive_rate)
+                for serial in self.__serials:
+                    bloom.add(serial)
+            else:
+                bloom = self.__bloom
+            pack, hasher = struct.Struct("<qqq").pack, self.__hasher
+            serials = array("q")
+            for ticket_id in range(start, stop):
+                attempt = 0
+                while True:
+                    digest = hasher.copy()
+                    digest.update(pack(self.__event_number, ticket_id, attempt))
+                    serial = int.from_bytes(digest.digest(), "big") & _SERIAL_MASK
+                    # two tickets with the same serial: the later one takes the next attempt
+                    if serial not in index:
+                        break
+                    attempt += 1
+                index[serial] = ticket_id
+                bloom.add(serial)
+                serials.append(serial)
+            self.__serials.extend(serials)
+            self.__bloom = bloom
+            return stop - start
+
+    def get_code(self, ticket):
+        '''
+        :param ticket: a ticket of the ledger of the event
+        :return: its gate code, issuing the codes of the new tickets first if needed
+        '''
+        ticket_id = ticket.get_ticket_id()
+        if ticket_id is None:
+            raise ValueError("The ticket was not sold by this event")
+        if ticket_id >= len(self.__serials):
+            self.issue_codes()
+        return format_code(self.__serials[ticket_id])
+
+    def get_ticket(self, code):
+        '''
+        :return: the ticket of a gate code, otherwise None if it was never issued
+        '''
+        serial = parse_code(code)
+        ticket_id = self.__index.get(serial) if serial is not None else None
+        return None if ticket_id is None else self.__ledger.get_ticket(ticket_id)
+
+    def scan(self, code):
+        '''
+        Validates a gate code and lets its ticket in if it was not let in yet.
+        :param code: the gate code as scanned
+        :return: ADMITTED, otherwise MALFORMED, UNKNOWN, CANCELLED or ALREADY_ADMITTED
+        '''
+        serial = parse_code(code)
+        if serial is None:
+            return MALFORMED
+        if serial not in self.__bloom:
+            return UNKNOWN
+        ticket_id = self.__index.get(serial)
+        if ticket_id is None:
+            return UNKNOWN
+        if not self.__ledger.get_ticket(ticket_id).is_valid():
+            return CANCELLED
+
+        byte, bit = ticket_id >> 3, 1 << (ticket_id & 7)
+        stripe = byte % len(self.__locks)
+        with self.__locks[stripe]:
+            if self.__admitted[byte] & bit:
+                return ALREADY_ADMITTED
+            self.__admitted[byte] |= bit
+            self.__admitted_counts[stripe] += 1
+        return ADMITTED
+
+    def is_admitted(self, ticket):
+        ticket_id = ticket.get_ticket_id()
+        return (ticket_id is not None and ticket_id < len(self.__serials)
+                and bool(self.__admitted[ticket_id >> 3] & 1 << (ticket_id & 7)))
+
+
+def _read_secret(path):
+    with open(path, "rb") as file:
+        return file.read().strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gate codes of the tickets of an event and a scan-in console")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--storage", help="SQLite database saved by storage.SQLiteStorage")
+    source.add_argument("--event-log", help="event log of the app, read with the snapshot next to it")
+    parser.add_argument("--snapshot", help="snapshot of the event log, event.snapshot by default")
+    parser.add_argument("--event-id", type=int,
+                        help="event of the storage, or the id of an event in a log that has none")
+    parser.add_argument("--secret-file", required=True, help="file holding the secret of the gate codes")
+    parser.add_argument("--codes", help="write the ticket ids and their gate codes to this CSV file and exit")
+    args = parser.parse_args()
+
+    if args.event_log:
+        # the app may still be writing the log, so it is read without repairing it
+        event = EventLog(args.event_log, args.snapshot or "event.snapshot").recover(repair=False)
+        if not event:
+            parser.error("No event saved in {}".format(args.event_log))
+        if event.get_event_id() is None:
+            if args.event_id is None:
+                parser.error("The event in {} has no id, give it one with --event-id".format(args.event_log))
+            event.set_event_id(args.event_id)
+    else:
+        from storage import SQLiteStorage
+
+        if args.event_id is None:
+            parser.error("--event-id is needed with --storage")
+        storage = SQLiteStorage(args.storage)
+        try:
+            event = storage.load_event(args.event_id, ledger=ColumnarTicketLedger())
+        finally:
+            storage.close()
+        if not event:
+            parser.error("No event {} in {}".format(args.event_id, args.storage))
+
+    validator = GateValidator(event, _read_secret(args.secret_file))
+    issued = validator.issue_codes()
+    if args.codes:
+        import csv
+
+        with open(args.codes, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(("ticket_id", "ticket_type", "seat", "code"))
+            ledger = event.get_ledger()
+            written = 0
+            for ticket_id in range(issued):
+                ticket = ledger.get_ticket(ticket_id)
+                if ticket.is_valid():
+                    writer.writerow((ticket_id, ticket.get_ticket_type(), ticket.get_seat_number(),
+                                     validator.get_code(ticket)))
+                    written += 1
+        print("gate codes of {} tickets written to {}".format(written, args.codes))
+        return
+
+    print("{} tickets, scan or type a gate code per line".format(issued))
+    for line in sys.stdin:
+        if line.strip():
+            print(validator.scan(line.strip()), flush=True)
+
+
+instrumentation.instrument(GateValidator, "scan", "gate_scan", "scanning a ticket in at the gate")
+
+
+if __name__ == "__main__":
+    main()
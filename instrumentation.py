@@ -0,0 +1,442 @@
+'''
+
+Instrumentation of the booking hot paths
+
+Counters and latency histograms for booking, customer lookup, registration,
+persistence and discount evaluation, exported in the Prometheus text format
+to a file or over HTTP, and a sampling profiler that can be switched on at
+runtime.
+
+Instrumentation is off by default and then costs nothing: the hot paths are
+registered with instrument() but stay the plain methods. enable() replaces
+each registered method on its class with a timed wrapper and disable() puts
+the original back.
+
+Counter, Histogram, MetricsRegistry
+
+SamplingProfiler
+
+'''
+
+
+
+import bisect
+import collections
+import os
+import sys
+import threading
+import time
+
+
+# latency buckets in seconds, from 1 microsecond to 1 second
+DEFAULT_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+                   1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 0.1, 1.0)
+
+METRIC_PREFIX = "racing_"
+
+# Observations are appended to a deque, which is atomic under the GIL and
+# needs no lock, and folded into the totals in batches of this size or when
+# the metrics are read.
+FOLD_SIZE = 4096
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    '''
+    Monotonic counter, optionally split by the value of one label.
+    '''
+    def __init__(self, name, help, label=None):
+        self.__name = name
+        self.__help = help
+        self.__label = label
+        self.__values = {}
+        self.__pending = collections.deque()  # label values of increments by one
+        self.__lock = threading.Lock()
+
+    def get_name(self):
+        return self.__name
+
+    def inc(self, label_value=None, amount=1):
+        if amount == 1:
+            self.__pending.append(label_value)
+            if len(self.__pending) >= FOLD_SIZE:
+                self.__fold()
+            return
+        with self.__lock:
+            self.__values[label_value] = self.__values.get(label_value, 0) + amount
+
+    def get(self, label_value=None):
+        self.__fold()
+        return self.__values.get(label_value, 0)
+
+    def render(self):
+        lines = ["# HELP {} {}".format(self.__name, self.__help), "# TYPE {} counter".format(self.__name)]
+        self.__fold()
+        with self.__lock:
+            values = sorted(self.__values.items(), key=lambda item: str(item[0]))
+        for label_value, value in values:
+            labels = '{{{}="{}"}}'.format(self.__label, label_value) if self.__label else ""
+            lines.append("{}{} {}".format(self.__name, labels, _format_value(value)))
+        return lines
+
+    def __fold(self):
+        with self.__lock:
+            pop = self.__pending.popleft
+            values = self.__values
+            for _ in range(len(self.__pending)):
+                label_value = pop()
+                values[label_value] = values.get(label_value, 0) + 1
+
+
+class Histogram:
+    '''
+    Latency histogram with fixed buckets. observe() only appends to a buffer,
+    the bucket of each observation is found when the buffer is folded.
+    '''
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        self.__name = name
+        self.__help = help
+        self.__bounds = list(buckets)
+        self.__counts = [0] * (len(self.__bounds) + 1)  # the last one is +Inf
+        self.__sum = 0.0
+        self.__count = 0
+        self.__pending = collections.deque()
+        self.__lock = threading.Lock()
+
+    def get_name(self):
+        return self.__name
+
+    def get_count(self):
+        self.__fold()
+        return self.__count
+
+    def get_sum(self):
+        self.__fold()
+        return self.__sum
+
+    def observe(self, seconds):
+        self.__pending.append(seconds)
+        if len(self.__pending) >= FOLD_SIZE:
+            self.__fold()
+
+    def render(self):
+        self.__fold()
+        with self.__lock:
+            counts = list(self.__counts)
+            total, count = self.__sum, self.__count
+        lines = ["# HELP {} {}".format(self.__name, self.__help), "# TYPE {} histogram".format(self.__name)]
+        cumulative = 0
+        for bound, bucket_count in zip(self.__bounds + [float("inf")], counts):
+            cumulative += bucket_count
+            lines.append('{}_bucket{{le="{}"}} {}'.format(self.__name, _format_value(bound), cumulative))
+        lines.append("{}_sum {}".format(self.__name, repr(total)))
+        lines.append("{}_count {}".format(self.__name, count))
+        return lines
+
+    def __fold(self):
+        with self.__lock:
+            pop = self.__pending.popleft
+            bounds, counts = self.__bounds, self.__counts
+            folded = len(self.__pending)
+            total = 0.0
+            for _ in range(folded):
+                seconds = pop()
+                counts[bisect.bisect_left(bounds, seconds)] += 1
+                total += seconds
+            self.__sum += total
+            self.__count += folded
+
+
+class MetricsRegistry:
+    '''
+    The metrics of the process and the instrumented methods.
+
+    Every instrumented method gets a histogram `racing_<name>_seconds` of its
+    latency and a counter `racing_<name>_total` of its calls by outcome: "ok",
+    "rejected" when it returned False, "error" when it raised.
+    '''
+    def __init__(self):
+        self.__metrics = {}
+        self.__points = []  # (owner, attribute, name, description)
+        self.__originals = {}  # (owner, attribute) -> original function
+        self.__enabled = False
+        self.__lock = threading.RLock()
+
+    def is_enabled(self):
+        return self.__enabled
+
+    def counter(self, name, help, label=None):
+        '''
+        Returns the counter with the given name, creating it on first use.
+        '''
+        with self.__lock:
+            if name not in self.__metrics:
+                self.__metrics[name] = Counter(name, help, label)
+            return self.__metrics[name]
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        '''
+        Returns the histogram with the given name, creating it on first use.
+        '''
+        with self.__lock:
+            if name not in self.__metrics:
+                self.__metrics[name] = Histogram(name, help, buckets)
+            return self.__metrics[name]
+
+    def get_metric(self, name):
+        return self.__metrics.get(name, False)
+
+    def instrument(self, owner, attribute, name, description):
+        '''
+        Registers a method to be timed while instrumentation is enabled.
+        Several methods may share a name, e.g. overrides in subclasses.
+        :param owner: class defining the method
+        :param attribute: name of the method
+        :param name: metric name without prefix and suffix, e.g. "booking"
+        :param description: what the method does, used in the metric help
+        :return:
+        '''
+        with self.__lock:
+            self.__points.append((owner, attribute, name, description))
+            if self.__enabled:
+                self.__wrap(owner, attribute, name, description)
+
+    def enable(self):
+        with self.__lock:
+            if self.__enabled:
+                return
+            for point in self.__points:
+                self.__wrap(*point)
+            self.__enabled = True
+
+    def disable(self):
+        with self.__lock:
+            for (owner, attribute), function in self.__originals.items():
+                setattr(owner, attribute, function)
+            self.__originals.clear()
+            self.__enabled = False
+
+    def render(self):
+        '''
+        Returns every metric in the Prometheus text exposition format.
+        '''
+        with self.__lock:
+            metrics = sorted(self.__metrics.values(), key=lambda metric: metric.get_name())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def write_file(self, path):
+        '''
+        Writes the metrics to a file, e.g. for the textfile collector of the
+        node exporter. The file is replaced atomically so it is never read half written.
+        :param path:
+        :return:
+        '''
+        temporary = "{}.{}.tmp".format(path, os.getpid())
+        with open(temporary, "w") as file:
+            file.write(self.render())
+        os.replace(temporary, path)
+
+    def __wrap(self, owner, attribute, name, description):
+        function = owner.__dict__[attribute]
+        histogram = self.histogram("{}{}_seconds".format(METRIC_PREFIX, name),
+                                   "Latency of {} in seconds".format(description))
+        calls = self.counter("{}{}_total".format(METRIC_PREFIX, name),
+                             "Calls of {} by outcome".format(description), label="outcome")
+        clock = time.perf_counter
+        observe = histogram.observe
+
+        def timed(*args, **kwargs):
+            start = clock()
+            try:
+                result = function(*args, **kwargs)
+            except BaseException:
+                observe(clock() - start)
+                calls.inc("error")
+                raise
+            observe(clock() - start)
+            calls.inc("rejected" if result is False else "ok")
+            return result
+
+        timed.__name__ = function.__name__
+        timed.__qualname__ = function.__qualname__
+        timed.__doc__ = function.__doc__
+        timed.__wrapped__ = function
+        self.__originals[owner, attribute] = function
+        setattr(owner, attribute, timed)
+
+
+def start_http_server(port, host="127.0.0.1", registry=None):
+    '''
+    Serves the metrics at http://host:port/metrics from a daemon thread.
+    :return: the HTTP server, call shutdown() on it to stop serving
+    '''
+    import http.server
+
+    registry = registry or REGISTRY
+
+    class MetricsHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+class SamplingProfiler:
+    '''
+    Statistical profiler that samples the stacks of all other threads every
+    `interval` seconds from a background thread. The program runs unmodified
+    between samples, so the overhead is set by the interval. Samples are
+    aggregated as collapsed stacks, the input format of flame graph tools.
+    '''
+    def __init__(self, interval=0.005, max_depth=64):
+        self.__interval = interval
+        self.__max_depth = max_depth
+        self.__stacks = {}  # "outer;...;inner" -> samples
+        self.__samples = 0
+        self.__thread = None
+        self.__stop = threading.Event()
+        self.__lock = threading.Lock()
+
+    def is_running(self):
+        return self.__thread is not None
+
+    def get_samples(self):
+        return self.__samples
+
+    def start(self):
+        with self.__lock:
+            if self.__thread is not None:
+                return
+            self.__stop.clear()
+            self.__thread = threading.Thread(target=self.__run, name="sampling-profiler", daemon=True)
+            self.__thread.start()
+
+    def stop(self):
+        with self.__lock:
+            thread, self.__thread = self.__thread, None
+        if thread is not None:
+            self.__stop.set()
+            thread.join()
+
+    def reset(self):
+        with self.__lock:
+            self.__stacks = {}
+            self.__samples = 0
+
+    def get_top(self, count=20):
+        '''
+        Returns the functions most often on top of the sampled stacks.
+        :return: list of (function, samples)
+        '''
+        leaves = {}
+        with self.__lock:
+            for stack, samples in self.__stacks.items():
+                leaf = stack.rsplit(";", 1)[-1]
+                leaves[leaf] = leaves.get(leaf, 0) + samples
+        return sorted(leaves.items(), key=lambda item: item[1], reverse=True)[:count]
+
+    def write_collapsed(self, path):
+        '''
+        Writes the samples as collapsed stacks, one "frame;frame;frame count" per line.
+        '''
+        with self.__lock:
+            stacks = sorted(self.__stacks.items())
+        with open(path, "w") as file:
+            for stack, samples in stacks:
+                file.write("{} {}\n".format(stack, samples))
+
+    def __run(self):
+        own = threading.get_ident()
+        while not self.__stop.wait(self.__interval):
+            frames = sys._current_frames()
+            with self.__lock:
+                for thread_id, frame in frames.items():
+                    if thread_id == own:
+                        continue
+                    stack = []
+                    while frame is not None and len(stack) < self.__max_depth:
+                        code = frame.f_code
+                        stack.append("{}:{}".format(os.path.basename(code.co_filename), code.co_name))
+                        frame = frame.f_back
+                    key = ";".join(reversed(stack))
+                    self.__stacks[key] = self.__stacks.get(key, 0) + 1
+                self.__samples += 1
+
+
+REGISTRY = MetricsRegistry()
+
+_profiler = None
+
+
+def instrument(owner, attribute, name, description):
+    REGISTRY.instrument(owner, attribute, name, description)
+
+
+def enable():
+    '''
+    Starts timing the instrumented methods.
+    '''
+    REGISTRY.enable()
+
+
+def disable():
+    '''
+    Stops timing, the instrumented methods are the plain methods again.
+    '''
+    REGISTRY.disable()
+
+
+def is_enabled():
+    return REGISTRY.is_enabled()
+
+
+def render():
+    return REGISTRY.render()
+
+
+def write_metrics_file(path):
+    REGISTRY.write_file(path)
+
+
+def start_profiler(interval=0.005):
+    '''
+    Starts the sampling profiler of the process, creating it on first use.
+    :return: the SamplingProfiler
+    '''
+    global _profiler
+    if _profiler is None:
+        _profiler = SamplingProfiler(interval)
+    _profiler.start()
+    return _profiler
+
+
+def stop_profiler():
+    '''
+    Stops the sampling profiler.
+    :return: the SamplingProfiler with its samples, None if it was never started
+    '''
+    if _profiler is not None:
+        _profiler.stop()
+    return _profiler
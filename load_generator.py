@@ -0,0 +1,447 @@
+'''
+
+Flash-sale load generator for the booking core
+
+Creates an event with synthetic customers and replays a traffic profile
+against it in-process: bookings arrive open-loop at a given rate (Poisson
+arrivals), with a mix of ticket types and quantities, a share of the
+arrivals cancels a ticket sold earlier, and the discount can be switched on
+or off at given times during the sale. Every request is timed from the
+moment it was due to arrive rather than from when it started, so a booking
+core that falls behind shows up in the latencies instead of slowing the
+arrivals down.
+
+The schedule depends only on the seed. With one worker the outcome of every
+request is the same from run to run; only the timings change.
+
+The report holds the throughput, the p50/p99/p999 latency of each
+operation, what happened once the event sold out, a timeline per second and
+the sales figures, and can be written as JSON.
+
+LatencyRecorder
+
+TrafficProfile
+
+LoadGenerator
+
+'''
+
+
+
+import argparse
+import json
+import math
+import platform
+import random
+import threading
+import time
+from array import array
+
+from racing_event_ticket_booking import (ColumnarTicketLedger, Customer, DiscountPolicy, PAYMENT_METHOD_CODES,
+                                         RacingCarEvent, SeasonMembershipTicket, SingleRaceTicket,
+                                         WeekendPackageTicket, season_membership_ticket_price,
+                                         single_race_ticket_price, weekend_package_ticket_price)
+
+
+TICKET_TYPES = {
+    "SINGLE_RACE": (SingleRaceTicket, single_race_ticket_price),
+    "WEEKEND_PACKAGE": (WeekendPackageTicket, weekend_package_ticket_price),
+    "SEASON_MEMBERSHIP": (SeasonMembershipTicket, season_membership_ticket_price),
+}
+
+DEFAULT_TICKET_MIX = {"SINGLE_RACE": 0.7, "WEEKEND_PACKAGE": 0.25, "SEASON_MEMBERSHIP": 0.05}
+
+# tickets per booking and their weights
+DEFAULT_QUANTITIES = {1: 0.8, 2: 0.15, 4: 0.05}
+
+PERCENTILES = (50, 99, 99.9)
+
+
+def _percentile(sorted_values, pct):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+
+class LatencyRecorder:
+    '''
+    Latencies of the requests, per operation, kept as integer nanoseconds in
+    typed arrays so that millions of requests stay cheap to record.
+    '''
+    def __init__(self):
+        self.__latencies = {}  # operation -> array of ns
+        self.__lock = threading.Lock()
+
+    def record(self, operation, latency_ns):
+        latencies = self.__latencies.get(operation)
+        if latencies is None:
+            with self.__lock:
+                latencies = self.__latencies.setdefault(operation, array("q"))
+        latencies.append(latency_ns)
+
+    def get_count(self, operation=None):
+        if operation is None:
+            return sum(len(latencies) for latencies in self.__latencies.values())
+        return len(self.__latencies.get(operation, ()))
+
+    def get_summary(self):
+        '''
+        Returns {operation: {count, mean_us, p50_us, p99_us, p99.9_us, max_us}},
+        with "all" for every request together.
+        '''
+        summary = {}
+        every = array("q")
+        for operation, latencies in sorted(self.__latencies.items()):
+            every.extend(latencies)
+            summary[operation] = self.__summarize(latencies)
+        if every:
+            summary["all"] = self.__summarize(every)
+        return summary
+
+    @staticmethod
+    def __summarize(latencies):
+        ordered = sorted(latencies)
+        summary = {"count": len(ordered), "mean_us": sum(ordered) / len(ordered) / 1000}
+        for pct in PERCENTILES:
+            summary["p{:g}_us".format(pct)] = _percentile(ordered, pct) / 1000
+        summary["max_us"] = ordered[-1] / 1000
+        return summary
+
+
+class TrafficProfile:
+    '''
+    What the load generator sends: the arrival rate and duration, the ticket
+    types and quantities booked, the share of cancellations and the times the
+    discount is switched.
+    '''
+    def __init__(self, rate=2000.0, duration=10.0, ticket_mix=None, quantities=None, cancel_rate=0.05,
+                 discount_toggles=()):
+        '''
+        :param rate: mean number of arrivals per second
+        :param duration: seconds of traffic
+        :param ticket_mix: {ticket type: weight}, DEFAULT_TICKET_MIX if None
+        :param quantities: {tickets per booking: weight}, DEFAULT_QUANTITIES if None
+        :param cancel_rate: share of the arrivals that cancel a ticket sold earlier
+        :param discount_toggles: list of (seconds into the sale, True to switch the discount on)
+        '''
+        ticket_mix = dict(ticket_mix or DEFAULT_TICKET_MIX)
+        quantities = dict(quantities or DEFAULT_QUANTITIES)
+        if rate <= 0 or duration <= 0:
+            raise ValueError("The rate and the duration must be positive")
+        if any(ticket_type not in TICKET_TYPES for ticket_type in ticket_mix):
+            raise ValueError("Unknown ticket type in {}".format(", ".join(ticket_mix)))
+        if not 0 <= cancel_rate < 1:
+            raise ValueError("The cancellation rate must be between 0 and 1")
+        self.__rate = rate
+        self.__duration = duration
+        self.__ticket_mix = ticket_mix
+        self.__quantities = quantities
+        self.__cancel_rate = cancel_rate
+        self.__discount_toggles = sorted(discount_toggles)
+
+    def get_rate(self):
+        return self.__rate
+
+    def get_duration(self):
+        return self.__duration
+
+    def get_ticket_mix(self):
+        return dict(self.__ticket_mix)
+
+    def get_quantities(self):
+        return dict(self.__quantities)
+
+    def get_cancel_rate(self):
+        return self.__cancel_rate
+
+    def get_discount_toggles(self):
+        return list(self.__discount_toggles)
+
+    def to_dict(self):
+        return {
+            "rate": self.__rate,
+            "duration": self.__duration,
+            "ticket_mix": self.__ticket_mix,
+            "quantities": {str(quantity): weight for quantity, weight in self.__quantities.items()},
+            "cancel_rate": self.__cancel_rate,
+            "discount_toggles": [[at, "on" if active else "off"] for at, active in self.__discount_toggles],
+        }
+
+    def build_schedule(self, customers, seed):
+        '''
+        Draws the arrivals of the sale from the seed.
+        :param customers: number of customers the bookings are spread over
+        :return: list of (seconds into the sale, operation, args) sorted by time
+        '''
+        rng = random.Random(seed)
+        ticket_types = list(self.__ticket_mix)
+        type_weights = [self.__ticket_mix[ticket_type] for ticket_type in ticket_types]
+        quantities = list(self.__quantities)
+        quantity_weights = [self.__quantities[quantity] for quantity in quantities]
+        payment_methods = list(PAYMENT_METHOD_CODES)
+
+        schedule = [(at, "discount", (active,)) for at, active in self.__discount_toggles if at < self.__duration]
+        at = rng.expovariate(self.__rate)
+        while at < self.__duration:
+            if rng.random() < self.__cancel_rate:
+                # the ticket is picked among those sold by then, at this relative position
+                schedule.append((at, "cancel", (rng.random(),)))
+            else:
+                schedule.append((at, "book", (rng.randrange(customers),
+                                              rng.choices(ticket_types, type_weights)[0],
+                                              rng.choices(quantities, quantity_weights)[0],
+                                              rng.choice(payment_methods))))
+            at += rng.expovariate(self.__rate)
+        schedule.sort(key=lambda arrival: arrival[0])
+        return schedule
+
+
+class LoadGenerator:
+    '''
+    Runs a TrafficProfile against a new event and reports how it coped.
+
+    A dispatcher thread releases every arrival at its time. With one worker
+    the requests run one after the other on the dispatcher, otherwise on a
+    pool of worker threads.
+    '''
+    def __init__(self, profile, customers=10000, capacity=20000, seed=1, workers=1, ledger="list",
+                 discount_pct=10, discount_active=False):
+        '''
+        :param profile: the TrafficProfile
+        :param customers: number of synthetic customers registered before the sale
+        :param capacity: seats of the event
+        :param workers: threads running the requests
+        :param ledger: "list" or "columnar", see ColumnarTicketLedger
+        :param discount_pct: percentage of the discount policy
+        :param discount_active: whether the discount is on when the sale opens
+        '''
+        if workers < 1:
+            raise ValueError("At least one worker is needed")
+        self.__profile = profile
+        self.__seed = seed
+        self.__workers = workers
+        self.__ledger = ledger
+        self.__event = RacingCarEvent("Flash Sale", "UAE", "05/09/2025", capacity,
+                                      ledger=ColumnarTicketLedger() if ledger == "columnar" else None)
+        self.__policy = DiscountPolicy(discount_pct, discount_active)
+        self.__event.set_discount_policy(self.__policy)
+        self.__customers = [Customer("c{}".format(number), "Customer {}".format(number),
+                                     "customer{}@example.com".format(number), "05{:08d}".format(number))
+                            for number in range(customers)]
+        self.__event.register_customers(self.__customers)
+        self.__schedule = profile.build_schedule(customers, seed)
+
+        self.__recorder = LatencyRecorder()
+        self.__sold = []  # (ticket, customer) of the tickets sold, cancelled ones included
+        self.__outcomes = dict.fromkeys(("booked", "tickets_booked", "sold_out", "cancelled", "nothing_to_cancel",
+                                         "discount_toggles", "errors"), 0)
+        self.__timeline = []  # per second: [booked, sold out, cancelled]
+        self.__first_sold_out = None  # (seconds into the sale, tickets sold then)
+        self.__booked_after_sold_out = 0
+        self.__lock = threading.Lock()
+
+    def get_event(self):
+        return self.__event
+
+    def get_schedule(self):
+        return list(self.__schedule)
+
+    def run(self):
+        '''
+        Replays the schedule in real time.
+        :return: the report, see write_report
+        '''
+        duration = self.__profile.get_duration()
+        self.__timeline = [[0, 0, 0] for _ in range(max(1, math.ceil(duration)))]
+        executor = None
+        if self.__workers > 1:
+            from concurrent.futures import ThreadPoolExecutor
+
+            executor = ThreadPoolExecutor(max_workers=self.__workers, thread_name_prefix="load-generator")
+
+        clock = time.perf_counter_ns
+        max_lag = 0
+        start = clock()
+        try:
+            for at, operation, args in self.__schedule:
+                due = start + int(at * 1e9)
+                lag = clock() - due
+                if lag < 0:
+                    time.sleep(-lag / 1e9)
+                else:
+                    max_lag = max(max_lag, lag)
+                if executor is None:
+                    self.__run_request(due, start, operation, args)
+                else:
+                    executor.submit(self.__run_request, due, start, operation, args)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+        elapsed = (clock() - start) / 1e9
+        return self.__report(elapsed, max_lag / 1e9)
+
+    def __run_request(self, due, start, operation, args):
+        try:
+            outcome = getattr(self, "_LoadGenerator__" + operation)(*args)
+        except Exception:
+            outcome = "errors"
+        finished = time.perf_counter_ns()
+        self.__recorder.record(operation, finished - due)
+        with self.__lock:
+            self.__outcomes[outcome] += 1
+            second = min(len(self.__timeline) - 1, (due - start) // 1000000000)
+            if outcome == "booked":
+                self.__timeline[second][0] += 1
+            elif outcome == "sold_out":
+                self.__timeline[second][1] += 1
+                if self.__first_sold_out is None:
+                    self.__first_sold_out = ((due - start) / 1e9, self.__get_seats_sold())
+            elif outcome == "cancelled":
+                self.__timeline[second][2] += 1
+
+    def __get_seats_sold(self):
+        return self.__event.get_capacity() - self.__event.get_seat_map().get_free_seats()
+
+    def __book(self, customer_number, ticket_type, quantity, payment_method):
+        event = self.__event
+        customer = self.__customers[customer_number]
+        ticket_class, price = TICKET_TYPES[ticket_type]
+        if quantity == 1:
+            ticket = event.sell_ticket(ticket_class, price, customer, payment_method=payment_method)
+            tickets = [ticket] if ticket else False
+        else:
+            tickets = event.book_tickets(ticket_class, price, quantity, customer, payment_method=payment_method)
+        if not tickets:
+            return "sold_out"
+        with self.__lock:
+            self.__sold.extend((ticket, customer) for ticket in tickets)
+            self.__outcomes["tickets_booked"] += len(tickets)
+            if self.__first_sold_out is not None:
+                self.__booked_after_sold_out += 1
+        return "booked"
+
+    def __cancel(self, position):
+        with self.__lock:
+            if not self.__sold:
+                return "nothing_to_cancel"
+            ticket, customer = self.__sold[int(position * len(self.__sold))]
+        if not self.__event.cancel_ticket(ticket, customer):
+            # picked a ticket that was cancelled already
+            return "nothing_to_cancel"
+        return "cancelled"
+
+    def __discount(self, active):
+        if active:
+            self.__policy.enable_discount()
+        else:
+            self.__policy.disable_discount()
+        return "discount_toggles"
+
+    def __report(self, elapsed, max_lag):
+        event = self.__event
+        completed = self.__recorder.get_count()
+        capacity = event.get_capacity()
+        first_sold_out = self.__first_sold_out
+        return {
+            "meta": {
+                "seed": self.__seed,
+                "workers": self.__workers,
+                "ledger": self.__ledger,
+                "customers": len(self.__customers),
+                "python": platform.python_version(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            },
+            "profile": self.__profile.to_dict(),
+            "throughput": {
+                "arrivals": len(self.__schedule),
+                "completed": completed,
+                "elapsed_s": elapsed,
+                "requests_per_s": completed / elapsed if elapsed else 0.0,
+                "offered_per_s": self.__profile.get_rate(),
+                # how far behind its schedule the dispatcher got, 0 if it kept up
+                "max_dispatch_lag_s": max_lag,
+            },
+            "latency": self.__recorder.get_summary(),
+            "outcomes": dict(self.__outcomes),
+            "capacity": {
+                "capacity": capacity,
+                "tickets_sold": self.__get_seats_sold(),
+                "free_seats": event.get_seat_map().get_free_seats(),
+                "sold_out_at_s": first_sold_out[0] if first_sold_out else None,
+                "tickets_sold_at_sold_out": first_sold_out[1] if first_sold_out else None,
+                "rejected_sold_out": self.__outcomes["sold_out"],
+                # bookings that got seats freed by cancellations after the first sold out
+                "booked_after_sold_out": self.__booked_after_sold_out,
+            },
+            "timeline": [{"second": second, "booked": booked, "sold_out": sold_out, "cancelled": cancelled}
+                         for second, (booked, sold_out, cancelled) in enumerate(self.__timeline)],
+            "sales": dict(event.get_sales_aggregates().get_summary(), total_sales=event.get_total_sales()),
+        }
+
+
+def write_report(report, path):
+    with open(path, "w") as file:
+        json.dump(report, file, indent=2)
+
+
+def _parse_weights(text, key=str):
+    # "SINGLE_RACE=0.7,WEEKEND_PACKAGE=0.3" -> {"SINGLE_RACE": 0.7, "WEEKEND_PACKAGE": 0.3}
+    weights = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        weights[key(name.strip())] = float(weight)
+    return weights
+
+
+def _parse_toggle(text):
+    # "3.5:off" -> (3.5, False)
+    at, _, state = text.partition(":")
+    if state not in ("on", "off"):
+        raise argparse.ArgumentTypeError("A discount toggle is SECONDS:on or SECONDS:off")
+    return float(at), state == "on"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flash-sale load generator for the booking core")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--rate", type=float, default=2000, help="arrivals per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of traffic")
+    parser.add_argument("--customers", type=int, default=10000)
+    parser.add_argument("--capacity", type=int, default=20000)
+    parser.add_argument("--mix", type=_parse_weights, help="ticket type weights, e.g. SINGLE_RACE=0.7,WEEKEND_PACKAGE=0.3")
+    parser.add_argument("--quantities", type=lambda text: _parse_weights(text, int),
+                        help="tickets per booking weights, e.g. 1=0.8,2=0.2")
+    parser.add_argument("--cancel-rate", type=float, default=0.05)
+    parser.add_argument("--discount", type=float, default=10, help="discount percentage")
+    parser.add_argument("--discount-on", action="store_true", help="open the sale with the discount on")
+    parser.add_argument("--discount-toggle", type=_parse_toggle, nargs="*", default=[],
+                        help="switch the discount during the sale, e.g. 3:on 6:off")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--ledger", choices=("list", "columnar"), default="list")
+    parser.add_argument("--output", help="JSON file for the report")
+    args = parser.parse_args()
+
+    profile = TrafficProfile(args.rate, args.duration, args.mix, args.quantities, args.cancel_rate,
+                             args.discount_toggle)
+    generator = LoadGenerator(profile, args.customers, args.capacity, args.seed, args.workers, args.ledger,
+                              args.discount, args.discount_on)
+    report = generator.run()
+
+    throughput, capacity = report["throughput"], report["capacity"]
+    print("{} requests in {:.2f} s, {:.0f}/s offered {:.0f}/s, dispatcher at most {:.3f} s behind".format(
+        throughput["completed"], throughput["elapsed_s"], throughput["requests_per_s"], throughput["offered_per_s"],
+        throughput["max_dispatch_lag_s"]))
+    for operation, latency in report["latency"].items():
+        print("{:>10}  {:>8}  p50 {:>9.1f} us  p99 {:>9.1f} us  p99.9 {:>9.1f} us  max {:>9.1f} us".format(
+            operation, latency["count"], latency["p50_us"], latency["p99_us"], latency["p99.9_us"], latency["max_us"]))
+    if capacity["sold_out_at_s"] is not None:
+        print("sold out at {:.2f} s with {} tickets, {} bookings rejected, {} booked from cancellations".format(
+            capacity["sold_out_at_s"], capacity["tickets_sold_at_sold_out"], capacity["rejected_sold_out"],
+            capacity["booked_after_sold_out"]))
+    else:
+        print("{} of {} seats sold, never sold out".format(capacity["tickets_sold"], capacity["capacity"]))
+    if args.output:
+        write_report(report, args.output)
+        print("report written to {}".format(args.output))
+
+
+if __name__ == "__main__":
+    main()
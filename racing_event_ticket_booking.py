@@ -7,17 +7,56 @@ Ticket (Abstract Base Class)
 
 Subclasses: SingleRaceTicket, WeekendPackageTicket, SeasonMembershipTicket
 
+TicketList, ColumnarTicketLedger, MappedTicketLedger (ticket ledgers of an event)
+
+SalesAggregates
+
 RacingCarEvent
 
-DiscountPolicy
+EventCatalog
+
+DiscountPolicy, PricingPolicy
 
 PurchaseOrder
 
+CustomerDirectory
+
+SeatMap
+
+SeatHold, HoldExpiryTimer
+
+CustomerJournal
+
+EventLog
+
+BackgroundWorker
+
+CustomerBrowser
+
 '''
 
+# concurrent.futures, datetime, pickle, queue, tkinter and NumPy are imported where they are
+# used so that importing this module stays cheap and free of side effects.
+
+import bisect
+import heapq
+import itertools
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from collections import Counter, deque
+
+import instrumentation
 
 
-import pickle
+CUSTOMERS_FILE = "customers.pkl"
+CUSTOMERS_JOURNAL_FILE = "customers.journal"
+EVENT_LOG_FILE = "event.log"
+EVENT_SNAPSHOT_FILE = "event.snapshot"
 
 class Customer:
     def __init__(self, id, name, email, phone):
@@ -25,7 +64,10 @@ class Customer:
         self.__name = name
         self.__email = email
         self.__phone = phone
-        self.__purchase_history = []
+        # (purchase key of the event, ticket id) -> ticket, in the order of purchase
+        self.__purchase_history = {}
+        self.__directories = []  # CustomerDirectory objects indexing this customer
+        self.__lock = threading.Lock()
 
     # Hardcore getters
     def get_id(self):
@@ -42,58 +84,164 @@ class Customer:
 
     # Minimal setters
     def set_name(self, new_name):
+        old_name = self.__name
         self.__name = new_name
+        for directory in self.__directories:
+            directory._reindex_name(self, old_name)
 
     def set_email(self, new_email):
+        old_email = self.__email
         self.__email = new_email
+        for directory in self.__directories:
+            directory._reindex_email(self, old_email)
 
     def set_phone(self, new_phone):
+        old_phone = self.__phone
         self.__phone = new_phone
+        for directory in self.__directories:
+            directory._reindex_phone(self, old_phone)
+
+    # directory bookkeeping, used by CustomerDirectory
+    def _attach_directory(self, directory):
+        self.__directories.append(directory)
+
+    def _detach_directory(self, directory):
+        for index, attached in enumerate(self.__directories):
+            if attached is directory:
+                del self.__directories[index]
+                return
 
     # purchase methods
-    def add_purchase(self, ticket):
+    # Purchases are keyed by (purchase key of the event, ticket id): ticket ids
+    # are only unique within the ledger of one event. The purchase key is the
+    # event id, or a key of its own for an event created without one.
+    def get_purchase_history(self):
         '''
-        Takes the ticket and adds the ticket into the purchased tickets list
-        :param ticket:
+        Returns a copy of the list of purchased tickets
+        :return:
+        '''
+        with self.__lock:
+            return list(self.__purchase_history.values())
+
+    def get_purchase_history_page(self, page, page_size=50):
+        '''
+        Returns one page of the purchased tickets in the order of purchase,
+        without copying the whole history.
+        :param page: number of the page, starting at 0
+        :param page_size:
+        :return: list of at most page_size tickets
+        '''
+        start = page * page_size
+        with self.__lock:
+            return list(itertools.islice(self.__purchase_history.values(), start, start + page_size))
+
+    def get_purchase_count(self):
+        return len(self.__purchase_history)
+
+    def get_purchase(self, ticket_id, event_id=None):
+        '''
+        Returns the purchased ticket with the given id, otherwise False.
+        :param ticket_id:
+        :param event_id: purchase key of the event the ticket was bought for
         :return:
         '''
-        self.__purchase_history.append(ticket)
+        return self.__purchase_history.get((event_id, ticket_id), False)
 
-    def cancel_purchase(self, ticket):
+    def add_purchase(self, ticket, event_id=None):
         '''
-        This method cancels the purchase by removing the ticket from the list
+        Takes the ticket and adds the ticket into the purchased tickets
         :param ticket:
+        :param event_id: purchase key of the event the ticket was bought for
         :return:
         '''
-        self.__purchase_history.remove(ticket)
+        with self.__lock:
+            self.__purchase_history[event_id, ticket.get_ticket_id()] = ticket
 
-    def save_to_file(self):
+    def add_purchases(self, tickets, event_id=None):
         '''
-        This method adds the customer information into the binary pickle file
-        from which the information can be read whenever required.
+        Takes a batch of tickets and adds them into the purchased tickets
+        :param tickets:
+        :param event_id: purchase key of the event the tickets were bought for
         :return:
         '''
-        try:
-            with open("customers.pkl", "rb") as file:
-                customers = pickle.load(file)
-        except (FileNotFoundError, EOFError):
-            customers = []
+        with self.__lock:
+            self.__purchase_history.update(((event_id, ticket.get_ticket_id()), ticket) for ticket in tickets)
+
+    def cancel_purchase(self, ticket, event_id=None):
+        '''
+        This method cancels the purchase by removing the ticket from the purchased tickets
+        :param ticket:
+        :param event_id: purchase key of the event the ticket was bought for
+        :return: True if the ticket was removed, otherwise False
+        '''
+        with self.__lock:
+            return self.__purchase_history.pop((event_id, ticket.get_ticket_id()), None) is not None
 
-        customers.append(self)
+    def save(self, storage):
+        '''
+        This method saves the customer through a storage backend (see storage.py).
+        :param storage:
+        :return:
+        '''
+        storage.save_customer(self)
 
-        with open("customers.pkl", "wb") as file:
-            pickle.dump(customers, file)
+    @staticmethod
+    def load(storage, id):
+        '''
+        Loads the customer with the given id from a storage backend.
+        :return: the customer, otherwise False if it is not stored
+        '''
+        return storage.load_customer(id)
+
+    def save_to_file(self, journal=None):
+        '''
+        This method appends the customer information to the customer journal
+        from which the information can be read whenever required.
+        Saving is a single small write no matter how many customers exist.
+        :param journal: journal to write to, the default customer journal if None
+        :return:
+        '''
+        if journal is None:
+            journal = get_customer_journal()
+        journal.append(self)
+
+    def __getstate__(self):
+        # the directories belong to the events, not to the customer
+        state = self.__dict__.copy()
+        state["_Customer__directories"] = []
+        del state["_Customer__lock"]
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault("_Customer__directories", [])
+        history = state.get("_Customer__purchase_history", {})
+        if isinstance(history, list):
+            # saved before purchases were keyed, tickets without an id keep their position
+            state["_Customer__purchase_history"] = {
+                (None, ticket.get_ticket_id() if ticket.get_ticket_id() is not None else -1 - position): ticket
+                for position, ticket in enumerate(history)}
+        self.__dict__.update(state)
+        self.__lock = threading.Lock()
 
     def __str__(self):
         return "*** Showing Details for Customer ***\nID : {}\nName : {}\n" \
                "Email : {}\nPhone : {}\nTotal Orders : {}".format(self.get_id(),self.get_name(),
                                                                   self.get_email(),self.get_phone(),
-                                                                  len(self.__purchase_history))
+                                                                  self.get_purchase_count())
 
 class Ticket:
+    __slots__ = ("__price", "__is_valid", "__ticket_id")
+
     def __init__(self, price):
         self.__price = price
         self.__is_valid = True
+        self.__ticket_id = None  # set by the ledger the ticket is recorded in
+
+    def get_ticket_id(self):
+        return self.__ticket_id
+
+    def set_ticket_id(self, ticket_id):
+        self.__ticket_id = ticket_id
 
     def get_price(self):
         return self.__price
@@ -111,6 +259,9 @@ class Ticket:
         pass
 
 class SingleRaceTicket(Ticket):
+    __slots__ = ("__seat_number",)
+    TICKET_TYPE = "SINGLE_RACE"
+
     def __init__(self, price, seat_number):
         super().__init__(price)
         self.__seat_number = seat_number
@@ -119,9 +270,12 @@ class SingleRaceTicket(Ticket):
         return self.__seat_number
 
     def get_ticket_type(self):
-        return "SINGLE_RACE"
+        return self.TICKET_TYPE
 
 class WeekendPackageTicket(Ticket):
+    __slots__ = ("__seat_number",)
+    TICKET_TYPE = "WEEKEND_PACKAGE"
+
     def __init__(self, price, seat_number):
         super().__init__(price)
         self.__seat_number = seat_number
@@ -130,9 +284,12 @@ class WeekendPackageTicket(Ticket):
         return self.__seat_number
 
     def get_ticket_type(self):
-        return "WEEKEND_PACKAGE"
+        return self.TICKET_TYPE
 
 class SeasonMembershipTicket(Ticket):
+    __slots__ = ("__seat_number",)
+    TICKET_TYPE = "SEASON_MEMBERSHIP"
+
     def __init__(self, price, seat_number):
         super().__init__(price)
         self.__seat_number = seat_number
@@ -141,20 +298,1314 @@ class SeasonMembershipTicket(Ticket):
         return self.__seat_number
 
     def get_ticket_type(self):
-        return "SEASON_MEMBERSHIP"
+        return self.TICKET_TYPE
+
+# ticket type codes used by the ticket ledgers
+TICKET_TYPE_CODES = {
+    "SINGLE_RACE": 1,
+    "WEEKEND_PACKAGE": 2,
+    "SEASON_MEMBERSHIP": 3,
+}
+
+TICKET_CLASSES = {
+    1: SingleRaceTicket,
+    2: WeekendPackageTicket,
+    3: SeasonMembershipTicket,
+}
+
+# payment method codes used by the ticket ledgers, 0 means not recorded
+PAYMENT_METHOD_CODES = {
+    "Credit Card": 1,
+    "Debit Card": 2,
+}
+
+PAYMENT_METHODS = {code: method for method, code in PAYMENT_METHOD_CODES.items()}
+
+
+def _check_payment_method(payment_method):
+    if payment_method is not None and payment_method not in PAYMENT_METHOD_CODES:
+        raise ValueError("Unknown payment method {}".format(payment_method))
+
+
+class LedgerTicketView(Ticket):
+    '''
+    Ticket backed by a row of a ticket ledger. It holds nothing but the ledger
+    and the row index; every getter and setter goes to the ledger columns.
+    '''
+    __slots__ = ("_ledger", "_index")
+
+    def __init__(self, ledger, index):
+        self._ledger = ledger
+        self._index = index
+
+    def get_ledger_index(self):
+        return self._index
+
+    def get_ticket_id(self):
+        return self._ledger.get_ticket_id(self._index)
+
+    def get_price(self):
+        return self._ledger.get_price(self._index)
+
+    def is_valid(self):
+        return self._ledger.is_valid(self._index)
+
+    def set_price(self, new_price):
+        self._ledger.set_price(self._index, new_price)
+
+    def invalidate(self):
+        self._ledger.invalidate(self._index)
+
+    def get_seat_number(self):
+        return self._ledger.get_seat_number(self._index)
+
+    def get_ticket_type(self):
+        return self._ledger.get_ticket_type(self._index)
+
+    def get_customer_id(self):
+        return self._ledger.get_customer_id(self._index)
+
+    def __eq__(self, other):
+        return (isinstance(other, LedgerTicketView) and other._ledger is self._ledger
+                and other._index == self._index)
+
+    def __hash__(self):
+        return hash((id(self._ledger), self._index))
+
+
+class TicketList:
+    '''
+    Default ticket ledger of an event: a plain list of the Ticket objects sold,
+    with the price paid for each of them.
+    '''
+    def __init__(self):
+        self.__tickets = []
+        self.__paid = []
+        self.__customer_ids = []
+        self.__payment_methods = []
+        self.__sold_at = []  # time of sale, seconds since the epoch
+
+    def __len__(self):
+        return len(self.__tickets)
+
+    def __iter__(self):
+        return iter(self.__tickets)
+
+    def append(self, ticket, paid_price, customer_id=None, payment_method=None, sold_at=None):
+        '''
+        Records a sold ticket. Its ticket id becomes its index in the ledger.
+        :param sold_at: time of sale in seconds since the epoch, now if None
+        :return: the ticket as stored in the ledger
+        '''
+        ticket.set_ticket_id(len(self.__tickets))
+        self.__tickets.append(ticket)
+        self.__paid.append(paid_price)
+        self.__customer_ids.append(customer_id)
+        self.__payment_methods.append(payment_method)
+        self.__sold_at.append(int(time.time()) if sold_at is None else sold_at)
+        return ticket
+
+    def append_many(self, tickets, paid_prices, customer_id=None, payment_method=None, sold_at=None):
+        '''
+        Records a batch of tickets sold to one customer.
+        :return: the tickets as stored in the ledger
+        '''
+        for ticket_id, ticket in enumerate(tickets, len(self.__tickets)):
+            ticket.set_ticket_id(ticket_id)
+        self.__tickets.extend(tickets)
+        self.__paid.extend(paid_prices)
+        self.__customer_ids.extend([customer_id] * len(tickets))
+        self.__payment_methods.extend([payment_method] * len(tickets))
+        self.__sold_at.extend([int(time.time()) if sold_at is None else sold_at] * len(tickets))
+        return list(tickets)
+
+    def get_ticket(self, index):
+        return self.__tickets[index]
+
+    def get_paid_price(self, index):
+        return self.__paid[index]
+
+    def get_customer_id(self, index):
+        return self.__customer_ids[index]
+
+    def get_payment_method(self, index):
+        return self.__payment_methods[index]
+
+    def get_sold_at(self, index):
+        return self.__sold_at[index]
+
+    def get_total_sales(self):
+        return math.fsum(self.__paid)
+
+    def get_sales_by_type(self):
+        totals = {}
+        for ticket, paid in zip(self.__tickets, self.__paid):
+            ticket_type = ticket.get_ticket_type()
+            totals[ticket_type] = totals.get(ticket_type, 0) + paid
+        return totals
+
+    def get_columns(self, start=0, stop=None):
+        '''
+        Returns the rows from `start` to `stop` as columns, see
+        ColumnarTicketLedger.get_columns. The tickets are read one by one.
+        '''
+        tickets = self.__tickets[start:stop]
+        customer_index = {}
+        customers = array("l")
+        for customer_id in self.__customer_ids[start:stop]:
+            if customer_id is None:
+                customers.append(-1)
+            else:
+                customers.append(customer_index.setdefault(customer_id, len(customer_index)))
+        return {
+            "price": array("d", [ticket.get_price() for ticket in tickets]),
+            "paid": array("d", self.__paid[start:stop]),
+            "type_code": array("b", [TICKET_TYPE_CODES[ticket.get_ticket_type()] for ticket in tickets]),
+            "valid": bytearray(1 if ticket.is_valid() else 0 for ticket in tickets),
+            "payment_code": array("b", [PAYMENT_METHOD_CODES.get(method, 0)
+                                        for method in self.__payment_methods[start:stop]]),
+            "sold_at": array("q", self.__sold_at[start:stop]),
+            "customer": customers,
+            "customer_ids": list(customer_index),
+        }
+
+    def __setstate__(self, state):
+        # ledgers pickled before the time of sale was recorded
+        state.setdefault("_TicketList__sold_at", [0] * len(state["_TicketList__tickets"]))
+        self.__dict__.update(state)
+
+
+class ColumnarTicketLedger:
+    '''
+    Ticket ledger storing each field of the tickets sold in its own typed array.
+
+    A ticket costs about 35 bytes here instead of a full object, which matters
+    once an event sells hundreds of thousands of tickets. Tickets are handed
+    out as LedgerTicketView objects created on demand, and totals are computed
+    straight from the columns.
+    '''
+    def __init__(self):
+        self.__prices = array("d")
+        self.__paid = array("d")
+        self.__type_codes = array("b")
+        self.__seat_numbers = array("l")
+        self.__valid = bytearray()
+        self.__customers = array("l")  # index into __customer_ids, -1 if unknown
+        self.__customer_ids = []
+        self.__customer_index = {}
+        self.__payment_codes = array("b")
+        self.__sold_at = array("q")  # time of sale, seconds since the epoch
+
+    def __len__(self):
+        return len(self.__type_codes)
+
+    def __iter__(self):
+        for index in range(len(self.__type_codes)):
+            yield LedgerTicketView(self, index)
+
+    def append(self, ticket, paid_price, customer_id=None, payment_method=None, sold_at=None):
+        '''
+        Records a sold ticket in the columns.
+        :param sold_at: time of sale in seconds since the epoch, now if None
+        :return: a LedgerTicketView of the new row
+        '''
+        self.__prices.append(ticket.get_price())
+        self.__paid.append(paid_price)
+        self.__type_codes.append(TICKET_TYPE_CODES[ticket.get_ticket_type()])
+        self.__seat_numbers.append(ticket.get_seat_number())
+        self.__valid.append(1 if ticket.is_valid() else 0)
+        self.__customers.append(self.__intern_customer(customer_id))
+        self.__payment_codes.append(PAYMENT_METHOD_CODES.get(payment_method, 0))
+        self.__sold_at.append(int(time.time()) if sold_at is None else sold_at)
+        return LedgerTicketView(self, len(self.__type_codes) - 1)
+
+    def append_many(self, tickets, paid_prices, customer_id=None, payment_method=None, sold_at=None):
+        '''
+        Records a batch of tickets sold to one customer, extending every
+        column once.
+        :return: LedgerTicketView objects of the new rows
+        '''
+        start = len(self.__type_codes)
+        count = len(tickets)
+        self.__prices.extend([ticket.get_price() for ticket in tickets])
+        self.__paid.extend(paid_prices)
+        self.__type_codes.extend([TICKET_TYPE_CODES[ticket.get_ticket_type()] for ticket in tickets])
+        self.__seat_numbers.extend([ticket.get_seat_number() for ticket in tickets])
+        self.__valid.extend([1 if ticket.is_valid() else 0 for ticket in tickets])
+        self.__customers.extend(array("l", [self.__intern_customer(customer_id)]) * count)
+        self.__payment_codes.extend(array("b", [PAYMENT_METHOD_CODES.get(payment_method, 0)]) * count)
+        self.__sold_at.extend(array("q", [int(time.time()) if sold_at is None else sold_at]) * count)
+        return [LedgerTicketView(self, index) for index in range(start, start + count)]
+
+    def get_ticket(self, index):
+        if not -len(self) <= index < len(self):
+            raise IndexError("ticket index out of range")
+        return LedgerTicketView(self, index % len(self))
+
+    # column accessors used by LedgerTicketView
+    def get_ticket_id(self, index):
+        return index
+
+    def get_price(self, index):
+        return self.__prices[index]
+
+    def set_price(self, index, new_price):
+        self.__prices[index] = new_price
+
+    def get_paid_price(self, index):
+        return self.__paid[index]
+
+    def is_valid(self, index):
+        return self.__valid[index] == 1
+
+    def invalidate(self, index):
+        self.__valid[index] = 0
+
+    def get_seat_number(self, index):
+        return self.__seat_numbers[index]
+
+    def get_ticket_type(self, index):
+        return TICKET_CLASSES[self.__type_codes[index]].TICKET_TYPE
+
+    def get_customer_id(self, index):
+        customer = self.__customers[index]
+        if customer < 0:
+            return None
+        return self.__customer_ids[customer]
+
+    def get_payment_method(self, index):
+        return PAYMENT_METHODS.get(self.__payment_codes[index])
+
+    def get_sold_at(self, index):
+        return self.__sold_at[index]
+
+    def get_total_sales(self):
+        return math.fsum(self.__paid)
+
+    def get_sales_by_type(self):
+        totals = {}
+        for code, paid in zip(self.__type_codes, self.__paid):
+            ticket_type = TICKET_CLASSES[code].TICKET_TYPE
+            totals[ticket_type] = totals.get(ticket_type, 0) + paid
+        return totals
+
+    def get_columns(self, start=0, stop=None):
+        '''
+        Returns the rows from `start` to `stop` as typed arrays, e.g. to be
+        aggregated in chunks by reporting.py: price and paid (dollars),
+        type_code, valid, payment_code, sold_at, and customer, an index into
+        customer_ids or -1 if the ticket has no customer.
+        '''
+        return {
+            "price": self.__prices[start:stop],
+            "paid": self.__paid[start:stop],
+            "type_code": self.__type_codes[start:stop],
+            "valid": self.__valid[start:stop],
+            "payment_code": self.__payment_codes[start:stop],
+            "sold_at": self.__sold_at[start:stop],
+            "customer": self.__customers[start:stop],
+            "customer_ids": self.__customer_ids,
+        }
+
+    def __intern_customer(self, customer_id):
+        if customer_id is None:
+            return -1
+        index = self.__customer_index.get(customer_id)
+        if index is None:
+            index = len(self.__customer_ids)
+            self.__customer_ids.append(customer_id)
+            self.__customer_index[customer_id] = index
+        return index
+
+    def __setstate__(self, state):
+        # ledgers pickled before the time of sale was recorded
+        state.setdefault("_ColumnarTicketLedger__sold_at",
+                         array("q", bytes(8 * len(state["_ColumnarTicketLedger__type_codes"]))))
+        self.__dict__.update(state)
+
+
+class MappedTicketLedger:
+    '''
+    Ticket ledger kept in a file of fixed-width binary records which is
+    memory-mapped for reading and writing.
+
+    Each record holds the ticket id, prices in cents, seat, time of sale, type
+    code, validity, customer id and payment method code. Reads go straight to the mapped bytes, so
+    opening a ledger of millions of tickets deserializes nothing, and
+    invalidating a ticket flips one byte in place. New records are appended
+    into spare room at the end of the file, which is grown by doubling, and the
+    record count in the header is updated after each record is written.
+    '''
+    MAGIC = b"RTLEDGR1"
+    HEADER = struct.Struct("<8sIQ4x")  # magic, record size, record count
+    # ticket id, price cents, paid cents, seat, sold at, type code, valid, customer id, payment code
+    RECORD = struct.Struct("<QqqIIBB16sB5x")
+    PAID_FIELD = struct.Struct("<16xq32x")
+    TYPE_AND_PAID_FIELDS = struct.Struct("<16xq8xB23x")
+    COUNT_OFFSET = 12
+    VALID_OFFSET = 33
+    INITIAL_RECORDS = 1024
+
+    def __init__(self, path):
+        self.__path = path
+        self.__file = open(path, "a+b")
+        self.__file.seek(0, os.SEEK_END)
+        if self.__file.tell() == 0:
+            self.__file.write(self.HEADER.pack(self.MAGIC, self.RECORD.size, 0))
+            self.__file.truncate(self.HEADER.size + self.INITIAL_RECORDS * self.RECORD.size)
+            self.__file.flush()
+
+        self.__map = mmap.mmap(self.__file.fileno(), 0)
+        magic, record_size, count = self.HEADER.unpack_from(self.__map, 0)
+        if magic != self.MAGIC or record_size != self.RECORD.size:
+            self.__close()
+            raise ValueError("{} is not a ticket ledger file".format(path))
+        self.__count = count
+        self.__lock = threading.Lock()
+
+    def get_path(self):
+        return self.__path
+
+    def __len__(self):
+        return self.__count
+
+    def __iter__(self):
+        for index in range(self.__count):
+            yield LedgerTicketView(self, index)
+
+    def append(self, ticket, paid_price, customer_id=None, payment_method=None, sold_at=None):
+        '''
+        Appends the record of a sold ticket.
+        :param sold_at: time of sale in seconds since the epoch, now if None
+        :return: a LedgerTicketView of the new record
+        '''
+        return self.append_many([ticket], [paid_price], customer_id, payment_method, sold_at)[0]
+
+    def append_many(self, tickets, paid_prices, customer_id=None, payment_method=None, sold_at=None):
+        '''
+        Appends the records of a batch of tickets sold to one customer.
+        :return: LedgerTicketView objects of the new records
+        '''
+        customer = self.__encode_customer(customer_id)
+        payment_code = PAYMENT_METHOD_CODES.get(payment_method, 0)
+        if sold_at is None:
+            sold_at = int(time.time())
+        with self.__lock:
+            start = self.__count
+            self.__reserve(start + len(tickets))
+            offset = self.HEADER.size + start * self.RECORD.size
+            for index, (ticket, paid_price) in enumerate(zip(tickets, paid_prices), start):
+                self.RECORD.pack_into(self.__map, offset, index, _to_cents(ticket.get_price()),
+                                      _to_cents(paid_price), ticket.get_seat_number(), sold_at,
+                                      TICKET_TYPE_CODES[ticket.get_ticket_type()],
+                                      1 if ticket.is_valid() else 0, customer, payment_code)
+                offset += self.RECORD.size
+            self.__count = start + len(tickets)
+            struct.pack_into("<Q", self.__map, self.COUNT_OFFSET, self.__count)
+        return [LedgerTicketView(self, index) for index in range(start, self.__count)]
+
+    def get_ticket(self, index):
+        if not -self.__count <= index < self.__count:
+            raise IndexError("ticket index out of range")
+        return LedgerTicketView(self, index % self.__count)
+
+    def get_record(self, index):
+        '''
+        :return: (ticket id, price cents, paid cents, seat, sold at, type code, valid,
+                  customer id bytes, payment code)
+        '''
+        return self.RECORD.unpack_from(self.__map, self.__offset(index))
+
+    # field accessors used by LedgerTicketView, each reads one field in place
+    def get_ticket_id(self, index):
+        return struct.unpack_from("<Q", self.__map, self.__offset(index))[0]
+
+    def get_price(self, index):
+        return struct.unpack_from("<q", self.__map, self.__offset(index) + 8)[0] / 100
+
+    def set_price(self, index, new_price):
+        struct.pack_into("<q", self.__map, self.__offset(index) + 8, _to_cents(new_price))
+
+    def get_paid_price(self, index):
+        return struct.unpack_from("<q", self.__map, self.__offset(index) + 16)[0] / 100
+
+    def get_seat_number(self, index):
+        return struct.unpack_from("<I", self.__map, self.__offset(index) + 24)[0]
+
+    def get_sold_at(self, index):
+        return struct.unpack_from("<I", self.__map, self.__offset(index) + 28)[0]
+
+    def get_ticket_type(self, index):
+        return TICKET_CLASSES[self.__map[self.__offset(index) + 32]].TICKET_TYPE
+
+    def is_valid(self, index):
+        return self.__map[self.__offset(index) + self.VALID_OFFSET] == 1
+
+    def invalidate(self, index):
+        self.__map[self.__offset(index) + self.VALID_OFFSET] = 0
+
+    def get_customer_id(self, index):
+        offset = self.__offset(index) + 34
+        customer = bytes(self.__map[offset:offset + 16]).rstrip(b"\x00")
+        return customer.decode() if customer else None
+
+    def get_payment_method(self, index):
+        return PAYMENT_METHODS.get(self.__map[self.__offset(index) + 50])
+
+    # aggregates, computed over the mapped records
+    def get_total_sales(self):
+        return self.get_total_sales_cents() / 100
+
+    def get_total_sales_cents(self):
+        numpy = _load_numpy()
+        with self.__lock:
+            with self.__records() as records:
+                if numpy is not None:
+                    return int(numpy.frombuffer(records, dtype=self.__numpy_dtype(numpy))["paid"].sum())
+                return sum(paid for (paid,) in self.PAID_FIELD.iter_unpack(records))
+
+    def get_sales_by_type(self):
+        cents = {}
+        with self.__lock:
+            with self.__records() as records:
+                for paid, code in self.TYPE_AND_PAID_FIELDS.iter_unpack(records):
+                    cents[code] = cents.get(code, 0) + paid
+        return {TICKET_CLASSES[code].TICKET_TYPE: total / 100 for code, total in cents.items()}
+
+    def get_columns(self, start=0, stop=None):
+        '''
+        Returns the records from `start` to `stop` as columns, like
+        ColumnarTicketLedger.get_columns but with the prices in cents
+        (price_cents, paid_cents). The records are copied out of the map in
+        one go, with NumPy into a structured array.
+        '''
+        numpy = _load_numpy()
+        with self.__lock:
+            # the map is not resized while its bytes are copied
+            start, stop, _ = slice(start, stop).indices(self.__count)
+            records = self.__records()[start * self.RECORD.size:max(start, stop) * self.RECORD.size]
+            if numpy is not None:
+                rows = numpy.frombuffer(records, dtype=self.__numpy_dtype(numpy)).copy()
+            else:
+                fields = list(zip(*self.RECORD.iter_unpack(records))) or [()] * 9
+            records.release()
+
+        if numpy is not None:
+            customer_ids, customers = numpy.unique(rows["customer_id"], return_inverse=True)
+            customer_ids = [customer.decode() for customer in customer_ids.tolist()]
+            if customer_ids and customer_ids[0] == "":
+                # tickets without a customer sort first
+                customer_ids.pop(0)
+                customers = customers - 1
+            columns = {name: rows[name] for name in ("price", "paid", "type_code", "valid", "payment_code",
+                                                     "sold_at")}
+        else:
+            customer_index = {}
+            customers = array("l")
+            for customer in fields[7]:
+                customer = customer.rstrip(b"\x00")
+                customers.append(customer_index.setdefault(customer.decode(), len(customer_index))
+                                 if customer else -1)
+            customer_ids = list(customer_index)
+            columns = {
+                "price": array("q", fields[1]),
+                "paid": array("q", fields[2]),
+                "type_code": array("b", fields[5]),
+                "valid": bytearray(fields[6]),
+                "payment_code": array("b", fields[8]),
+                "sold_at": array("q", fields[4]),
+            }
+        columns["price_cents"] = columns.pop("price")
+        columns["paid_cents"] = columns.pop("paid")
+        columns["customer"] = customers
+        columns["customer_ids"] = customer_ids
+        return columns
+
+    def flush(self):
+        self.__map.flush()
+
+    def close(self):
+        with self.__lock:
+            self.__close()
+
+    def __close(self):
+        if self.__map is not None:
+            self.__map.flush()
+            self.__map.close()
+            self.__map = None
+        self.__file.close()
+
+    def __getstate__(self):
+        self.flush()
+        return {"path": self.__path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def __offset(self, index):
+        if not 0 <= index < self.__count:
+            raise IndexError("ticket index out of range")
+        return self.HEADER.size + index * self.RECORD.size
+
+    def __records(self):
+        start = self.HEADER.size
+        return memoryview(self.__map)[start:start + self.__count * self.RECORD.size]
+
+    def __numpy_dtype(self, numpy):
+        return numpy.dtype({
+            "names": ["ticket_id", "price", "paid", "seat", "sold_at", "type_code", "valid", "customer_id",
+                      "payment_code"],
+            "formats": ["<u8", "<i8", "<i8", "<u4", "<u4", "u1", "u1", "S16", "u1"],
+            "offsets": [0, 8, 16, 24, 28, 32, 33, 34, 50],
+            "itemsize": self.RECORD.size,
+        })
+
+    def __reserve(self, count):
+        # Called with the lock held; grows the file by doubling its record capacity.
+        # The field accessors read without the lock, so the old map is not closed
+        # under them: it stays valid, shows the same file, and is unmapped once
+        # the last reader drops it.
+        capacity = (len(self.__map) - self.HEADER.size) // self.RECORD.size
+        if count <= capacity:
+            return
+        while capacity < count:
+            capacity *= 2
+        self.__map.flush()
+        self.__file.truncate(self.HEADER.size + capacity * self.RECORD.size)
+        self.__map = mmap.mmap(self.__file.fileno(), 0)
+
+    @staticmethod
+    def __encode_customer(customer_id):
+        if customer_id is None:
+            return b""
+        encoded = str(customer_id).encode()
+        if len(encoded) > 16:
+            raise ValueError("customer id {} is longer than 16 bytes".format(customer_id))
+        return encoded
+
+
+class SalesAggregates:
+    '''
+    Sales figures of an event kept up to date on every sale and cancellation.
+
+    Revenue and ticket counts are tracked per ticket type, per payment method
+    and for discounted versus full price sales, together with the remaining
+    capacity. Amounts are integer cents so that they never drift the way a
+    running float total does. Updating and reading any figure is O(1).
+    Cancelled tickets are taken out of every figure.
+    '''
+    def __init__(self, capacity):
+        self.__capacity = capacity
+        self.__tickets = 0
+        self.__revenue_cents = 0
+        self.__by_type = {ticket_type: [0, 0] for ticket_type in TICKET_TYPE_CODES}  # [count, cents]
+        self.__by_payment = {}  # payment method -> [count, cents]
+        self.__discounted = [0, 0]
+        self.__full_price = [0, 0]
+
+    def record_sale(self, ticket_type, payment_method, price_cents, paid_cents, count=1):
+        '''
+        Adds `count` tickets of one type sold at the same price.
+        :param ticket_type: e.g. "SINGLE_RACE"
+        :param payment_method: e.g. "Credit Card", None if not recorded
+        :param price_cents: list price of one ticket in cents
+        :param paid_cents: price paid for one ticket in cents
+        :param count:
+        :return:
+        '''
+        self.__add(ticket_type, payment_method, price_cents, paid_cents, count)
+
+    def record_cancellation(self, ticket_type, payment_method, price_cents, paid_cents, count=1):
+        '''
+        Takes `count` cancelled tickets back out of the figures.
+        '''
+        self.__add(ticket_type, payment_method, price_cents, paid_cents, -count)
+
+    def get_capacity(self):
+        return self.__capacity
+
+    def get_tickets_sold(self):
+        return self.__tickets
+
+    def get_remaining_capacity(self):
+        return self.__capacity - self.__tickets
+
+    def get_revenue_cents(self):
+        return self.__revenue_cents
+
+    def get_ticket_type_figures(self, ticket_type):
+        '''
+        :return: (tickets, revenue in cents) for the ticket type
+        '''
+        return tuple(self.__by_type.get(ticket_type, (0, 0)))
+
+    def get_payment_method_figures(self, payment_method):
+        '''
+        :return: (tickets, revenue in cents) for the payment method
+        '''
+        return tuple(self.__by_payment.get(payment_method, (0, 0)))
+
+    def get_discounted_figures(self):
+        return tuple(self.__discounted)
+
+    def get_full_price_figures(self):
+        return tuple(self.__full_price)
+
+    def get_summary(self):
+        '''
+        Returns every figure in one dictionary, e.g. for the dashboard or an API.
+        Amounts are in cents.
+        :return:
+        '''
+        def figures(pair):
+            return {"tickets": pair[0], "revenue_cents": pair[1]}
+
+        return {
+            "tickets_sold": self.__tickets,
+            "revenue_cents": self.__revenue_cents,
+            "remaining_capacity": self.get_remaining_capacity(),
+            "by_ticket_type": {ticket_type: figures(pair) for ticket_type, pair in self.__by_type.items()},
+            "by_payment_method": {method or "Unknown": figures(pair)
+                                  for method, pair in self.__by_payment.items()},
+            "discounted": figures(self.__discounted),
+            "full_price": figures(self.__full_price),
+        }
+
+    def __add(self, ticket_type, payment_method, price_cents, paid_cents, count):
+        revenue = paid_cents * count
+        self.__tickets += count
+        self.__revenue_cents += revenue
+        for pair in (self.__by_type.setdefault(ticket_type, [0, 0]),
+                     self.__by_payment.setdefault(payment_method, [0, 0]),
+                     self.__discounted if paid_cents < price_cents else self.__full_price):
+            pair[0] += count
+            pair[1] += revenue
+
+
+class _PrefixIndex:
+    '''
+    Sorted entries of one customer field for prefix search. An entry is the
+    normalized value of the field and the customer id joined by a NUL, so the
+    entries sort by value and then by id, and the entries starting with a
+    prefix are one contiguous range found with bisect.
+
+    Inserting into a sorted list of a million entries moves the whole list,
+    so new entries go to a second, smaller sorted list that is merged into
+    the main one once it holds an eighth of it. A range is then made of a
+    part of each list and read back in merged order.
+    '''
+    MIN_MERGE = 1024
+
+    def __init__(self, entries=()):
+        self.__main = sorted(entries)
+        self.__recent = []
+
+    def __len__(self):
+        return len(self.__main) + len(self.__recent)
+
+    def add(self, entry):
+        bisect.insort(self.__recent, entry)
+        if len(self.__recent) > max(self.MIN_MERGE, len(self.__main) >> 3):
+            # both lists are sorted runs, which sorted() merges in linear time
+            self.__main = sorted(self.__main + self.__recent)
+            self.__recent = []
+
+    def remove(self, entry):
+        for entries in (self.__recent, self.__main):
+            position = bisect.bisect_left(entries, entry)
+            if position < len(entries) and entries[position] == entry:
+                del entries[position]
+                return True
+        return False
+
+    def find(self, prefix):
+        '''
+        :return: ((start, stop) in the main list, (start, stop) in the recent
+            list) of the entries starting with prefix
+        '''
+        stop = prefix + "\U0010ffff"
+        return tuple((bisect.bisect_left(entries, prefix), bisect.bisect_left(entries, stop))
+                     for entries in (self.__main, self.__recent))
+
+    def get_entries(self, ranges, start, count):
+        '''
+        Returns `count` entries of a range returned by find(), from position
+        `start` of the range in sorted order.
+        '''
+        main, recent = self.__main, self.__recent
+        (main_start, main_stop), (recent_start, recent_stop) = ranges
+        # binary search for how many of the first `start` entries come from the main list
+        low, high = max(0, start - (recent_stop - recent_start)), min(start, main_stop - main_start)
+        while low < high:
+            taken = (low + high) // 2
+            if main[main_start + taken] < recent[recent_start + start - taken - 1]:
+                low = taken + 1
+            else:
+                high = taken
+        i, j = main_start + low, recent_start + start - low
+        entries = []
+        while len(entries) < count and (i < main_stop or j < recent_stop):
+            if j >= recent_stop or (i < main_stop and main[i] < recent[j]):
+                entries.append(main[i])
+                i += 1
+            else:
+                entries.append(recent[j])
+                j += 1
+        return entries
+
+
+def _search_key(field, value):
+    # names and emails match whatever their case, phone numbers on their digits only
+    if field == "phone":
+        return "".join(character for character in value if character.isdigit())
+    return value.casefold()
+
+
+class CustomerDirectory:
+    '''
+    Set of customers indexed by id, with secondary indexes on email and phone.
+
+    Lookup, insert and delete by id are O(1). Several customers may share an
+    email or a phone number, so the secondary indexes map each value to the
+    customers holding it. A customer keeps a reference to every directory it
+    is in so that set_name, set_email and set_phone keep the indexes in sync.
+
+    search() finds customers by a prefix of their name, email or phone. Its
+    sorted indexes are built on the first search and kept up to date from
+    then on, so a directory that is never searched does not pay for them.
+    '''
+    SEARCH_FIELDS = ("name", "email", "phone")
+
+    def __init__(self):
+        self.__by_id = {}
+        self.__by_email = {}  # email -> {id: customer}
+        self.__by_phone = {}  # phone -> {id: customer}
+        self.__search_indexes = None  # field -> _PrefixIndex, built by the first search
+        self.__lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.__by_id)
+
+    def __iter__(self):
+        return iter(list(self.__by_id.values()))
+
+    def __contains__(self, id):
+        return id in self.__by_id
+
+    def get(self, id):
+        '''
+        Returns the customer with the given id, otherwise False.
+        :param id:
+        :return:
+        '''
+        return self.__by_id.get(id, False)
+
+    def find_by_email(self, email):
+        return list(self.__by_email.get(email, {}).values())
+
+    def find_by_phone(self, phone):
+        return list(self.__by_phone.get(phone, {}).values())
+
+    def count_matches(self, text):
+        '''
+        Returns the number of results of search() for the text.
+        '''
+        with self.__lock:
+            return sum(stop - start for _, _, ranges in self.__search_ranges(text) for start, stop in ranges)
+
+    def search(self, text, start=0, count=50):
+        '''
+        Finds the customers whose name, email or phone starts with the text,
+        ignoring case, and phone numbers on their digits only. The results are
+        the name matches sorted by name, then the email matches and then the
+        phone matches, so a customer matching on several fields is listed once
+        per field. An empty text lists every customer by name. Only the
+        results asked for are read, which keeps paging through a large result
+        cheap.
+        :param start: position of the first result
+        :param count: number of results
+        :return: list of (customer, field) where field is "name", "email" or "phone"
+        '''
+        results = []
+        with self.__lock:
+            for field, index, ranges in self.__search_ranges(text):
+                size = sum(stop - first for first, stop in ranges)
+                if start >= size:
+                    start -= size
+                    continue
+                for entry in index.get_entries(ranges, start, count - len(results)):
+                    results.append((self.__by_id[entry[entry.rindex("\x00") + 1:]], field))
+                start = 0
+                if len(results) == count:
+                    break
+        return results
+
+    def add(self, customer):
+        '''
+        Adds the customer to the directory. A customer whose id is already
+        taken is rejected.
+        :param customer:
+        :return: True if the customer was added, otherwise False
+        '''
+        id = customer.get_id()
+        with self.__lock:
+            if id in self.__by_id:
+                return False
+
+            self.__by_id[id] = customer
+            self.__index(self.__by_email, customer.get_email(), customer)
+            self.__index(self.__by_phone, customer.get_phone(), customer)
+            if self.__search_indexes is not None:
+                for field in self.SEARCH_FIELDS:
+                    self.__search_indexes[field].add(self.__search_entry(field, customer))
+            customer._attach_directory(self)
+            return True
+
+    def remove(self, customer):
+        '''
+        Removes the customer from the directory.
+        :param customer:
+        :return: True if the customer was removed, otherwise False
+        '''
+        id = customer.get_id()
+        with self.__lock:
+            if self.__by_id.get(id) is not customer:
+                return False
+
+            del self.__by_id[id]
+            self.__unindex(self.__by_email, customer.get_email(), customer)
+            self.__unindex(self.__by_phone, customer.get_phone(), customer)
+            if self.__search_indexes is not None:
+                for field in self.SEARCH_FIELDS:
+                    self.__search_indexes[field].remove(self.__search_entry(field, customer))
+            customer._detach_directory(self)
+            return True
+
+    # called by Customer when an indexed field changes
+    def _reindex_name(self, customer, old_name):
+        with self.__lock:
+            self.__reindex_search("name", customer, old_name)
+
+    def _reindex_email(self, customer, old_email):
+        with self.__lock:
+            self.__unindex(self.__by_email, old_email, customer)
+            self.__index(self.__by_email, customer.get_email(), customer)
+            self.__reindex_search("email", customer, old_email)
+
+    def _reindex_phone(self, customer, old_phone):
+        with self.__lock:
+            self.__unindex(self.__by_phone, old_phone, customer)
+            self.__index(self.__by_phone, customer.get_phone(), customer)
+            self.__reindex_search("phone", customer, old_phone)
+
+    def __reindex_search(self, field, customer, old_value):
+        if self.__search_indexes is None:
+            return
+        index = self.__search_indexes[field]
+        index.remove(_search_key(field, old_value) + "\x00" + customer.get_id())
+        index.add(self.__search_entry(field, customer))
+
+    @staticmethod
+    def __search_entry(field, customer):
+        return _search_key(field, getattr(customer, "get_" + field)()) + "\x00" + customer.get_id()
+
+    def __search_ranges(self, text):
+        # (field, index, ranges) of the fields the text is looked up in, with the lock held
+        if self.__search_indexes is None:
+            customers = self.__by_id.values()
+            self.__search_indexes = {
+                field: _PrefixIndex([self.__search_entry(field, customer) for customer in customers])
+                for field in self.SEARCH_FIELDS}
+        fields = ["name", "email"] if text else ["name"]
+        if text and not any(character.isalpha() for character in text) and _search_key("phone", text):
+            fields.append("phone")
+        return [(field, self.__search_indexes[field],
+                 self.__search_indexes[field].find(_search_key(field, text))) for field in fields]
+
+    @staticmethod
+    def __index(index, key, customer):
+        index.setdefault(key, {})[customer.get_id()] = customer
+
+    @staticmethod
+    def __unindex(index, key, customer):
+        customers = index.get(key)
+        if customers is None:
+            return
+        customers.pop(customer.get_id(), None)
+        if not customers:
+            del index[key]
+
+    def __getstate__(self):
+        return {"customers": list(self.__by_id.values())}
+
+    def __setstate__(self, state):
+        self.__init__()
+        for customer in state["customers"]:
+            self.add(customer)
+
+
+class _SeatRange:
+    '''
+    Allocation state for a contiguous run of seats: a cursor over seats that
+    have never been handed out and a stack of seats released since.
+    '''
+    __slots__ = ("first", "last", "cursor", "free", "taken")
+
+    def __init__(self, first, last):
+        self.first = first
+        self.last = last
+        self.cursor = first
+        self.free = array("l")
+        self.taken = 0
+
+    def size(self):
+        return self.last - self.first + 1
+
+
+class SeatMap:
+    '''
+    Seat map of an event stored as a bitmap, one bit per seat.
+
+    Seats are numbered from 1 to the capacity. Handing out the next free seat
+    pops a released seat or advances a cursor, so it is O(1) amortised, and
+    taking or releasing a specific seat is O(1). The map can be split into
+    named sections of contiguous seats which are allocated independently.
+    A 100k seat event needs about 12.5 KB for the bitmap. All changes happen
+    under one lock; each critical section is O(1), which keeps it cheaper than
+    striping the bitmap across several locks.
+    '''
+    def __init__(self, capacity):
+        self.__capacity = capacity
+        self.__bits = bytearray((capacity + 7) // 8)
+        self.__all = _SeatRange(1, capacity)
+        self.__sections = {}
+        self.__section_starts = []  # first seat of each section, sorted
+        self.__section_ranges = []  # ranges in the same order as the starts
+        self.__lock = threading.RLock()
+
+    def get_capacity(self):
+        return self.__capacity
+
+    def get_seats_taken(self, section=None):
+        return self.__range(section).taken
+
+    def get_free_seats(self, section=None):
+        seat_range = self.__range(section)
+        return seat_range.size() - seat_range.taken
+
+    def get_sections(self):
+        return list(self.__sections)
+
+    def is_seat_taken(self, seat):
+        '''
+        :return: True if the seat is taken, otherwise False, also for a seat outside 1..capacity
+        '''
+        if not 1 <= seat <= self.__capacity:
+            return False
+        index = seat - 1
+        return bool(self.__bits[index >> 3] & (1 << (index & 7)))
+
+    def add_section(self, name, first_seat, last_seat):
+        '''
+        This method defines a named section covering seats first_seat to last_seat.
+        Sections may not overlap.
+        :param name:
+        :param first_seat:
+        :param last_seat:
+        :return: True if the section was added, otherwise False
+        '''
+        if not 1 <= first_seat <= last_seat <= self.__capacity:
+            return False
+
+        with self.__lock:
+            if name in self.__sections:
+                return False
+            position = bisect.bisect_left(self.__section_starts, first_seat)
+            if position > 0 and self.__section_ranges[position - 1].last >= first_seat:
+                return False
+            if position < len(self.__section_starts) and self.__section_starts[position] <= last_seat:
+                return False
+
+            seat_range = _SeatRange(first_seat, last_seat)
+            seat_range.taken = sum(1 for seat in range(first_seat, last_seat + 1) if self.is_seat_taken(seat))
+            self.__sections[name] = seat_range
+            self.__section_starts.insert(position, first_seat)
+            self.__section_ranges.insert(position, seat_range)
+            return True
+
+    def allocate_seat(self, section=None):
+        '''
+        This method takes the next free seat, optionally inside a section.
+        :param section: name of the section, the whole map if None
+        :return: the seat number, otherwise False if there is no free seat
+        '''
+        seat_range = self.__range(section)
+        with self.__lock:
+            if seat_range.taken == seat_range.size():
+                return False
+
+            while seat_range.free:
+                seat = seat_range.free.pop()
+                if self.__claim(seat):
+                    return seat
+
+            while seat_range.cursor <= seat_range.last:
+                seat = seat_range.cursor
+                seat_range.cursor += 1
+                if self.__claim(seat):
+                    return seat
+
+            return False
+
+    def allocate_seats(self, count, section=None):
+        '''
+        This method takes `count` free seats at once. Either all of them are
+        taken or none is.
+        :param count:
+        :param section: name of the section, the whole map if None
+        :return: list of seat numbers, otherwise False if there are not enough free seats
+        '''
+        with self.__lock:
+            if self.get_free_seats(section) < count:
+                return False
+            return [self.allocate_seat(section) for _ in range(count)]
+
+    def allocate_specific_seat(self, seat):
+        '''
+        This method takes the given seat if it is free.
+        :param seat:
+        :return: True if the seat was taken, otherwise False
+        '''
+        if not 1 <= seat <= self.__capacity:
+            return False
+        with self.__lock:
+            return self.__claim(seat)
+
+    def release_seat(self, seat):
+        '''
+        This method frees a taken seat so that it can be handed out again.
+        :param seat:
+        :return: True if the seat was released, otherwise False
+        '''
+        if not 1 <= seat <= self.__capacity:
+            return False
+
+        with self.__lock:
+            if not self.is_seat_taken(seat):
+                return False
+
+            index = seat - 1
+            self.__bits[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+            for seat_range in (self.__all, self.__section_of(seat)):
+                if seat_range is None:
+                    continue
+                seat_range.taken -= 1
+                # seats at or past the cursor are found by the cursor anyway
+                if seat < seat_range.cursor:
+                    seat_range.free.append(seat)
+                    if len(seat_range.free) > seat_range.size():
+                        self.__rebuild_free(seat_range)
+            return True
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_SeatMap__lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__lock = threading.RLock()
+
+    def __claim(self, seat):
+        # called with the lock held
+        index = seat - 1
+        mask = 1 << (index & 7)
+        if self.__bits[index >> 3] & mask:
+            return False
+
+        self.__bits[index >> 3] |= mask
+        self.__all.taken += 1
+        section = self.__section_of(seat)
+        if section is not None:
+            section.taken += 1
+        return True
+
+    def __range(self, section):
+        if section is None:
+            return self.__all
+        return self.__sections[section]
+
+    def __section_of(self, seat):
+        position = bisect.bisect_right(self.__section_starts, seat) - 1
+        if position < 0:
+            return None
+        seat_range = self.__section_ranges[position]
+        if seat > seat_range.last:
+            return None
+        return seat_range
+
+    def __rebuild_free(self, seat_range):
+        # drops the stale entries left behind by seats taken directly
+        seat_range.free = array("l", (seat for seat in range(seat_range.cursor - 1, seat_range.first - 1, -1)
+                                      if not self.is_seat_taken(seat)))
+
+
+# seconds a seat hold lasts unless it is confirmed, see RacingCarEvent.hold_seats
+DEFAULT_HOLD_TTL = 600
+
+
+class SeatHold:
+    '''
+    Seats set aside for a customer while they pay, see RacingCarEvent.hold_seats.
+    The hold expires at get_expires_at() on the time.monotonic() clock.
+    '''
+    __slots__ = ("__hold_id", "__ticket_class", "__price", "__seats", "__customer", "__expires_at")
+
+    def __init__(self, hold_id, ticket_class, price, seats, customer, expires_at):
+        self.__hold_id = hold_id
+        self.__ticket_class = ticket_class
+        self.__price = price
+        self.__seats = tuple(seats)
+        self.__customer = customer
+        self.__expires_at = expires_at
+
+    def get_hold_id(self):
+        return self.__hold_id
+
+    def get_ticket_class(self):
+        return self.__ticket_class
+
+    def get_price(self):
+        return self.__price
+
+    def get_seats(self):
+        return self.__seats
+
+    def get_customer(self):
+        return self.__customer
+
+    def get_expires_at(self):
+        return self.__expires_at
+
+    def get_remaining_time(self):
+        return max(0.0, self.__expires_at - time.monotonic())
+
+
+class _WaitlistEntry:
+    __slots__ = ("entry_id", "ticket_class", "price", "quantity", "customer", "section", "ttl", "on_hold")
+
+    def __init__(self, entry_id, ticket_class, price, quantity, customer, section, ttl, on_hold):
+        self.entry_id = entry_id
+        self.ticket_class = ticket_class
+        self.price = price
+        self.quantity = quantity
+        self.customer = customer
+        self.section = section
+        self.ttl = ttl
+        self.on_hold = on_hold
+
+
+class HoldExpiryTimer:
+    '''
+    Thread releasing the expired seat holds of every event at their deadline.
+
+    Each event keeps its holds in a heap ordered by expiry and only tells the
+    timer its earliest deadline, so the timer sleeps until the next deadline
+    of any event instead of scanning the holds, and its own heap holds about
+    one entry per event however many holds there are.
+    '''
+    def __init__(self):
+        self.__deadlines = []  # heap of (deadline, sequence number, event)
+        self.__sequence = itertools.count()
+        self.__condition = threading.Condition()
+        self.__thread = None
+
+    def schedule(self, event, deadline):
+        '''
+        Calls event._expire_scheduled(deadline) once time.monotonic() reaches the deadline.
+        '''
+        with self.__condition:
+            heapq.heappush(self.__deadlines, (deadline, next(self.__sequence), event))
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, name="hold-expiry-timer", daemon=True)
+                self.__thread.start()
+            if self.__deadlines[0][0] == deadline:
+                self.__condition.notify()
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                while True:
+                    now = time.monotonic()
+                    if self.__deadlines and self.__deadlines[0][0] <= now:
+                        deadline, _, event = heapq.heappop(self.__deadlines)
+                        break
+                    self.__condition.wait(self.__deadlines[0][0] - now if self.__deadlines else None)
+            # the event is called without the condition held, it takes its own lock
+            event._expire_scheduled(deadline)
+
+
+_hold_expiry_timer = None
+
+
+def get_hold_expiry_timer():
+    '''
+    Returns the timer releasing expired seat holds, creating it on first use.
+    :return:
+    '''
+    global _hold_expiry_timer
+    if _hold_expiry_timer is None:
+        _hold_expiry_timer = HoldExpiryTimer()
+    return _hold_expiry_timer
+
+
+def _new_purchase_key():
+    # an event without an id still needs a key of its own in the purchase
+    # histories, one that no event of this or any other process will have
+    return ("event", int.from_bytes(os.urandom(8), "big"))
+
 
 class RacingCarEvent:
-    def __init__(self, name, location, date, capacity):
+    def __init__(self, name, location, date, capacity, ledger=None, event_id=None):
+        self.__event_id = event_id
+        # key of the purchases in Customer histories, kept when an id is set later
+        self.__purchase_key = event_id if event_id is not None else _new_purchase_key()
         self.__name = name
         self.__location = location
         self.__date = date
         self.__capacity = capacity
         self.__total_sales = 0
-        self.__tickets_sold = []  # List of Ticket objects
-        self.__registered_customers = []
+        # Ticket ledger, a TicketList of Ticket objects unless a ColumnarTicketLedger is given
+        self.__tickets_sold = ledger if ledger is not None else TicketList()
+        self.__registered_customers = CustomerDirectory()
         self.__discount_policy = None
+        self.__seat_map = SeatMap(capacity)
+        self.__aggregates = SalesAggregates(capacity)
+        self.__event_date = None  # parsed date, see get_event_date
+        self.__catalogs = []  # EventCatalog objects indexing this event
+        self.__event_log = None  # EventLog recording the operations, see EventLog.attach
+        self.__holds = {}  # hold id -> SeatHold
+        self.__hold_deadlines = []  # heap of (expires at, hold id), settled holds are skipped when popped
+        self.__next_hold_id = 1
+        self.__scheduled_expiry = None  # deadline the HoldExpiryTimer will call back at
+        self.__waitlists = {}  # ticket type -> deque of _WaitlistEntry, first come first served
+        self.__waitlist_entries = {}  # entry id -> _WaitlistEntry still waiting
+        self.__next_waitlist_id = 1
+        self.__cancelled = array("q")  # ticket ids in the order they were cancelled, see get_cancelled_since
+        # guards the ledger, the sales figures, the registered customers, the holds and the waitlists
+        self.__lock = threading.RLock()
 
     # Getters
+    def get_event_id(self):
+        return self.__event_id
+
+    def get_purchase_key(self):
+        '''
+        Returns the key of the purchases of this event in the Customer purchase
+        histories: the event id it was created with, otherwise a key of its own.
+        '''
+        return self.__purchase_key
+
     def get_name(self):
         return self.__name
 
@@ -164,100 +1615,1034 @@ class RacingCarEvent:
     def get_date(self):
         return self.__date
 
+    def get_event_date(self):
+        '''
+        Returns the date of the event parsed into a datetime.date.
+        :raises ValueError: if the date is not in one of EVENT_DATE_FORMATS
+        '''
+        if self.__event_date is None:
+            self.__event_date = parse_event_date(self.__date)
+        return self.__event_date
+
     def get_capacity(self):
         return self.__capacity
 
-    def get_total_sales(self):
-        return self.__total_sales
+    def get_total_sales(self):
+        return self.__total_sales
+
+    def get_total_tickets_sold(self):
+        return len(self.__tickets_sold)
+
+    def get_discount_policy(self):
+        return self.__discount_policy
+
+    def get_seat_map(self):
+        return self.__seat_map
+
+    def get_sales_aggregates(self):
+        '''
+        Returns the SalesAggregates of the event, kept up to date on every sale
+        and cancellation.
+        '''
+        return self.__aggregates
+
+    def get_ledger(self):
+        return self.__tickets_sold
+
+    # Setters
+    def set_event_id(self, event_id):
+        self.__event_id = event_id
+
+    def set_name(self, new_name):
+        self.__name = new_name
+
+    def set_location(self, new_location):
+        self.__location = new_location
+        for catalog in self.__catalogs:
+            catalog._reindex_event(self)
+
+    def set_date(self, new_date):
+        # an event in a catalog must keep a date the catalog can index
+        event_date = parse_event_date(new_date) if self.__catalogs else None
+        self.__date = new_date
+        self.__event_date = event_date
+        for catalog in self.__catalogs:
+            catalog._reindex_event(self)
+
+    def set_discount_policy(self,policy):
+        try:
+            with self.__lock:
+                if self.__discount_policy is not None:
+                    self.__discount_policy._detach_event(self)
+                self.__discount_policy = policy
+                if policy is not None:
+                    policy._attach_event(self)
+                self.__log("policy", _policy_record(policy))
+        finally:
+            self.__wait_for_log()
+
+    # Admin methods
+
+    def get_customer_by_id(self,id):
+        '''
+        This method takes the id and returns the customer if the id matches.
+        otherwise it returns false.
+        :param id:
+        :return:
+        '''
+        return self.__registered_customers.get(id)
+
+    def get_customers_by_email(self,email):
+        '''
+        This method returns the list of registered customers with the given email.
+        :param email:
+        :return:
+        '''
+        return self.__registered_customers.find_by_email(email)
+
+    def get_customers_by_phone(self,phone):
+        '''
+        This method returns the list of registered customers with the given phone.
+        :param phone:
+        :return:
+        '''
+        return self.__registered_customers.find_by_phone(phone)
+
+    def search_customers(self, text, start=0, count=50):
+        '''
+        This method finds registered customers by a prefix of their name, email
+        or phone, one page at a time. See CustomerDirectory.search.
+        :return: list of (customer, field matched)
+        '''
+        return self.__registered_customers.search(text, start, count)
+
+    def count_customers_matching(self, text):
+        '''
+        This method returns the number of results of search_customers for the text.
+        '''
+        return self.__registered_customers.count_matches(text)
+
+    def register_customer(self,customer):
+        '''
+        This method registers a customer. A customer whose id is already
+        registered is rejected.
+        :param customer:
+        :return: True if the customer was registered, otherwise False
+        '''
+        try:
+            with self.__lock:
+                if not self.__registered_customers.add(customer):
+                    return False
+                if self.__event_log is not None:
+                    self.__log("register", _customer_record(customer))
+                return True
+        finally:
+            self.__wait_for_log()
+
+    def register_customers(self,customers):
+        '''
+        This method registers a batch of customers under one lock. Customers
+        whose id is already registered are skipped.
+        :param customers:
+        :return: list of the customers registered
+        '''
+        try:
+            with self.__lock:
+                registered = [customer for customer in customers if self.__registered_customers.add(customer)]
+                if registered and self.__event_log is not None:
+                    self.__log("register_many", [_customer_record(customer) for customer in registered])
+                return registered
+        finally:
+            self.__wait_for_log()
+
+    def unregister_customer(self,customer):
+        '''
+        This methos unregisters a customer and removes it from the directory.
+        :param customer:
+        :return: True if the customer was unregistered, otherwise False
+        '''
+        try:
+            with self.__lock:
+                if not self.__registered_customers.remove(customer):
+                    return False
+                self.__log("unregister", customer.get_id())
+                return True
+        finally:
+            self.__wait_for_log()
+
+    def allocate_seat(self,section=None):
+        '''
+        This method takes the next free seat of the event.
+        :param section: optional section of the seat map to take the seat from
+        :return: the seat number, otherwise False if the event is sold out
+        '''
+        return self.__seat_map.allocate_seat(section)
+
+    def release_seat(self,seat):
+        '''
+        This method frees a seat, e.g. after its ticket was cancelled.
+        :param seat:
+        :return: True if the seat was released, otherwise False
+        '''
+        return self.__seat_map.release_seat(seat)
+
+    def add_ticket_sale(self,ticket,customer=None,payment_method=None,promo_code=None):
+        '''
+        This method adds the ticket and adds its price into the sales of the event.
+        No more tickets are accepted once the capacity is reached.
+        :param ticket:
+        :param customer: optional customer the ticket is sold to
+        :param payment_method: optional payment method, a key of PAYMENT_METHOD_CODES
+        :param promo_code: optional promo code of the pricing policy
+        :return: the ticket as stored in the ledger (a LedgerTicketView for a
+                 ColumnarTicketLedger), otherwise False if the event is full
+        '''
+        _check_payment_method(payment_method)
+        try:
+            with self.__lock:
+                return self.__add_ticket_sale(ticket, customer, payment_method, promo_code)
+        finally:
+            self.__wait_for_log()
+
+    def __add_ticket_sale(self, ticket, customer, payment_method, promo_code):
+        # called with the lock held
+        customer_id = customer.get_id() if customer else None
+        if self.__aggregates.get_remaining_capacity() < 1:
+            return False
+
+        price_after_discount = ticket.get_price() * self.__price_factor(ticket.get_ticket_type(), 1, promo_code)
+        sold_at = int(time.time())
+        self.__total_sales += price_after_discount
+        self.__aggregates.record_sale(ticket.get_ticket_type(), payment_method,
+                                      _to_cents(ticket.get_price()), _to_cents(price_after_discount))
+        if self.__event_log is not None:
+            self.__log("sale", ticket.get_ticket_type(), ticket.get_price(), ticket.get_seat_number(),
+                       price_after_discount, customer and _customer_record(customer), payment_method, True,
+                       sold_at)
+        return self.__tickets_sold.append(ticket, price_after_discount, customer_id, payment_method, sold_at)
+
+    def sell_ticket(self,ticket_class,price,customer,section=None,seat=None,payment_method=None,
+                    promo_code=None):
+        '''
+        This method sells one ticket atomically: it reserves a seat, records the
+        sale and adds the ticket to the purchases of the customer. Concurrent
+        calls never sell a seat twice or sell past the capacity.
+        :param ticket_class: SingleRaceTicket, WeekendPackageTicket or SeasonMembershipTicket
+        :param price: price of the ticket
+        :param customer: customer the ticket is sold to
+        :param section: optional section of the seat map to take the seat from
+        :param seat: optional specific seat to sell
+        :param payment_method: optional payment method, a key of PAYMENT_METHOD_CODES
+        :param promo_code: optional promo code of the pricing policy
+        :return: the ticket as stored in the ledger, otherwise False if no seat is available
+        '''
+        _check_payment_method(payment_method)
+        try:
+            with self.__lock:
+                self.__check_promo_code(promo_code)
+                if self.__aggregates.get_remaining_capacity() < 1:
+                    return False
+
+                if seat is None:
+                    seat = self.__seat_map.allocate_seat(section)
+                    if not seat:
+                        return False
+                elif not self.__seat_map.allocate_specific_seat(seat):
+                    return False
+
+                ticket = self.__add_ticket_sale(ticket_class(price, seat), customer, payment_method, promo_code)
+                customer.add_purchase(ticket, self.__purchase_key)
+                return ticket
+        finally:
+            self.__wait_for_log()
+
+    def add_ticket_sales(self,tickets,customer=None,payment_method=None,promo_code=None):
+        '''
+        This method adds a batch of tickets in one go. The whole batch is priced
+        in a single pass and the sales of the event are updated once. The batch
+        counts as one group for the group discounts of a PricingPolicy.
+        Either every ticket is recorded or, if the batch does not fit in the
+        remaining capacity, none is.
+        :param tickets: iterable of tickets
+        :param customer: optional customer the tickets are sold to
+        :param payment_method: optional payment method of the whole batch
+        :param promo_code: optional promo code of the pricing policy
+        :return: list of the tickets as stored in the ledger, otherwise False
+        '''
+        _check_payment_method(payment_method)
+        tickets = list(tickets)
+        try:
+            with self.__lock:
+                return self.__add_ticket_sales(tickets, customer, payment_method, promo_code)
+        finally:
+            self.__wait_for_log()
+
+    def __add_ticket_sales(self, tickets, customer, payment_method, promo_code):
+        # called with the lock held
+        customer_id = customer.get_id() if customer else None
+        if len(tickets) > self.__aggregates.get_remaining_capacity():
+            return False
+        if not tickets:
+            return []
+
+        # Tickets of one type at one price cost the same, so a batch is priced and
+        # added to the sales once per (ticket type, price) group, not per ticket.
+        keys = [(ticket.get_ticket_type(), ticket.get_price()) for ticket in tickets]
+        groups = Counter(keys)
+        paid = {key: key[1] * self.__price_factor(key[0], len(tickets), promo_code) for key in groups}
+        paid_prices = [paid[key] for key in keys]
+
+        sold_at = int(time.time())
+        for (ticket_type, price), count in groups.items():
+            self.__total_sales += paid[ticket_type, price] * count
+            self.__aggregates.record_sale(ticket_type, payment_method, _to_cents(price),
+                                          _to_cents(paid[ticket_type, price]), count)
+        if self.__event_log is not None:
+            self.__log("sales", [(ticket_type, price, ticket.get_seat_number(), paid_price)
+                                 for ticket, (ticket_type, price), paid_price in zip(tickets, keys, paid_prices)],
+                       customer and _customer_record(customer), payment_method, sold_at)
+        return self.__tickets_sold.append_many(tickets, paid_prices, customer_id, payment_method, sold_at)
+
+    def book_tickets(self,ticket_class,price,quantity,customer=None,section=None,payment_method=None,
+                     promo_code=None):
+        '''
+        This method books `quantity` tickets of one type: it takes the seats in
+        bulk, creates the tickets and records them with add_ticket_sales.
+        :param ticket_class: SingleRaceTicket, WeekendPackageTicket or SeasonMembershipTicket
+        :param price: price of one ticket
+        :param quantity:
+        :param customer: optional customer the tickets are sold to, who also gets the purchases
+        :param section: optional section of the seat map to take the seats from
+        :param payment_method: optional payment method, a key of PAYMENT_METHOD_CODES
+        :param promo_code: optional promo code of the pricing policy
+        :return: list of the tickets sold, otherwise False if there are not enough seats
+        '''
+        _check_payment_method(payment_method)
+        try:
+            with self.__lock:
+                self.__check_promo_code(promo_code)
+                if quantity > self.__aggregates.get_remaining_capacity():
+                    return False
+                seats = self.__seat_map.allocate_seats(quantity, section)
+                if seats is False:
+                    return False
+
+                tickets = self.__add_ticket_sales([ticket_class(price, seat) for seat in seats], customer,
+                                                  payment_method, promo_code)
+                if customer:
+                    customer.add_purchases(tickets, self.__purchase_key)
+                return tickets
+        finally:
+            self.__wait_for_log()
+
+    def cancel_ticket(self,ticket,customer):
+        '''
+        This method cancels a sold ticket and refunds it, all in one step: the
+        ticket is invalidated in the ledger, its seat is freed, the price paid
+        is taken off the sales and the aggregates, and it is removed from the
+        purchases of the customer. The seat can be sold again.
+        :param ticket: the ticket as stored in the ledger
+        :param customer: the customer who bought the ticket
+        :return: True if the ticket was cancelled, otherwise False if it is not
+                 a valid ticket of this event bought by the customer
+        '''
+        try:
+            with self.__lock:
+                index = ticket.get_ticket_id()
+                if (index is None or not ticket.is_valid()
+                        or customer.get_purchase(index, self.__purchase_key) != ticket):
+                    return False
+
+                paid_price = self.__tickets_sold.get_paid_price(index)
+                ticket.invalidate()
+                self.__seat_map.release_seat(ticket.get_seat_number())
+                self.__serve_waitlist()
+                self.__total_sales -= paid_price
+                self.__aggregates.record_cancellation(ticket.get_ticket_type(),
+                                                      self.__tickets_sold.get_payment_method(index),
+                                                      _to_cents(ticket.get_price()), _to_cents(paid_price))
+                customer.cancel_purchase(ticket, self.__purchase_key)
+                self.__cancelled.append(index)
+                self.__log("cancel", index, customer.get_id())
+                return True
+        finally:
+            self.__wait_for_log()
+
+    def get_cancelled_since(self,position):
+        '''
+        Returns the ids of the tickets cancelled with cancel_ticket after the
+        first `position` cancellations, e.g. to save only the new ones.
+        :param position: number of cancellations already handled, 0 for all
+        :return: (list of ticket ids, position to pass next time)
+        '''
+        with self.__lock:
+            return self.__cancelled[position:].tolist(), len(self.__cancelled)
+
+    def cancel_ticket_by_id(self,ticket_id,customer):
+        '''
+        Cancels and refunds a ticket of the customer given by its ticket id, see cancel_ticket.
+        :param ticket_id:
+        :param customer:
+        :return: the cancelled ticket, otherwise False
+        '''
+        # cancel_ticket checks again under the lock that the customer still holds the ticket
+        ticket = customer.get_purchase(ticket_id, self.__purchase_key)
+        if not ticket or not self.cancel_ticket(ticket, customer):
+            return False
+        return ticket
+
+    def restore_ticket_sale(self,ticket,paid_price,customer=None,payment_method=None,sold_at=None):
+        '''
+        This method puts back a sale recorded earlier, e.g. when loading the event
+        from storage. The price paid is taken as given instead of applying the
+        discount policy again. A valid ticket takes its seat again and counts in
+        the sales; a cancelled one was refunded, so it is only kept in the ledger.
+        :param ticket:
+        :param paid_price:
+        :param customer: optional customer the ticket was sold to, who gets the purchase back
+        :param payment_method: optional payment method the ticket was paid with
+        :param sold_at: optional time of the sale in seconds since the epoch, now if None
+        :return: the ticket as stored in the ledger
+        '''
+        _check_payment_method(payment_method)
+        customer_id = customer.get_id() if customer else None
+        if sold_at is None:
+            sold_at = int(time.time())
+        try:
+            with self.__lock:
+                valid = ticket.is_valid()
+                if valid:
+                    self.__seat_map.allocate_specific_seat(ticket.get_seat_number())
+                    self.__aggregates.record_sale(ticket.get_ticket_type(), payment_method,
+                                                  _to_cents(ticket.get_price()), _to_cents(paid_price))
+                    self.__total_sales += paid_price
+                if self.__event_log is not None:
+                    self.__log("sale", ticket.get_ticket_type(), ticket.get_price(), ticket.get_seat_number(),
+                               paid_price, customer and _customer_record(customer), payment_method, valid, sold_at)
+                ticket = self.__tickets_sold.append(ticket, paid_price, customer_id, payment_method, sold_at)
+        finally:
+            self.__wait_for_log()
+        if customer and valid:
+            customer.add_purchase(ticket, self.__purchase_key)
+        return ticket
+
+    # Seat holds and waitlists
+
+    def hold_seats(self,ticket_class,price,quantity=1,customer=None,section=None,ttl=DEFAULT_HOLD_TTL):
+        '''
+        This method sets seats aside for `ttl` seconds, e.g. while the customer
+        pays. The seats count as taken until the hold is confirmed with
+        confirm_hold, released with release_hold, or expires; expired holds are
+        released by the HoldExpiryTimer and the freed seats go to the waitlist.
+        :param ticket_class: class of the tickets sold when the hold is confirmed
+        :param price: price of one ticket
+        :param quantity: number of seats
+        :param customer: optional customer the seats are held for
+        :param section: optional section of the seat map to take the seats from
+        :param ttl: seconds the hold lasts
+        :return: the SeatHold, otherwise False if there are not enough free seats
+        '''
+        with self.__lock:
+            self.__expire_holds(time.monotonic())
+            return self.__create_hold(ticket_class, price, quantity, customer, section, ttl)
+
+    def confirm_hold(self,hold_id,customer=None,payment_method=None,promo_code=None):
+        '''
+        This method sells the held seats, see book_tickets. A hold that expired
+        in the meantime cannot be confirmed.
+        :param hold_id:
+        :param customer: customer the tickets are sold to, the customer of the hold if None
+        :param payment_method: optional payment method, a key of PAYMENT_METHOD_CODES
+        :param promo_code: optional promo code of the pricing policy
+        :return: list of the tickets sold, otherwise False if the hold is unknown or expired,
+                 or if the capacity left cannot take the held seats, which are then released
+        '''
+        _check_payment_method(payment_method)
+        try:
+            with self.__lock:
+                self.__check_promo_code(promo_code)
+                self.__expire_holds(time.monotonic())
+                hold = self.__holds.get(hold_id)
+                if hold is None:
+                    return False
+
+                customer = customer or hold.get_customer()
+                # if the sale raises, the hold stays until it is released or expires
+                tickets = self.__add_ticket_sales([hold.get_ticket_class()(hold.get_price(), seat)
+                                                   for seat in hold.get_seats()], customer, payment_method, promo_code)
+                del self.__holds[hold_id]
+                if tickets is False:
+                    for seat in hold.get_seats():
+                        self.__seat_map.release_seat(seat)
+                    self.__serve_waitlist()
+                    return False
+                if customer:
+                    customer.add_purchases(tickets, self.__purchase_key)
+                return tickets
+        finally:
+            self.__wait_for_log()
+
+    def release_hold(self,hold_id):
+        '''
+        This method gives the seats of a hold back before it expires.
+        :param hold_id:
+        :return: True if the hold was released, otherwise False
+        '''
+        with self.__lock:
+            hold = self.__holds.pop(hold_id, None)
+            if hold is None:
+                return False
+            for seat in hold.get_seats():
+                self.__seat_map.release_seat(seat)
+            self.__serve_waitlist()
+            return True
+
+    def get_hold(self,hold_id):
+        '''
+        Returns the SeatHold with the given id, otherwise False if it was
+        confirmed, released or has expired.
+        '''
+        hold = self.__holds.get(hold_id)
+        if hold is None or hold.get_expires_at() <= time.monotonic():
+            return False
+        return hold
+
+    def get_active_holds(self):
+        '''
+        Returns the number of holds not confirmed, released or expired yet.
+        '''
+        return len(self.__holds)
+
+    def expire_holds(self):
+        '''
+        This method releases the holds whose time is up. The HoldExpiryTimer
+        calls it at the deadlines, so it is only needed to expire holds at once.
+        :return: the number of holds released
+        '''
+        with self.__lock:
+            return self.__expire_holds(time.monotonic())
+
+    def join_waitlist(self,ticket_class,price,customer,quantity=1,section=None,ttl=DEFAULT_HOLD_TTL,
+                      on_hold=None):
+        '''
+        This method puts a customer on the waitlist of a ticket type. Whenever
+        seats are freed, the customers who have waited the longest get holds
+        for them (see hold_seats), which they confirm as usual. The customer is
+        served at once if the seats are free already.
+        :param ticket_class: SingleRaceTicket, WeekendPackageTicket or SeasonMembershipTicket
+        :param price: price of one ticket
+        :param customer: the waiting customer
+        :param quantity: number of seats wanted, served all together
+        :param section: optional section of the seat map
+        :param ttl: seconds the hold given to the customer lasts
+        :param on_hold: called with the SeatHold once the customer is served,
+            with the event lock held, so it should only hand the hold on
+        :return: the id of the waitlist entry
+        '''
+        with self.__lock:
+            entry_id = self.__next_waitlist_id
+            self.__next_waitlist_id += 1
+            entry = _WaitlistEntry(entry_id, ticket_class, price, quantity, customer, section, ttl, on_hold)
+            self.__waitlists.setdefault(ticket_class.TICKET_TYPE, deque()).append(entry)
+            self.__waitlist_entries[entry_id] = entry
+            self.__serve_waitlist()
+            return entry_id
+
+    def leave_waitlist(self,entry_id):
+        '''
+        This method takes an entry off the waitlist.
+        :param entry_id:
+        :return: True if the entry was still waiting, otherwise False
+        '''
+        with self.__lock:
+            # the entry stays in its queue and is skipped when it reaches the front
+            return self.__waitlist_entries.pop(entry_id, None) is not None
+
+    def get_waitlist_length(self,ticket_type=None):
+        '''
+        Returns the number of entries waiting for a ticket type, or for any type if None.
+        :param ticket_type: a key of TICKET_TYPE_CODES
+        '''
+        with self.__lock:
+            if ticket_type is None:
+                return len(self.__waitlist_entries)
+            return sum(1 for entry in self.__waitlists.get(ticket_type, ())
+                       if entry.entry_id in self.__waitlist_entries)
+
+    def __create_hold(self, ticket_class, price, quantity, customer, section, ttl):
+        # called with the lock held
+        seats = self.__seat_map.allocate_seats(quantity, section)
+        if seats is False:
+            return False
+        hold_id = self.__next_hold_id
+        self.__next_hold_id += 1
+        hold = SeatHold(hold_id, ticket_class, price, seats, customer, time.monotonic() + ttl)
+        self.__holds[hold_id] = hold
+        heapq.heappush(self.__hold_deadlines, (hold.get_expires_at(), hold_id))
+        self.__schedule_expiry()
+        return hold
+
+    def __expire_holds(self, now):
+        # called with the lock held; pops the deadlines that passed, skipping the
+        # holds confirmed or released before their deadline
+        deadlines = self.__hold_deadlines
+        expired = 0
+        while deadlines and deadlines[0][0] <= now:
+            _, hold_id = heapq.heappop(deadlines)
+            hold = self.__holds.pop(hold_id, None)
+            if hold is None:
+                continue
+            for seat in hold.get_seats():
+                self.__seat_map.release_seat(seat)
+            expired += 1
+        if expired:
+            self.__serve_waitlist()
+        return expired
+
+    def __schedule_expiry(self):
+        # called with the lock held, asks the timer to call back at the earliest deadline
+        if not self.__hold_deadlines:
+            return
+        deadline = self.__hold_deadlines[0][0]
+        if self.__scheduled_expiry is None or deadline < self.__scheduled_expiry:
+            self.__scheduled_expiry = deadline
+            get_hold_expiry_timer().schedule(self, deadline)
+
+    def _expire_scheduled(self, deadline):
+        # called by the HoldExpiryTimer
+        with self.__lock:
+            if self.__scheduled_expiry == deadline:
+                self.__scheduled_expiry = None
+            self.__expire_holds(time.monotonic())
+            self.__schedule_expiry()
+
+    def __serve_waitlist(self):
+        # called with the lock held whenever seats are freed: gives holds to the
+        # entries that waited the longest, as long as their seats are free
+        while self.__waitlist_entries:
+            first = None
+            for queue in self.__waitlists.values():
+                while queue and queue[0].entry_id not in self.__waitlist_entries:
+                    queue.popleft()
+                if (queue and queue[0].quantity <= self.__seat_map.get_free_seats(queue[0].section)
+                        and (first is None or queue[0].entry_id < first.entry_id)):
+                    first = queue[0]
+            if first is None:
+                return
+            self.__waitlists[first.ticket_class.TICKET_TYPE].popleft()
+            del self.__waitlist_entries[first.entry_id]
+            hold = self.__create_hold(first.ticket_class, first.price, first.quantity, first.customer,
+                                      first.section, first.ttl)
+            if first.on_hold is not None:
+                first.on_hold(hold)
 
-    def get_total_tickets_sold(self):
-        return len(self.__tickets_sold)
+    def get_total_customers(self):
+        '''
+        This returns the number of total registered customers
+        :return:
+        '''
+        return len(self.__registered_customers)
 
-    def get_discount_policy(self):
-        return self.__discount_policy
+    def get_registered_customers(self):
+        '''
+        This returns the list of registered customers
+        :return:
+        '''
+        return list(self.__registered_customers)
 
-    # Setters
-    def set_name(self, new_name):
-        self.__name = new_name
+    def save(self,storage):
+        '''
+        This method saves the event, its discount policy, registered customers
+        and tickets through a storage backend (see storage.py).
+        :param storage:
+        :return: the id of the event in the storage
+        '''
+        with self.__lock:
+            return storage.save_event(self)
 
-    def set_location(self, new_location):
-        self.__location = new_location
+    @staticmethod
+    def load(storage,event_id):
+        '''
+        Loads an event with everything saved by save() from a storage backend.
+        :return: the event, otherwise False if it is not stored
+        '''
+        return storage.load_event(event_id)
+
+    def __price_factor(self, ticket_type, quantity, promo_code):
+        policy = self.__discount_policy
+        if policy is None:
+            self.__check_promo_code(promo_code)
+            return 1.0
+        return policy.get_price_factor(ticket_type, quantity, promo_code)
+
+    def __check_promo_code(self, promo_code):
+        # checked before a seat is taken, so an unknown code has no side effects
+        policy = self.__discount_policy
+        if promo_code is not None and (policy is None or not policy.is_promo_code(promo_code)):
+            raise ValueError("Unknown promo code {}".format(promo_code))
+
+    def __log(self, operation, *args):
+        # called with the lock held, so the log has the operations in the order they were applied
+        event_log = self.__event_log
+        if event_log is not None:
+            event_log._append((operation,) + args)
+
+    def __wait_for_log(self):
+        # called once the lock is released, so that a synchronous log commits
+        # the records of concurrent operations together
+        event_log = self.__event_log
+        if event_log is not None:
+            event_log._wait_for_commit()
+
+    # catalog bookkeeping, used by EventCatalog
+    def _attach_catalog(self, catalog):
+        self.__catalogs.append(catalog)
+
+    def _detach_catalog(self, catalog):
+        for index, attached in enumerate(self.__catalogs):
+            if attached is catalog:
+                del self.__catalogs[index]
+                return
+
+    # log bookkeeping, used by EventLog and DiscountPolicy
+    def _attach_log(self, event_log):
+        with self.__lock:
+            self.__event_log = event_log
+
+    def _detach_log(self, event_log):
+        with self.__lock:
+            if self.__event_log is event_log:
+                self.__event_log = None
+
+    def _get_lock(self):
+        return self.__lock
+
+    def _discount_policy_changed(self, policy):
+        try:
+            with self.__lock:
+                if policy is self.__discount_policy:
+                    self.__log("policy", _policy_record(policy))
+        finally:
+            self.__wait_for_log()
+
+    def __getstate__(self):
+        # the catalogs and the log hold the event, not the other way round
+        state = self.__dict__.copy()
+        state["_RacingCarEvent__catalogs"] = []
+        state["_RacingCarEvent__event_log"] = None
+        # holds and waitlists do not outlive the process, the held seats are freed when loading
+        state["_RacingCarEvent__held_seats"] = [seat for hold in self.__holds.values() for seat in hold.get_seats()]
+        state["_RacingCarEvent__holds"] = {}
+        state["_RacingCarEvent__hold_deadlines"] = []
+        state["_RacingCarEvent__scheduled_expiry"] = None
+        state["_RacingCarEvent__waitlists"] = {}
+        state["_RacingCarEvent__waitlist_entries"] = {}
+        del state["_RacingCarEvent__lock"]
+        return state
+
+    def __setstate__(self, state):
+        # events pickled before the purchase key keyed the purchases by their id
+        state.setdefault("_RacingCarEvent__purchase_key", state["_RacingCarEvent__event_id"])
+        state.setdefault("_RacingCarEvent__catalogs", [])
+        state.setdefault("_RacingCarEvent__event_date", None)
+        state.setdefault("_RacingCarEvent__event_log", None)
+        held_seats = state.pop("_RacingCarEvent__held_seats", [])
+        state.setdefault("_RacingCarEvent__cancelled", array("q"))
+        for name, default in (("holds", {}), ("hold_deadlines", []), ("next_hold_id", 1), ("scheduled_expiry", None),
+                              ("waitlists", {}), ("waitlist_entries", {}), ("next_waitlist_id", 1)):
+            state.setdefault("_RacingCarEvent__" + name, default)
+        self.__dict__.update(state)
+        self.__lock = threading.RLock()
+        for seat in held_seats:
+            self.__seat_map.release_seat(seat)
+        if self.__discount_policy is not None:
+            self.__discount_policy._attach_event(self)
+
+
+# accepted formats of event dates, the first one is used by the demo event
+EVENT_DATE_FORMATS = ("%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y", "%d.%m.%Y")
+
+
+def parse_event_date(date):
+    '''
+    Parses the date of an event, e.g. "05/09/2025" (day/month/year) or "2025-09-05".
+    :param date: a string in one of EVENT_DATE_FORMATS, or a datetime.date
+    :return: datetime.date
+    :raises ValueError: if the date is in none of the formats
+    '''
+    import datetime
+
+    if isinstance(date, datetime.date):
+        return date
+    for date_format in EVENT_DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(date.strip(), date_format).date()
+        except ValueError:
+            pass
+    raise ValueError("Unrecognised event date {}".format(date))
+
+
+def _location_key(location):
+    return location.strip().casefold()
+
+
+class EventCatalog:
+    '''
+    Catalog of many events with sorted indexes on date and location.
+
+    The date index is a sorted list of (date ordinal, event id) and every
+    location has its own sorted list, so a range query such as "all events
+    in March at Yas Marina" is two binary searches plus the events found,
+    whatever the size of the catalog. Locations are matched case-insensitively.
+
+    Every event keeps its own customers, tickets and seats. The catalog also
+    holds one directory of customers shared by all its events: customers
+    registered through the catalog are the same Customer object in every
+    event, so their purchase history spans the season.
+    '''
+    def __init__(self):
+        self.__events = {}
+        self.__keys = {}  # event id -> (date ordinal, location key) as indexed
+        self.__by_date = []  # sorted (date ordinal, event id)
+        self.__by_location = {}  # location key -> sorted (date ordinal, event id)
+        self.__locations = []  # sorted location keys
+        self.__location_names = {}  # location key -> location as first given
+        self.__customers = CustomerDirectory()
+        self.__customer_events = {}  # customer id -> set of event ids
+        self.__next_id = 1
+        self.__lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.__events)
+
+    def __iter__(self):
+        '''
+        Iterates over the events in date order.
+        '''
+        return iter(self.__collect(self.__by_date))
 
-    def set_date(self, new_date):
-        self.__date = new_date
+    def __contains__(self, event_id):
+        return event_id in self.__events
 
-    def set_discount_policy(self,policy):
-        self.__discount_policy = policy
+    # events
+    def add_event(self, event):
+        '''
+        Adds an event to the catalog. An event without an id gets the next free
+        one. Customers already registered for the event join the shared
+        customers of the catalog.
+        :param event:
+        :return: the id of the event, otherwise False if the id is taken or one
+                 of its customers clashes with another customer of the same id
+        :raises ValueError: if the date of the event cannot be parsed
+        '''
+        ordinal = event.get_event_date().toordinal()
+        with self.__lock:
+            event_id = event.get_event_id()
+            if event_id is None:
+                while self.__next_id in self.__events:
+                    self.__next_id += 1
+                event_id = self.__next_id
+            elif event_id in self.__events:
+                return False
+
+            customers = event.get_registered_customers()
+            for customer in customers:
+                known = self.__customers.get(customer.get_id())
+                if known and known is not customer:
+                    return False
+
+            event.set_event_id(event_id)
+            self.__events[event_id] = event
+            self.__index(event_id, ordinal, event.get_location())
+            for customer in customers:
+                self.__customers.add(customer)
+                self.__customer_events.setdefault(customer.get_id(), set()).add(event_id)
+            event._attach_catalog(self)
+            return event_id
+
+    def remove_event(self, event_id):
+        '''
+        Removes an event. Its customers stay in the catalog.
+        :return: True if the event was removed, otherwise False
+        '''
+        with self.__lock:
+            event = self.__events.pop(event_id, None)
+            if event is None:
+                return False
+            self.__unindex(event_id)
+            for customer in event.get_registered_customers():
+                self.__customer_events.get(customer.get_id(), set()).discard(event_id)
+            event._detach_catalog(self)
+            return True
+
+    def get_event(self, event_id):
+        '''
+        Returns the event with the given id, otherwise False.
+        '''
+        return self.__events.get(event_id, False)
 
-    # Admin methods
+    def get_locations(self):
+        '''
+        Returns the locations of the events in alphabetical order.
+        '''
+        return [self.__location_names[key] for key in self.__locations]
 
-    def get_customer_by_id(self,id):
+    def find_events(self, start=None, end=None, location=None):
         '''
-        This method takes the id and returns the customer if the id matches.
-        otherwise it returns false.
-        :param id:
-        :return:
+        Returns the events from `start` to `end` (both included) in date order.
+        :param start: optional first date, a string as accepted by parse_event_date or a datetime.date
+        :param end: optional last date
+        :param location: optional location the events must be at
+        :return: list of events
         '''
-        for customer in self.__registered_customers:
-            if id == customer.get_id():
-                return customer
+        low = parse_event_date(start).toordinal() if start is not None else -1
+        high = parse_event_date(end).toordinal() if end is not None else math.inf
+        with self.__lock:
+            if location is None:
+                index = self.__by_date
+            else:
+                index = self.__by_location.get(_location_key(location), [])
+            first = bisect.bisect_left(index, (low,))
+            last = bisect.bisect_right(index, (high, math.inf))
+            return self.__collect(index[first:last])
+
+    def find_events_in_month(self, year, month, location=None):
+        '''
+        Returns the events of one month in date order, optionally at one location.
+        '''
+        import datetime
 
-        return False
+        start = datetime.date(year, month, 1)
+        end = datetime.date(year + month // 12, month % 12 + 1, 1) - datetime.timedelta(days=1)
+        return self.find_events(start, end, location)
 
-    def register_customer(self,customer):
+    # customers
+    def register_customer(self, event_id, customer):
         '''
-        This method registers a customer.
+        Registers a customer for an event. A customer the catalog already knows
+        by id is registered as the existing Customer object.
+        :param event_id:
         :param customer:
-        :return:
+        :return: the customer as registered, otherwise False if the event does not
+                 exist or the customer is already registered for it
         '''
-        self.__registered_customers.append(customer)
-
-    def unregister_customer(self,customer):
+        with self.__lock:
+            event = self.__events.get(event_id)
+            if event is None:
+                return False
+            known = self.__customers.get(customer.get_id())
+            if known:
+                customer = known
+            if not event.register_customer(customer):
+                return False
+            self.__customers.add(customer)
+            self.__customer_events.setdefault(customer.get_id(), set()).add(event_id)
+            return customer
+
+    def unregister_customer(self, event_id, customer_id):
         '''
-        This methos unregisters a customer and removes it from the list.
-        :param customer:
-        :return:
+        :return: True if the customer was unregistered from the event, otherwise False
         '''
-        self.__registered_customers.remove(customer)
-
-    def add_ticket_sale(self,ticket):
+        with self.__lock:
+            event = self.__events.get(event_id)
+            customer = self.__customers.get(customer_id)
+            if event is None or not customer or not event.unregister_customer(customer):
+                return False
+            self.__customer_events[customer_id].discard(event_id)
+            return True
+
+    def get_customer(self, customer_id):
         '''
-        This method adds the ticket and adds its price into the sales of the event.
-        :param ticket:
-        :return:
+        Returns the customer with the given id, otherwise False.
         '''
-        if self.get_discount_policy().is_discount_active():
-            price_after_discount = self.get_discount_policy().apply_discount(ticket.get_price())
+        return self.__customers.get(customer_id)
 
-            self.__total_sales += price_after_discount
-            self.__tickets_sold.append(ticket)
-        else:
-            self.__total_sales += ticket.get_price()
-            self.__tickets_sold.append(ticket)
+    def get_customers(self):
+        return list(self.__customers)
 
+    def find_customers_by_email(self, email):
+        return self.__customers.find_by_email(email)
 
-    def get_total_customers(self):
+    def find_customers_by_phone(self, phone):
+        return self.__customers.find_by_phone(phone)
+
+    def get_customer_events(self, customer_id):
         '''
-        This returns the number of total registered customers
-        :return:
+        Returns the events a customer is registered for, in date order.
         '''
-        return len(self.__registered_customers)
+        with self.__lock:
+            event_ids = self.__customer_events.get(customer_id, ())
+            return sorted((self.__events[event_id] for event_id in event_ids),
+                          key=lambda event: self.__keys[event.get_event_id()])
+
+    # called by RacingCarEvent when its date or location changes
+    def _reindex_event(self, event):
+        with self.__lock:
+            event_id = event.get_event_id()
+            self.__unindex(event_id)
+            self.__index(event_id, event.get_event_date().toordinal(), event.get_location())
+
+    def __index(self, event_id, ordinal, location):
+        key = _location_key(location)
+        entry = (ordinal, event_id)
+        self.__keys[event_id] = (ordinal, key)
+        bisect.insort(self.__by_date, entry)
+        if key not in self.__by_location:
+            self.__by_location[key] = []
+            self.__location_names[key] = location
+            bisect.insort(self.__locations, key)
+        bisect.insort(self.__by_location[key], entry)
+
+    def __unindex(self, event_id):
+        ordinal, key = self.__keys.pop(event_id)
+        entry = (ordinal, event_id)
+        self.__remove_entry(self.__by_date, entry)
+        events = self.__by_location[key]
+        self.__remove_entry(events, entry)
+        if not events:
+            del self.__by_location[key]
+            del self.__location_names[key]
+            self.__remove_entry(self.__locations, key)
+
+    @staticmethod
+    def __remove_entry(index, entry):
+        del index[bisect.bisect_left(index, entry)]
+
+    def __collect(self, entries):
+        return [self.__events[event_id] for _, event_id in entries]
+
+    def __getstate__(self):
+        return {"events": list(self.__events.values())}
+
+    def __setstate__(self, state):
+        self.__init__()
+        for event in state["events"]:
+            self.add_event(event)
 
 
 class DiscountPolicy:
     def __init__(self, discount_pct, policy_state):
         self.__discount_active = policy_state
         self.__discount_percentage = discount_pct
+        self.__events = []  # events using the policy, told about every change
+        self.__update_factor()
 
     def enable_discount(self):
         self.__discount_active = True
+        self.__update_factor()
+        self._changed()
 
     def disable_discount(self):
         self.__discount_active = False
+        self.__update_factor()
+        self._changed()
 
     def is_discount_active(self):
         return self.__discount_active
 
+    def get_discount_percentage(self):
+        return self.__discount_percentage
+
     def apply_discount(self, original_price):
         """
         Apply discount to the original price if policy is active
@@ -267,56 +2652,1277 @@ class DiscountPolicy:
             return original_price * (1 - self.__discount_percentage / 100)
         return original_price
 
+    def get_price_factor(self, ticket_type, quantity=1, promo_code=None):
+        '''
+        Returns the factor a ticket price is multiplied with. The factor is
+        worked out when the discount is switched on or off, not per ticket.
+        :param ticket_type: e.g. "SINGLE_RACE"
+        :param quantity: number of tickets bought together
+        :param promo_code: must be None, this policy has no promo codes
+        :return: the factor, e.g. 0.9 for 10% off
+        '''
+        if promo_code is not None:
+            raise ValueError("Unknown promo code {}".format(promo_code))
+        return self.__factor
+
+    def is_promo_code(self, code):
+        return False
+
     def get_policy_details(self):
         if self.__discount_active:
             return f"{self.__discount_percentage}% discount"
         return "No discount"
 
+    # event bookkeeping, used by RacingCarEvent.set_discount_policy
+    def _attach_event(self, event):
+        self.__events.append(event)
+
+    def _detach_event(self, event):
+        for index, attached in enumerate(self.__events):
+            if attached is event:
+                del self.__events[index]
+                return
+
+    def _changed(self):
+        for event in self.__events:
+            event._discount_policy_changed(self)
+
+    def __update_factor(self):
+        self.__factor = 1 - self.__discount_percentage / 100 if self.__discount_active else 1.0
+
+    def __getstate__(self):
+        # the events hold the policy, not the other way round
+        state = self.__dict__.copy()
+        state["_DiscountPolicy__events"] = []
+        return state
+
+    def __setstate__(self, state):
+        state.setdefault("_DiscountPolicy__events", [])
+        self.__dict__.update(state)
+
+
+
+class PricingPolicy(DiscountPolicy):
+    '''
+    Discount policy with pricing rules on top of the single percentage of
+    DiscountPolicy: early-bird windows, tiered group discounts, promos per
+    ticket type and promo codes.
+
+    The rules in force are compiled into a table of price factors keyed by
+    (ticket type, group tier, promo code), so pricing a ticket is one lookup
+    and one multiplication. The table is rebuilt only after a rule changes,
+    the discount is switched on or off, or an early-bird window opens or
+    closes. Discounts that apply together are multiplied, e.g. 10% and 20%
+    give 28% off.
+    '''
+    def __init__(self, discount_pct=0, policy_state=False):
+        super().__init__(discount_pct, policy_state)
+        self.__early_bird = []  # (start, end, percentage), times in seconds since the epoch
+        self.__tier_quantities = []  # minimum group size of each tier, ascending
+        self.__tier_percentages = []
+        self.__type_promos = {}  # ticket type -> percentage
+        self.__promo_codes = {}  # code -> (percentage, ticket types or None for all)
+        self.__table = None
+        self.__valid_from = 0
+        self.__valid_until = 0
+
+    # rules
+    def add_early_bird(self, start, end, percentage):
+        '''
+        Gives `percentage` off to tickets sold from `start` until `end`, both in
+        seconds since the epoch. Of overlapping windows the largest discount applies.
+        :return:
+        '''
+        if end <= start:
+            raise ValueError("Early-bird window ends before it starts")
+        self.__early_bird.append((start, end, percentage))
+        self.__rules_changed()
+
+    def set_group_tiers(self, tiers):
+        '''
+        Replaces the group discounts.
+        :param tiers: iterable of (minimum quantity, percentage), e.g. [(5, 5), (10, 12)]
+        :return:
+        '''
+        tiers = sorted(tiers)
+        if any(quantity < 2 for quantity, _ in tiers):
+            raise ValueError("A group tier needs a minimum quantity of at least 2")
+        self.__tier_quantities = [quantity for quantity, _ in tiers]
+        self.__tier_percentages = [percentage for _, percentage in tiers]
+        self.__rules_changed()
+
+    def set_ticket_type_promo(self, ticket_type, percentage):
+        '''
+        Gives `percentage` off every ticket of one type, 0 removes the promo.
+        :param ticket_type: e.g. "SINGLE_RACE"
+        :return:
+        '''
+        if ticket_type not in TICKET_TYPE_CODES:
+            raise ValueError("Unknown ticket type {}".format(ticket_type))
+        if percentage:
+            self.__type_promos[ticket_type] = percentage
+        else:
+            self.__type_promos.pop(ticket_type, None)
+        self.__rules_changed()
+
+    def add_promo_code(self, code, percentage, ticket_types=None):
+        '''
+        Adds or replaces a promo code.
+        :param code:
+        :param percentage:
+        :param ticket_types: optional ticket types the code is valid for, all types if None
+        :return:
+        '''
+        if ticket_types is not None:
+            ticket_types = frozenset(ticket_types)
+        self.__promo_codes[code] = (percentage, ticket_types)
+        self.__rules_changed()
+
+    def remove_promo_code(self, code):
+        '''
+        :return: True if the code was removed, otherwise False
+        '''
+        if self.__promo_codes.pop(code, None) is None:
+            return False
+        self.__rules_changed()
+        return True
+
+    def is_promo_code(self, code):
+        return code in self.__promo_codes
+
+    def enable_discount(self):
+        super().enable_discount()
+        self.__invalidate()
+
+    def disable_discount(self):
+        super().disable_discount()
+        self.__invalidate()
+
+    # pricing
+    def get_price_factor(self, ticket_type, quantity=1, promo_code=None):
+        '''
+        Returns the factor a ticket price is multiplied with.
+        :param ticket_type: e.g. "SINGLE_RACE"
+        :param quantity: number of tickets bought together, selects the group tier
+        :param promo_code: optional promo code
+        :return: the factor, e.g. 0.9 for 10% off
+        :raises ValueError: if the promo code is unknown
+        '''
+        now = time.time()
+        table = self.__table
+        if table is None or not self.__valid_from <= now < self.__valid_until:
+            table = self.__compile(now)
+        tier = bisect.bisect_right(self.__tier_quantities, quantity)
+        try:
+            return table[ticket_type, tier, promo_code]
+        except KeyError:
+            raise ValueError("Unknown promo code {}".format(promo_code)) from None
+
+    def apply_discount(self, original_price):
+        '''
+        Prices a ticket of unknown type: only the rules that apply to every
+        ticket are used.
+        '''
+        return original_price * self.__compile_factor(None, 0, None, time.time())
+
+    def get_policy_details(self):
+        details = [super().get_policy_details()] if self.is_discount_active() else []
+        if self.__early_bird:
+            details.append("early bird")
+        if self.__tier_quantities:
+            details.append("group tiers")
+        if self.__type_promos:
+            details.append("ticket promos")
+        if self.__promo_codes:
+            details.append("promo codes")
+        return ", ".join(details) if details else "No discount"
+
+    def get_rules(self):
+        '''
+        Returns the rules as a dictionary of plain values, e.g. to save them.
+        '''
+        return {
+            "early_bird": [list(window) for window in self.__early_bird],
+            "group_tiers": [list(tier) for tier in zip(self.__tier_quantities, self.__tier_percentages)],
+            "ticket_type_promos": dict(self.__type_promos),
+            "promo_codes": {code: [percentage, sorted(types) if types is not None else None]
+                            for code, (percentage, types) in self.__promo_codes.items()},
+        }
+
+    @staticmethod
+    def from_rules(discount_pct, policy_state, rules):
+        '''
+        Creates a policy from the percentage, the state and the rules returned by get_rules().
+        '''
+        policy = PricingPolicy(discount_pct, policy_state)
+        for start, end, percentage in rules.get("early_bird", []):
+            policy.add_early_bird(start, end, percentage)
+        policy.set_group_tiers(rules.get("group_tiers", []))
+        for ticket_type, percentage in rules.get("ticket_type_promos", {}).items():
+            policy.set_ticket_type_promo(ticket_type, percentage)
+        for code, (percentage, ticket_types) in rules.get("promo_codes", {}).items():
+            policy.add_promo_code(code, percentage, ticket_types)
+        return policy
+
+    def __invalidate(self):
+        self.__table = None
+
+    def __rules_changed(self):
+        self.__invalidate()
+        self._changed()
+
+    def __compile(self, now):
+        # every key is filled in, so a lookup never evaluates a rule
+        promo_codes = [None] + list(self.__promo_codes)
+        table = {}
+        for ticket_type in TICKET_TYPE_CODES:
+            for tier in range(len(self.__tier_quantities) + 1):
+                for code in promo_codes:
+                    table[ticket_type, tier, code] = self.__compile_factor(ticket_type, tier, code, now)
+
+        # the table holds until the next early-bird window opens or closes
+        valid_from, valid_until = float("-inf"), float("inf")
+        for start, end, _ in self.__early_bird:
+            for boundary in (start, end):
+                if boundary <= now:
+                    valid_from = max(valid_from, boundary)
+                else:
+                    valid_until = min(valid_until, boundary)
+        self.__valid_from, self.__valid_until = valid_from, valid_until
+        self.__table = table
+        return table
+
+    def __compile_factor(self, ticket_type, tier, promo_code, now):
+        percentages = []
+        if self.is_discount_active():
+            percentages.append(self.get_discount_percentage())
+        percentages.append(max([percentage for start, end, percentage in self.__early_bird
+                                if start <= now < end], default=0))
+        if tier:
+            percentages.append(self.__tier_percentages[tier - 1])
+        percentages.append(self.__type_promos.get(ticket_type, 0))
+        if promo_code is not None:
+            percentage, ticket_types = self.__promo_codes[promo_code]
+            if ticket_types is None or ticket_type in ticket_types:
+                percentages.append(percentage)
+
+        factor = 1.0
+        for percentage in percentages:
+            factor *= 1 - percentage / 100
+        return max(factor, 0.0)
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state["_PricingPolicy__table"] = None
+        return state
+
+
+_numpy = None
+
+
+def _to_cents(amount):
+    return int(round(amount * 100))
+
+
+def _figures_in_dollars(figures):
+    '''
+    Turns a (tickets, revenue in cents) pair of SalesAggregates into (tickets, dollars).
+    '''
+    count, cents = figures
+    return count, cents / 100
+
+
+def _load_numpy():
+    '''
+    Imports NumPy on first use. NumPy is optional, batch operations fall back
+    to plain Python when it is not installed.
+    :return: the numpy module, otherwise None
+    '''
+    global _numpy
+    if _numpy is None:
+        try:
+            import numpy
+        except ImportError:
+            numpy = False
+        _numpy = numpy
+    return _numpy or None
+
+
+def _snapshot_unpickler(file):
+    '''
+    Returns an unpickler for a snapshot file. Snapshots written while the app
+    ran as a script record their classes under "__main__".
+    :param file:
+    :return:
+    '''
+    import pickle
+
+    class SnapshotUnpickler(pickle.Unpickler):
+        def find_class(self, module, name):
+            if module == "__main__" and name in globals():
+                return globals()[name]
+            return super().find_class(module, name)
+
+    return SnapshotUnpickler(file)
+
+
+def _load_customer_snapshot(file):
+    '''
+    Unpickles a customer snapshot.
+    :param file:
+    :return:
+    '''
+    return _snapshot_unpickler(file).load()
+
+
+def _customer_record(customer):
+    '''
+    Converts a customer into the plain tuple stored in the journal and snapshot.
+    :param customer:
+    :return: (id, name, email, phone)
+    '''
+    return (customer.get_id(), customer.get_name(), customer.get_email(), customer.get_phone())
+
+
+def _policy_record(policy):
+    '''
+    Converts a discount policy into the plain tuple stored in the event log.
+    :param policy: a DiscountPolicy, PricingPolicy or None
+    :return: (percentage, active, rules or None), otherwise None
+    '''
+    if policy is None:
+        return None
+    rules = policy.get_rules() if isinstance(policy, PricingPolicy) else None
+    return (policy.get_discount_percentage(), policy.is_discount_active(), rules)
+
+
+def _policy_from_record(record):
+    if record is None:
+        return None
+    discount_pct, policy_state, rules = record
+    if rules is None:
+        return DiscountPolicy(discount_pct, policy_state)
+    return PricingPolicy.from_rules(discount_pct, policy_state, rules)
+
+
+class CustomerJournal:
+    '''
+    Append-only customer store made of a snapshot file and a journal file.
+
+    Every save appends one length-prefixed record to the journal, so adding a
+    customer costs the same no matter how many customers already exist. When the
+    journal grows as large as the snapshot it is folded into a new snapshot on a
+    background thread, which keeps the compaction cost constant per record.
+    Loading reads the snapshot and then replays the journal tail over it.
+
+    The snapshot is a stream of records like the journal, after a short magic
+    header, so it can be read and rewritten one record at a time. Snapshots
+    pickled as a single list by older versions are still read.
+    '''
+    RECORD_HEADER = struct.Struct(">I")
+    SNAPSHOT_MAGIC = b"CJSNAP1\n"
+
+    def __init__(self, snapshot_path=CUSTOMERS_FILE, journal_path=CUSTOMERS_JOURNAL_FILE,
+                 compact_threshold=10000):
+        self.__snapshot_path = snapshot_path
+        self.__journal_path = journal_path
+        self.__compacting_path = journal_path + ".compacting"
+        self.__compact_threshold = compact_threshold
+        self.__file = None
+        self.__journal_records = 0
+        self.__snapshot_records = 0
+        self.__lock = threading.Lock()
+        self.__compactor = None
+
+    def get_snapshot_path(self):
+        return self.__snapshot_path
+
+    def get_journal_path(self):
+        return self.__journal_path
+
+    def append(self, customer):
+        '''
+        Appends one customer record to the journal. A later record for the same
+        id replaces the earlier one when loading.
+        :param customer:
+        :return:
+        '''
+        self.append_many([customer])
+
+    def append_many(self, customers):
+        '''
+        Appends the records of several customers with a single write.
+        :param customers:
+        :return:
+        '''
+        import pickle
+
+        chunks = []
+        count = 0
+        for customer in customers:
+            record = pickle.dumps(_customer_record(customer), pickle.HIGHEST_PROTOCOL)
+            chunks.append(self.RECORD_HEADER.pack(len(record)))
+            chunks.append(record)
+            count += 1
+        if count == 0:
+            return
+
+        with self.__lock:
+            if self.__file is None:
+                self.__file = open(self.__journal_path, "ab")
+            self.__file.write(b"".join(chunks))
+            self.__file.flush()
+            self.__journal_records += count
+            if self.__journal_records >= max(self.__compact_threshold, self.__snapshot_records):
+                self.__start_compaction()
+
+    def load_customers(self):
+        '''
+        Reads the snapshot and replays the journal over it.
+        :return: list of Customer objects, one per id
+        '''
+        self.wait_for_compaction()
+        with self.__lock:
+            records = self.__read_snapshot()
+            self.__snapshot_records = len(records)
+            for record in self.__read_journal(self.__compacting_path):
+                records[record[0]] = record
+            self.__journal_records = 0
+            for record in self.__read_journal(self.__journal_path, repair=True):
+                records[record[0]] = record
+                self.__journal_records += 1
+
+        return [Customer(*record) for record in records.values()]
+
+    def iter_records(self):
+        '''
+        Yields the record of every stored customer, one per id, without loading
+        them all: the snapshot is streamed and only the journal tail, which
+        compaction keeps short, is held in memory.
+        :return: iterator of (id, name, email, phone)
+        '''
+        self.wait_for_compaction()
+        with self.__lock:
+            tail = {}
+            for path in (self.__compacting_path, self.__journal_path):
+                for record in self.__read_journal(path):
+                    tail[record[0]] = record
+            # the open file keeps this snapshot even if a compaction replaces it meanwhile
+            snapshot = self.__open_snapshot()
+        for record in self.__read_snapshot_records(snapshot):
+            if record[0] not in tail:
+                yield record
+        yield from tail.values()
+
+    def compact(self):
+        '''
+        Folds the journal into the snapshot and waits for it to finish.
+        :return:
+        '''
+        with self.__lock:
+            self.__start_compaction()
+        self.wait_for_compaction()
+
+    def wait_for_compaction(self):
+        compactor = self.__compactor
+        if compactor is not None:
+            compactor.join()
+
+    def reset(self):
+        '''
+        Removes every stored customer by writing an empty snapshot and
+        deleting the journal files.
+        :return:
+        '''
+        self.wait_for_compaction()
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+            for path in (self.__journal_path, self.__compacting_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.__write_snapshot(())
+            self.__replace_snapshot()
+            self.__journal_records = 0
+            self.__snapshot_records = 0
+
+    def close(self):
+        self.wait_for_compaction()
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+
+    def __start_compaction(self):
+        # Called with the lock held. The live journal is renamed out of the way so
+        # that appends can continue into a fresh file while the old one is merged.
+        if self.__compactor is not None and self.__compactor.is_alive():
+            return
+        if not os.path.exists(self.__compacting_path):
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+            if not os.path.exists(self.__journal_path):
+                return
+            os.replace(self.__journal_path, self.__compacting_path)
+            self.__journal_records = 0
+
+        # started before it is published, wait_for_compaction joins it without the lock
+        compactor = threading.Thread(target=self.__run_compaction, daemon=True)
+        compactor.start()
+        self.__compactor = compactor
+
+    def __run_compaction(self):
+        # only the journal being folded is held in memory, the snapshot is streamed into the new one
+        tail = {}
+        for record in self.__read_journal(self.__compacting_path):
+            tail[record[0]] = record
+        snapshot = self.__open_snapshot()
+        kept = (record for record in self.__read_snapshot_records(snapshot) if record[0] not in tail)
+        count = self.__write_snapshot(itertools.chain(kept, tail.values()))
+        # Loaders read the snapshot and then the journal being folded under the lock,
+        # so they see both before the merge or only the new snapshot, never one without the other.
+        with self.__lock:
+            self.__replace_snapshot()
+            os.remove(self.__compacting_path)
+            self.__snapshot_records = count
+
+    def __read_snapshot(self):
+        records = {}
+        for record in self.__read_snapshot_records(self.__open_snapshot()):
+            records[record[0]] = record
+        return records
+
+    def __open_snapshot(self):
+        try:
+            return open(self.__snapshot_path, "rb")
+        except FileNotFoundError:
+            return None
+
+    def __read_snapshot_records(self, file):
+        '''
+        Yields the records of an open snapshot file and closes it.
+        '''
+        if file is None:
+            return
+        with file:
+            if file.read(len(self.SNAPSHOT_MAGIC)) == self.SNAPSHOT_MAGIC:
+                yield from self.__read_records(file)
+                return
+            # a snapshot pickled as one list
+            file.seek(0)
+            try:
+                customers = _load_customer_snapshot(file)
+            except EOFError:
+                return
+            for customer in customers:
+                yield _customer_record(customer) if isinstance(customer, Customer) else customer
+
+    def __write_snapshot(self, records):
+        '''
+        Writes the records into a new snapshot next to the current one, which
+        __replace_snapshot then swaps in.
+        :return: the number of records written
+        '''
+        import pickle
+
+        count = 0
+        with open(self.__snapshot_path + ".tmp", "wb") as file:
+            file.write(self.SNAPSHOT_MAGIC)
+            for record in records:
+                data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+                file.write(self.RECORD_HEADER.pack(len(data)))
+                file.write(data)
+                count += 1
+            file.flush()
+            os.fsync(file.fileno())
+        return count
+
+    def __replace_snapshot(self):
+        os.replace(self.__snapshot_path + ".tmp", self.__snapshot_path)
+
+    def __read_records(self, file):
+        '''
+        Yields the length-prefixed records of an open file from its current
+        position, up to the first record cut short.
+        '''
+        import pickle
+
+        header_size = self.RECORD_HEADER.size
+        while True:
+            header = file.read(header_size)
+            if len(header) < header_size:
+                return
+            (size,) = self.RECORD_HEADER.unpack(header)
+            data = file.read(size)
+            if len(data) < size:
+                return
+            yield pickle.loads(data)
+
+    def __read_journal(self, path, repair=False):
+        '''
+        Yields the records of a journal file. A record cut short by a crash ends
+        the journal; with repair set the partial record is truncated away so
+        that new records are not appended behind it.
+        '''
+        import pickle
+
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            return
+
+        header_size = self.RECORD_HEADER.size
+        good_offset = 0
+        with file:
+            while True:
+                header = file.read(header_size)
+                if len(header) < header_size:
+                    break
+                (size,) = self.RECORD_HEADER.unpack(header)
+                data = file.read(size)
+                if len(data) < size:
+                    break
+                good_offset += header_size + size
+                yield pickle.loads(data)
+            truncated = file.tell() != good_offset or file.read(1) != b""
+
+        if repair and truncated:
+            with open(path, "r+b") as file:
+                file.truncate(good_offset)
+
+
+_default_customer_journal = None
+
+
+def get_customer_journal():
+    '''
+    Returns the journal used by Customer.save_to_file, creating it on first use.
+    :return:
+    '''
+    global _default_customer_journal
+    if _default_customer_journal is None:
+        _default_customer_journal = CustomerJournal()
+    return _default_customer_journal
+
+
+def load_customers():
+    '''
+    Loads every saved customer from the snapshot and the journal tail.
+    :return: list of Customer objects
+    '''
+    return get_customer_journal().load_customers()
+
+
+class EventLog:
+    '''
+    Write-ahead log of the operations on one event, with snapshots.
+
+    Once attached, every registration, unregistration, sale, cancellation and
+    change of the discount policy of the event appends one record to the log
+    while the event lock is held, so the log replays the operations in the
+    order they were applied. Records carry a sequence number and a CRC-32; a
+    record cut short or damaged by a crash ends the log.
+
+    Records are written by a committer thread: whatever has piled up since
+    the last commit goes to disk with one write and one fsync (group commit).
+    With synchronous set an operation only returns once its record is on disk,
+    waiting after the event lock is released so that concurrent operations
+    share a commit; otherwise a crash loses at most the last commit_interval
+    seconds.
+
+    After snapshot_threshold records the event is pickled into a new snapshot
+    on a background thread and the log starts over, so recover() reads one
+    snapshot and at most about snapshot_threshold records however long the
+    event has been on sale.
+    '''
+    RECORD_HEADER = struct.Struct(">II")  # size and CRC-32 of the pickled record
+
+    def __init__(self, log_path=EVENT_LOG_FILE, snapshot_path=EVENT_SNAPSHOT_FILE, synchronous=False,
+                 commit_interval=0.005, snapshot_threshold=50000):
+        self.__log_path = log_path
+        self.__snapshot_path = snapshot_path
+        self.__previous_path = log_path + ".previous"  # log of the snapshot being written
+        self.__synchronous = synchronous
+        self.__commit_interval = commit_interval
+        self.__snapshot_threshold = snapshot_threshold
+        self.__event = None
+        self.__file = None
+        self.__buffer = []  # encoded records waiting for the committer
+        self.__last_seq = 0
+        self.__durable_seq = 0
+        self.__records_since_snapshot = 0
+        self.__error = None  # OSError of the committer, raised to the writers
+        self.__closing = False
+        self.__lock = threading.Lock()
+        self.__pending = threading.Condition(self.__lock)  # records to commit
+        self.__committed = threading.Condition(self.__lock)  # durable sequence number moved
+        self.__file_lock = threading.Lock()  # the committer against log rotation
+        self.__snapshot_lock = threading.Lock()
+        self.__committer = None
+        self.__snapshotter = None
+        self.__waiting = threading.local()  # sequence number a thread has to wait for
+
+    def get_log_path(self):
+        return self.__log_path
+
+    def get_snapshot_path(self):
+        return self.__snapshot_path
+
+    def get_event(self):
+        return self.__event
+
+    def get_last_seq(self):
+        return self.__last_seq
+
+    def get_durable_seq(self):
+        return self.__durable_seq
+
+    def recover(self, repair=True):
+        '''
+        Loads the latest snapshot and replays the records logged after it. A
+        partial record at the end of the log is truncated away. The event is
+        not attached, see attach().
+        :param repair: False to leave the files untouched, e.g. to read the log
+            of an event that is still being written
+        :return: the recovered RacingCarEvent, otherwise False if nothing was saved
+        '''
+        self.wait_for_snapshot()
+        try:
+            with open(self.__snapshot_path, "rb") as file:
+                unpickler = _snapshot_unpickler(file)
+                seq = unpickler.load()
+                event = unpickler.load()
+        except FileNotFoundError:
+            return False
+
+        buyers = {}  # customer id -> customer of the last sale replayed
+        for path in (self.__previous_path, self.__log_path):
+            for record in self.__read_log(path, repair):
+                if record[0] > seq:
+                    self.__replay(event, record, buyers)
+                    seq = record[0]
+        self.__last_seq = self.__durable_seq = seq
+        return event
+
+    def attach(self, event):
+        '''
+        Starts logging the operations of the event. A snapshot of the event is
+        written first, so the log only has to hold what happens from now on.
+        :param event: a new event or the one returned by recover()
+        :return:
+        '''
+        if self.__event is not None:
+            raise ValueError("The log already has an event")
+        if isinstance(event.get_ledger(), MappedTicketLedger):
+            raise ValueError("A MappedTicketLedger keeps its tickets in its own file")
+        self.__event = event
+        self.__closing = False
+        event._attach_log(self)
+        self.snapshot()
+        self.__committer = threading.Thread(target=self.__run_committer, name="event-log-committer", daemon=True)
+        self.__committer.start()
+
+    def flush(self):
+        '''
+        Waits until every record appended so far is on disk.
+        :return:
+        '''
+        self.wait_durable(self.__last_seq)
+
+    def wait_durable(self, seq):
+        '''
+        Waits until the record with the sequence number `seq` is on disk.
+        :raises OSError: if the committer failed to write the log
+        '''
+        with self.__lock:
+            while self.__durable_seq < seq and self.__error is None:
+                if self.__committer is None or not self.__committer.is_alive():
+                    break
+                self.__committed.wait()
+            if self.__error is not None:
+                raise self.__error
+
+    def snapshot(self):
+        '''
+        Writes a snapshot of the attached event now and starts the log over.
+        :return: the sequence number of the last operation in the snapshot
+        '''
+        self.wait_for_snapshot()
+        return self.__write_snapshot()
+
+    def wait_for_snapshot(self):
+        snapshotter = self.__snapshotter
+        if snapshotter is not None:
+            snapshotter.join()
+
+    def close(self):
+        '''
+        Stops logging: the event is detached and the records still pending are written.
+        :return:
+        '''
+        self.wait_for_snapshot()
+        if self.__event is not None:
+            self.__event._detach_log(self)
+            self.__event = None
+        with self.__lock:
+            self.__closing = True
+            self.__pending.notify()
+        if self.__committer is not None:
+            self.__committer.join()
+            self.__committer = None
+        with self.__file_lock:
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+
+    def _append(self, record):
+        # called by the event with its lock held
+        import pickle
+        import zlib
+
+        with self.__lock:
+            self.__last_seq += 1
+            seq = self.__last_seq
+            data = pickle.dumps((seq,) + record, pickle.HIGHEST_PROTOCOL)
+            self.__buffer.append(self.RECORD_HEADER.pack(len(data), zlib.crc32(data)) + data)
+            self.__pending.notify()
+            self.__records_since_snapshot += 1
+            start_snapshot = self.__records_since_snapshot >= self.__snapshot_threshold
+        if start_snapshot:
+            self.__start_snapshot()
+        if self.__synchronous:
+            self.__waiting.seq = seq
+        return seq
+
+    def _wait_for_commit(self):
+        # called by the event once its lock is released
+        seq = getattr(self.__waiting, "seq", 0)
+        if seq:
+            self.__waiting.seq = 0
+            self.wait_durable(seq)
+
+    def __run_committer(self):
+        while True:
+            with self.__lock:
+                while not self.__buffer and not self.__closing:
+                    self.__pending.wait()
+                if not self.__buffer:
+                    return
+                batch, self.__buffer = self.__buffer, []
+                seq = self.__last_seq
+            started = time.monotonic()
+            try:
+                with self.__file_lock:
+                    self.__file.write(b"".join(batch))
+                    self.__file.flush()
+                    os.fsync(self.__file.fileno())
+            except OSError as error:
+                with self.__lock:
+                    self.__error = error
+                    self.__committed.notify_all()
+                return
+            with self.__lock:
+                self.__durable_seq = seq
+                self.__committed.notify_all()
+            # records arriving meanwhile go into the next commit
+            delay = self.__commit_interval - (time.monotonic() - started)
+            if delay > 0 and not self.__closing:
+                time.sleep(delay)
+
+    def __start_snapshot(self):
+        with self.__lock:
+            if self.__snapshotter is not None and self.__snapshotter.is_alive():
+                return
+            self.__records_since_snapshot = 0
+            self.__snapshotter = threading.Thread(target=self.__write_snapshot, name="event-log-snapshot",
+                                                  daemon=True)
+            self.__snapshotter.start()
+
+    def __write_snapshot(self):
+        import pickle
+
+        event = self.__event
+        if event is None:
+            return self.__last_seq
+        with self.__snapshot_lock:
+            # the log is switched and the event pickled with no operation in between
+            with event._get_lock():
+                self.flush()
+                with self.__file_lock:
+                    self.__rotate()
+                seq = self.__last_seq
+                data = pickle.dumps(event, pickle.HIGHEST_PROTOCOL)
+                self.__records_since_snapshot = 0
+
+            temp_path = self.__snapshot_path + ".tmp"
+            with open(temp_path, "wb") as file:
+                pickle.dump(seq, file, pickle.HIGHEST_PROTOCOL)
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.__snapshot_path)
+            if os.path.exists(self.__previous_path):
+                os.remove(self.__previous_path)
+        return seq
+
+    def __rotate(self):
+        # Called with the file lock held. The records of the live log move to the
+        # previous log, which stays until the new snapshot covering them is written.
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+        if os.path.exists(self.__log_path):
+            if os.path.exists(self.__previous_path):
+                # an earlier snapshot failed, its log is still needed
+                with open(self.__log_path, "rb") as source, open(self.__previous_path, "ab") as target:
+                    target.write(source.read())
+                    target.flush()
+                    os.fsync(target.fileno())
+                os.remove(self.__log_path)
+            else:
+                os.replace(self.__log_path, self.__previous_path)
+        self.__file = open(self.__log_path, "ab")
+
+    def __read_log(self, path, repair=True):
+        '''
+        Yields the records of a log file up to the first one that is cut short
+        or fails its checksum, and truncates the file there if repair is set.
+        '''
+        import pickle
+        import zlib
+
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            return
+
+        header_size = self.RECORD_HEADER.size
+        good_offset = 0
+        with file:
+            while True:
+                header = file.read(header_size)
+                if len(header) < header_size:
+                    break
+                size, checksum = self.RECORD_HEADER.unpack(header)
+                data = file.read(size)
+                if len(data) < size or zlib.crc32(data) != checksum:
+                    break
+                good_offset += header_size + size
+                yield pickle.loads(data)
+            truncated = file.tell() != good_offset or file.read(1) != b""
+
+        if truncated and repair:
+            with open(path, "r+b") as file:
+                file.truncate(good_offset)
+
+    @staticmethod
+    def __replay(event, record, buyers):
+        operation, args = record[1], record[2:]
+        if operation == "register":
+            event.register_customer(Customer(*args[0]))
+        elif operation == "register_many":
+            event.register_customers([Customer(*customer) for customer in args[0]])
+        elif operation == "unregister":
+            customer = event.get_customer_by_id(args[0])
+            if customer:
+                event.unregister_customer(customer)
+        elif operation == "sale":
+            ticket_type, price, seat, paid_price, customer, payment_method, valid, sold_at = args
+            ticket = TICKET_CLASSES[TICKET_TYPE_CODES[ticket_type]](price, seat)
+            if not valid:
+                ticket.invalidate()
+            event.restore_ticket_sale(ticket, paid_price, EventLog.__buyer(event, customer, buyers),
+                                      payment_method, sold_at)
+        elif operation == "sales":
+            tickets, customer, payment_method, sold_at = args
+            customer = EventLog.__buyer(event, customer, buyers)
+            for ticket_type, price, seat, paid_price in tickets:
+                event.restore_ticket_sale(TICKET_CLASSES[TICKET_TYPE_CODES[ticket_type]](price, seat), paid_price,
+                                          customer, payment_method, sold_at)
+        elif operation == "cancel":
+            ticket_id, customer_id = args
+            customer = buyers.get(customer_id) or event.get_customer_by_id(customer_id)
+            if customer:
+                event.cancel_ticket_by_id(ticket_id, customer)
+        elif operation == "policy":
+            event.set_discount_policy(_policy_from_record(args[0]))
+
+    @staticmethod
+    def __buyer(event, record, buyers):
+        # the registered customer, or the same stand-in for a buyer who is not registered
+        if record is None:
+            return None
+        customer = event.get_customer_by_id(record[0]) or buyers.get(record[0]) or Customer(*record)
+        buyers[record[0]] = customer
+        return customer
+
+
+# hot paths timed while instrumentation is enabled, see instrumentation.py
+instrumentation.instrument(RacingCarEvent, "sell_ticket", "booking", "booking one ticket")
+instrumentation.instrument(RacingCarEvent, "book_tickets", "batch_booking", "booking a batch of tickets")
+instrumentation.instrument(RacingCarEvent, "cancel_ticket", "cancellation", "cancelling a ticket")
+instrumentation.instrument(RacingCarEvent, "hold_seats", "seat_hold", "holding seats")
+instrumentation.instrument(RacingCarEvent, "confirm_hold", "hold_confirmation", "confirming a seat hold")
+instrumentation.instrument(RacingCarEvent, "get_customer_by_id", "customer_lookup", "looking up a customer by id")
+instrumentation.instrument(RacingCarEvent, "register_customer", "registration", "registering a customer")
+instrumentation.instrument(Customer, "save_to_file", "customer_save", "saving a customer")
+instrumentation.instrument(CustomerJournal, "append_many", "journal_write", "writing customer journal records")
+instrumentation.instrument(EventLog, "recover", "event_recovery", "recovering an event from its snapshot and log")
+instrumentation.instrument(DiscountPolicy, "get_price_factor", "discount_evaluation", "evaluating the discount")
+instrumentation.instrument(PricingPolicy, "get_price_factor", "discount_evaluation", "evaluating the discount")
+
 
 
 # creating data storage files functions
 def create_customers_file():
-    with open("customers.pkl", "wb") as file:
-        pickle.dump([], file)
+    get_customer_journal().reset()
 
 
 def create_tickets_file():
+    import pickle
+
     with open("tickets.pkl", "wb") as file:
         pickle.dump([], file)
 
 
-# creating the files
-create_customers_file()
-create_tickets_file()
+def create_demo_event():
+    '''
+    Creates the event shown by the app, with its discount policy, the demo
+    customers and the customers saved in earlier sessions.
+    :return: the RacingCarEvent
+    '''
+    # creating the event object
+    event = RacingCarEvent("Racing Car Event","UAE","05/09/2025",300)
+    policy = DiscountPolicy(10,True)
+
+    # assigning the discount policy
+    event.set_discount_policy(policy)
 
-# creating the event object
-event = RacingCarEvent("Racing Car Event","UAE","05/09/2025",300)
-policy = DiscountPolicy(10,True)
+    # creating customer objects
+    c4 = Customer("4","Zayed","zayed@gmail.com","123456789")
+    c5 = Customer("5","Ahmed","ahmed@gmail.com","123456789")
+    c6 = Customer("6","Umar","umer@gmail.com","123456789")
 
-# assigning the discount policy
-event.set_discount_policy(policy)
+    # registering the customers
+    event.register_customer(c4)
+    event.register_customer(c5)
+    event.register_customer(c6)
 
-# creating customer objects
-c4 = Customer("4","Zayed","zayed@gmail.com","123456789")
-c5 = Customer("5","Ahmed","ahmed@gmail.com","123456789")
-c6 = Customer("6","Umar","umer@gmail.com","123456789")
+    # registering the customers saved in earlier sessions
+    for saved_customer in load_customers():
+        event.register_customer(saved_customer)
 
-# registering the customers
-event.register_customer(c4)
-event.register_customer(c5)
-event.register_customer(c6)
+    return event
 
 
 single_race_ticket_price = 100
 weekend_package_ticket_price = 200
 season_membership_ticket_price = 1000
-seat_number = 0
+
+
+class BackgroundWorker:
+    '''
+    Runs operations on a thread pool and hands their results back to the
+    thread that calls poll(), e.g. from root.after() in a Tk app, which must
+    not touch its widgets from other threads.
+
+    With one thread, the default, operations run in the order they were
+    submitted, so a customer registered with one click can book with the
+    next one.
+    '''
+    def __init__(self, max_workers=1):
+        from concurrent.futures import ThreadPoolExecutor
+        import queue
+
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="background-worker")
+        self.__done = queue.SimpleQueue()  # (callback, future) of the finished operations
+        self.__pending = 0
+
+    def submit(self, operation, on_done, *args):
+        '''
+        Runs operation(*args) in the background.
+        :param on_done: called by poll() with the result, or with the exception
+            raised by the operation
+        :return: a Future of the result
+        '''
+        future = self.__executor.submit(operation, *args)
+        self.__pending += 1
+        future.add_done_callback(lambda future: self.__done.put((on_done, future)))
+        return future
+
+    def poll(self, limit=None):
+        '''
+        Calls the callbacks of the operations finished so far, on the calling thread.
+        :param limit: most callbacks to call, all of them if None
+        :return: number of callbacks called
+        '''
+        handled = 0
+        while limit is None or handled < limit:
+            if self.__done.empty():
+                break
+            on_done, future = self.__done.get()
+            self.__pending -= 1
+            handled += 1
+            error = future.exception()
+            on_done(error if error is not None else future.result())
+        return handled
+
+    def get_pending(self):
+        '''
+        Returns the number of operations whose callbacks did not run yet.
+        '''
+        return self.__pending
+
+    def shutdown(self, wait=True):
+        '''
+        Stops taking operations. With wait, the ones already submitted are
+        finished first; their callbacks are dropped unless poll() is called.
+        '''
+        self.__executor.shutdown(wait=wait)
+
+
+def _load_tkinter():
+    '''
+    Imports tkinter into the module globals used by TicketBookingApp. It is only
+    needed by the GUI, so importing this module does not load it.
+    '''
+    global tk, tkfont
+    import tkinter as tk
+    import tkinter.font as tkfont
+
+
+class CustomerBrowser:
+    '''
+    Window listing the registered customers of an event, with search as you
+    type over their name, email and phone (see CustomerDirectory.search).
+
+    The list is virtual: the listbox only holds the rows on screen, and the
+    scrollbar is driven by hand from the number of matches, so scrolling
+    through a million customers reads one page of rows at a time.
+    '''
+    VISIBLE_ROWS = 15
+
+    def __init__(self, app):
+        self.app = app
+        self.event = app.event
+        self.top_row = 0
+        self.total = 0
+        self.rows = []  # (customer, field) shown in the listbox
+
+        self.window = tk.Toplevel(app.root)
+        self.window.title("Customers")
+        self.window.geometry("560x360")
+
+        search_frame = tk.Frame(self.window)
+        search_frame.pack(fill=tk.X, padx=5, pady=5)
+        tk.Label(search_frame, text="Search:").pack(side=tk.LEFT)
+        self.search_var = tk.StringVar()
+        self.search_entry = tk.Entry(search_frame, textvariable=self.search_var, state=tk.DISABLED)
+        self.search_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        self.count_var = tk.StringVar()
+        self.count_var.set("Indexing customers...")
+        tk.Label(search_frame, textvariable=self.count_var, width=18, anchor=tk.E).pack(side=tk.RIGHT)
+
+        list_frame = tk.Frame(self.window)
+        list_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=(0, 5))
+        self.listbox = tk.Listbox(list_frame, height=self.VISIBLE_ROWS, font=('Courier', 9), activestyle='none')
+        self.listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar = tk.Scrollbar(list_frame, command=self.scroll)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        tk.Label(self.window, text="Double-click a customer to book for or show it.",
+                 font=('Helvetica', 9)).pack(anchor=tk.W, padx=5, pady=(0, 5))
+
+        self.listbox.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.listbox.bind("<Button-4>", lambda event: self.scroll("scroll", -3, "units"))
+        self.listbox.bind("<Button-5>", lambda event: self.scroll("scroll", 3, "units"))
+        self.listbox.bind("<Double-Button-1>", self.on_select)
+        self.search_var.trace_add("write", lambda *args: self.search())
+
+        # the first search builds the indexes, which takes a while for a large event
+        app.run_in_background(self.event.count_customers_matching, self.on_indexed, "")
+
+    def is_open(self):
+        return bool(self.window.winfo_exists())
+
+    def on_indexed(self, result):
+        if not self.is_open():
+            return
+        self.search_entry.config(state=tk.NORMAL)
+        self.search_entry.focus_set()
+        self.search()
+
+    def search(self):
+        '''
+        Shows the first rows matching the search text, called on every keystroke.
+        '''
+        self.top_row = 0
+        self.refresh()
+
+    def refresh(self):
+        '''
+        Reads the rows on screen again, e.g. after customers were added or removed.
+        '''
+        if str(self.search_entry.cget("state")) == tk.DISABLED:
+            return
+        text = self.search_var.get().strip()
+        self.total = self.event.count_customers_matching(text)
+        self.top_row = max(0, min(self.top_row, self.total - self.VISIBLE_ROWS))
+        self.rows = self.event.search_customers(text, self.top_row, self.VISIBLE_ROWS)
+        self.count_var.set("{} matches".format(self.total))
+
+        self.listbox.delete(0, tk.END)
+        for customer, field in self.rows:
+            row = "{:<8} {:<24} {:<28} {}".format(customer.get_id(), customer.get_name(), customer.get_email(),
+                                                 customer.get_phone())
+            if field != "name":
+                row += "  ({})".format(field)
+            self.listbox.insert(tk.END, row)
+
+        if self.total:
+            self.scrollbar.set(self.top_row / self.total, (self.top_row + len(self.rows)) / self.total)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def scroll(self, action, amount, unit=None):
+        '''
+        Command of the scrollbar: moves the first row shown and reads that page.
+        '''
+        if action == "moveto":
+            self.top_row = int(float(amount) * self.total)
+        elif unit == "pages":
+            self.top_row += int(amount) * self.VISIBLE_ROWS
+        else:
+            self.top_row += int(amount)
+        self.refresh()
+
+    def on_mouse_wheel(self, event):
+        self.scroll("scroll", -3 if event.delta > 0 else 3, "units")
+
+    def on_select(self, event):
+        selection = self.listbox.curselection()
+        if selection and selection[0] < len(self.rows):
+            self.app.select_customer(self.rows[selection[0]][0])
 
 
 class TicketBookingApp:
 
-    def __init__(self, root):
+    # how often finished background operations are picked up, and the shortest
+    # time between two refreshes of the dashboard
+    POLL_INTERVAL_MS = 20
+    DASHBOARD_REFRESH_MS = 250
+
+    def __init__(self, root, event, worker=None):
+        _load_tkinter()
         self.root = root
+        self.event = event
+        self.policy = event.get_discount_policy()
+        # lookups, bookings and file writes run on the worker so the window never freezes
+        self.worker = worker or BackgroundWorker()
+        self.refresh_scheduled = False
+        self.browser = None
         self.root.title("Racing Event Ticket Booking System")
         self.root.geometry("850x500")
         self.root.resizable(False, False)
@@ -343,6 +3949,12 @@ class TicketBookingApp:
         separator = tk.Frame(self.main_frame, height=2, bd=1, relief=tk.SUNKEN)
         separator.pack(fill=tk.X, pady=5)
 
+        # Status line at the bottom, shows the operations still running
+        self.status_var = tk.StringVar()
+        self.status_var.set("Ready")
+        tk.Label(self.main_frame, textvariable=self.status_var, font=('Helvetica', 9),
+                 anchor=tk.W).pack(side=tk.BOTTOM, fill=tk.X)
+
         # Now create the content frames below the title
         content_frame = tk.Frame(self.main_frame)
         content_frame.pack(expand=True, fill=tk.BOTH)
@@ -360,6 +3972,9 @@ class TicketBookingApp:
         add_btn = tk.Button(left_frame, text="Add Customer", bg="#4caf50",command=self.open_add_customer_window)
         add_btn.pack(pady=5, fill=tk.X)
 
+        # Browse Customers button
+        tk.Button(left_frame, text="Browse Customers", command=self.open_customer_browser).pack(pady=(0, 5), fill=tk.X)
+
         # Delete Customer section
         del_frame = tk.Frame(left_frame)
         del_frame.pack(pady=5, fill=tk.X)
@@ -511,7 +4126,7 @@ class TicketBookingApp:
         customers_frame.pack(pady=5, padx=5, anchor=tk.W)  # pady=5 for spacing
 
         self.total_customers_var = tk.StringVar()
-        self.total_customers_var.set("{}".format(event.get_total_customers()))  # Set initial value
+        self.total_customers_var.set("{}".format(self.event.get_total_customers()))  # Set initial value
 
         # Customers Label + Field
         tk.Label(customers_frame, text="Total Customers:", font=('Helvetica', 10, 'bold')).pack(side=tk.LEFT)
@@ -535,7 +4150,7 @@ class TicketBookingApp:
         policy_frame.pack(pady=5, padx=5, anchor=tk.W)  # pady=5 for spacing
 
         self.policy_var = tk.StringVar()
-        self.policy_var.set(policy.get_policy_details())
+        self.policy_var.set(self.policy.get_policy_details())
 
         # Customers Label + Field
         tk.Label(policy_frame, text="Discount Policy:", font=('Helvetica', 10, 'bold')).pack(side=tk.LEFT)
@@ -571,6 +4186,16 @@ class TicketBookingApp:
         # Separator line (optional, matches your other frames)
         tk.Frame(admin_frame, height=2, bd=1, relief=tk.SUNKEN).pack(fill=tk.X, pady=5)
 
+        # Sales breakdown, refreshed by update_dashboard
+        self.sales_breakdown_var = tk.StringVar()
+        tk.Label(
+            admin_frame,
+            textvariable=self.sales_breakdown_var,
+            font=('Helvetica', 9),
+            justify=tk.LEFT
+        ).pack(pady=5, padx=5, anchor=tk.W)
+        self.update_dashboard()
+
 
 
 
@@ -578,6 +4203,8 @@ class TicketBookingApp:
         right_frame = tk.Frame(content_frame)
         right_frame.pack(side=tk.RIGHT, expand=True, fill=tk.BOTH)
 
+        self.poll_worker()
+
 
     def account_management_output(self, new_text):
         """
@@ -636,13 +4263,71 @@ class TicketBookingApp:
         self.email_entry.grid(row=2, column=1, padx=5, pady=5)
         self.phone_entry.grid(row=3, column=1, padx=5, pady=5)
 
-        submit_btn = tk.Button(add_window, text="Submit", command=self.submit_customer)
-        submit_btn.grid(row=4, columnspan=2, pady=10)
+        self.submit_btn = tk.Button(add_window, text="Submit", command=self.submit_customer)
+        self.submit_btn.grid(row=4, columnspan=2, pady=10)
+
+    def run_in_background(self, operation, on_done, *args):
+        '''
+        Runs operation(*args) on the worker and on_done(result) back on the Tk
+        thread once it finished. on_done gets the exception if the operation failed.
+        '''
+        self.worker.submit(operation, on_done, *args)
+        self.show_pending()
+
+    def poll_worker(self):
+        '''
+        Calls the callbacks of the finished background operations and
+        schedules itself again.
+        '''
+        if self.worker.poll():
+            self.show_pending()
+        self.root.after(self.POLL_INTERVAL_MS, self.poll_worker)
+
+    def show_pending(self):
+        pending = self.worker.get_pending()
+        self.status_var.set("Working... ({} pending)".format(pending) if pending else "Ready")
+
+    def request_dashboard_refresh(self):
+        '''
+        Refreshes the dashboard once DASHBOARD_REFRESH_MS from now. Requests made
+        in the meantime share that refresh, so the dashboard is redrawn at most
+        a few times a second however many operations finish.
+        '''
+        if not self.refresh_scheduled:
+            self.refresh_scheduled = True
+            self.root.after(self.DASHBOARD_REFRESH_MS, self.refresh_dashboard)
+
+    def refresh_dashboard(self):
+        self.refresh_scheduled = False
+        self.update_dashboard()
+        if self.browser is not None and self.browser.is_open():
+            self.browser.refresh()
+
+    def open_customer_browser(self):
+        '''
+        Opens the customer browser, or brings it to the front if it is open.
+        '''
+        if self.browser is not None and self.browser.is_open():
+            self.browser.window.lift()
+            return
+        self.browser = CustomerBrowser(self)
+
+    def select_customer(self, customer):
+        '''
+        Called when a customer is picked in the browser: fills in the customer
+        id fields and shows the details of the customer.
+        '''
+        for entry in (self.customer_id_entry, self.details_entry, self.del_entry):
+            entry.delete(0, tk.END)
+            entry.insert(0, customer.get_id())
+        self.customer_details()
 
     def submit_customer(self):
         '''
         This method is called when the user submits for adding a new customer.
         It creates a customer object and registers that customer into the system as well.
+        The registration and the save run in the background, the window closes
+        once they are done.
         :return: 
         '''
         id =  self.id_entry.get()
@@ -666,33 +4351,67 @@ class TicketBookingApp:
             print(f"Phone: {customer_data['phone']}")
 
             customer = Customer(id,name,email,phone)
-            event.register_customer(customer)
-            customer.save_to_file()
-
-            current_customers = int(self.total_customers_field.get())
-            current_customers += 1
-            self.total_customers_var.set(current_customers)
-
-            self.id_entry.master.destroy()
+            submit_btn = self.submit_btn
+            submit_btn.config(state=tk.DISABLED)
+            self.account_management_output("Adding customer {}...".format(id))
+            self.run_in_background(self.register_and_save, lambda result: self.customer_submitted(
+                result, id, submit_btn), customer)
 
         else:
             print("Missing Information!")
 
+    def register_and_save(self, customer):
+        '''
+        Registers a new customer and saves it, run in the background.
+        :return: True, otherwise False if the id is taken
+        '''
+        if not self.event.register_customer(customer):
+            return False
+        customer.save_to_file()
+        return True
+
+    def customer_submitted(self, result, id, submit_btn):
+        if isinstance(result, Exception):
+            msg = "Customer with ID {} could not be added: {}".format(id, result)
+        elif not result:
+            msg = "Customer with ID {} already exists.".format(id)
+        else:
+            msg = "Customer with ID {} added.".format(id)
+        self.account_management_output(msg)
+        self.request_dashboard_refresh()
+
+        if not submit_btn.winfo_exists():
+            return
+        if result is True:
+            submit_btn.master.destroy()
+        else:
+            submit_btn.config(state=tk.NORMAL)
+
     def delete_customer(self):
         '''
         THis method reads the id from the field and removes the customer from the event system.
         :return: 
         '''
         id = self.del_entry.get()
-        customer = event.get_customer_by_id(id)
+        self.account_management_output("Deleting customer {}...".format(id))
+        self.run_in_background(self.remove_customer, self.show_account_result, id)
+
+    def remove_customer(self, id):
+        '''
+        Unregisters the customer with the given id, run in the background.
+        :return: the message to show
+        '''
+        customer = self.event.get_customer_by_id(id)
         if customer:
-            event.unregister_customer(customer)
-            msg = "Customer with ID {} deleted.".format(id)
-            self.account_management_output(msg)
+            self.event.unregister_customer(customer)
+            return "Customer with ID {} deleted.".format(id)
+        return "Customer with the id {} not found".format(id)
 
-        else:
-            msg = "Customer with the id {} not found".format(id)
-            self.account_management_output(msg)
+    def show_account_result(self, result):
+        if isinstance(result, Exception):
+            result = "Error: {}".format(result)
+        self.account_management_output(result)
+        self.request_dashboard_refresh()
 
     def customer_details(self):
         '''
@@ -701,29 +4420,49 @@ class TicketBookingApp:
         :return: 
         '''
         id = self.details_entry.get()
-        customer = event.get_customer_by_id(id)
+        self.run_in_background(self.find_customer_details, self.show_account_result, id)
+
+    def find_customer_details(self, id):
+        customer = self.event.get_customer_by_id(id)
         if customer:
-            details = customer.__str__()
-            self.account_management_output(details)
-        else:
-            msg = "Customer with the id {} not found".format(id)
-            self.account_management_output(msg)
+            return customer.__str__()
+        return "Customer with the id {} not found".format(id)
 
     def enable_discount_policy(self):
-        policy.enable_discount()
-        self.policy_var.set(policy.get_policy_details())
+        self.run_in_background(self.policy.enable_discount, self.show_policy)
 
     def disable_discount_policy(self):
-        policy.disable_discount()
-        self.policy_var.set(policy.get_policy_details())
+        self.run_in_background(self.policy.disable_discount, self.show_policy)
+
+    def show_policy(self, result):
+        if isinstance(result, Exception):
+            self.account_management_output("Error: {}".format(result))
+        self.policy_var.set(self.policy.get_policy_details())
 
     def update_dashboard(self):
         '''
-        This method refreshes the sales amount on the dashboard
+        This method refreshes the sales amount, the number of customers and the sales
+        breakdown on the dashboard. The figures come from the sales aggregates of the
+        event, so refreshing does not depend on the number of tickets sold.
+        Use request_dashboard_refresh() after an operation instead of calling it directly.
         :return: 
         '''
-        msg = "${}".format(event.get_total_sales())
+        msg = "${}".format(self.event.get_total_sales())
         self.total_sales_var.set(msg)
+        self.total_customers_var.set("{}".format(self.event.get_total_customers()))
+
+        aggregates = self.event.get_sales_aggregates()
+        lines = []
+        for ticket_type in TICKET_TYPE_CODES:
+            lines.append("{}: {} (${:.2f})".format(ticket_type, *_figures_in_dollars(
+                aggregates.get_ticket_type_figures(ticket_type))))
+        for method in PAYMENT_METHOD_CODES:
+            lines.append("{}: {} (${:.2f})".format(method, *_figures_in_dollars(
+                aggregates.get_payment_method_figures(method))))
+        lines.append("Discounted: {} (${:.2f})".format(*_figures_in_dollars(aggregates.get_discounted_figures())))
+        lines.append("Full price: {} (${:.2f})".format(*_figures_in_dollars(aggregates.get_full_price_figures())))
+        lines.append("Remaining capacity: {}".format(aggregates.get_remaining_capacity()))
+        self.sales_breakdown_var.set("\n".join(lines))
 
 
     def book_ticket(self):
@@ -732,50 +4471,68 @@ class TicketBookingApp:
         and then adds that ticket into the event for keeping track of the sales also 
         provides it to the customer.
         '''
-        global seat_number
-
         customer_id = self.customer_id_entry.get()
-        customer = event.get_customer_by_id(customer_id)
+        payment_method = self.payment_method.get()
+        ticket_type = self.ticket_type.get()
+        self.booking_output("Booking {} for customer {}...".format(ticket_type, customer_id))
+        self.run_in_background(self.sell, self.show_booking, customer_id, ticket_type, payment_method)
+
+    def sell(self, customer_id, ticket_type, payment_method):
+        '''
+        Sells a ticket of the type chosen in the dropdown, run in the background.
+        :return: the message to show
+        '''
+        customer = self.event.get_customer_by_id(customer_id)
         # print(customer_id)
         if customer:
-            payment_method = self.payment_method.get()
-            ticket_type = self.ticket_type.get()
-            seat_number += 1
-            print(ticket_type)
             if ticket_type == "Single-Race Passes":
-                ticket = SingleRaceTicket(single_race_ticket_price,seat_number)
-                event.add_ticket_sale(ticket)
-                customer.add_purchase(ticket)
-                msg = "Ticket : {} sold to\nCustomer : {}".format(ticket_type,customer.get_name())
-                self.booking_output(msg)
+                ticket = self.event.sell_ticket(SingleRaceTicket,single_race_ticket_price,customer,
+                                                 payment_method=payment_method)
 
             elif ticket_type == "Season Ticket":
-                ticket = SeasonMembershipTicket(season_membership_ticket_price,seat_number)
-                event.add_ticket_sale(ticket)
-                customer.add_purchase(ticket)
-                msg = "Ticket : {} sold to\nCustomer : {}".format(ticket_type,customer.get_name())
-                self.booking_output(msg)
+                ticket = self.event.sell_ticket(SeasonMembershipTicket,season_membership_ticket_price,customer,
+                                                 payment_method=payment_method)
 
             elif ticket_type == "Weekend Packages":
-                ticket = WeekendPackageTicket(season_membership_ticket_price,seat_number)
-                event.add_ticket_sale(ticket)
-                customer.add_purchase(ticket)
-                msg = "Ticket : {} sold to\nCustomer : {}".format(ticket_type,customer.get_name())
-                self.booking_output(msg)
+                ticket = self.event.sell_ticket(WeekendPackageTicket,season_membership_ticket_price,customer,
+                                                 payment_method=payment_method)
 
-            self.update_dashboard()
-        else:
-            msg = "Customer not found"
-            self.booking_output(msg)
+            if ticket:
+                return "Ticket : {} sold to\nCustomer : {}".format(ticket_type,customer.get_name())
+            return "Sorry, the event is sold out"
+        return "Customer not found"
 
+    def show_booking(self, result):
+        if isinstance(result, Exception):
+            result = "Booking failed: {}".format(result)
+        self.booking_output(result)
+        self.request_dashboard_refresh()
 
 
-if __name__ == "__main__":
-    import tkinter as tk
-    import tkinter.font as tkfont
+
+def main():
+    '''
+    Entry point of the app: recovers the event from its snapshot and log, or
+    creates the demo event on the first run, and runs the Tk window. Every
+    operation on the event is logged, so nothing sold is lost on a restart.
+    '''
+    event_log = EventLog()
+    event = event_log.recover() or create_demo_event()
+    event_log.attach(event)
+
+    _load_tkinter()
     root = tk.Tk()
-    app = TicketBookingApp(root)
-    root.mainloop()
+    app = TicketBookingApp(root, event)
+    try:
+        root.mainloop()
+    finally:
+        # the operations still queued are finished before the log is closed
+        app.worker.shutdown()
+        event_log.close()
+
+
+if __name__ == "__main__":
+    main()
 
 
 
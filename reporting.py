@@ -0,0 +1,422 @@
+'''
+
+Sales reports over the ticket ledgers of one event or a season of events
+
+The ledger of every event is read in chunks of columns (see
+ColumnarTicketLedger.get_columns), or straight from a SQLite database with
+SQLiteStorage.iter_ticket_columns, and each chunk is folded into running
+totals: tickets and revenue per ticket type, per day of sale and per payment
+method, the discounted share of the sales, and the revenue of the top
+customers. With NumPy a chunk is grouped and summed with bincount over its
+codes; without it the same totals are worked out row by row. Memory depends
+on the chunk size and the number of distinct customers, not on the number of
+tickets.
+
+Amounts are added up in integer cents. Cancelled tickets were refunded, so
+they are only counted as cancellations. Days are UTC days of the time of sale.
+
+SalesReport
+
+build_report, write_report
+
+'''
+
+
+
+import argparse
+import csv
+import heapq
+import json
+
+from racing_event_ticket_booking import EventLog, PAYMENT_METHODS, TICKET_CLASSES, _load_numpy
+
+
+FORMATS = ("csv", "json")
+
+DEFAULT_CHUNK_SIZE = 1 << 18
+
+DEFAULT_TOP_CUSTOMERS = 10
+
+CSV_FIELDS = ("section", "key", "tickets", "revenue", "discount", "cancelled")
+
+SECONDS_PER_DAY = 86400
+
+
+def _dollars(cents):
+    return round(cents / 100, 2)
+
+
+def _top_customer_order(row):
+    customer_id, tickets, revenue = row
+    return -revenue, -tickets, customer_id
+
+
+class SalesReport:
+    '''
+    Running totals of the sales of one or more events, filled chunk by chunk
+    with add_event().
+    '''
+    def __init__(self, top_customers=DEFAULT_TOP_CUSTOMERS):
+        self.__top_customers = top_customers
+        self.__events = []  # dictionaries of the per event figures
+        self.__tickets = 0
+        self.__revenue = 0
+        self.__cancelled = 0
+        self.__discounted = [0, 0, 0]  # tickets, revenue, discount in cents
+        self.__types = {}  # type code -> [tickets, revenue, discount]
+        self.__days = {}  # days since the epoch -> [tickets, revenue]
+        self.__payments = {}  # payment code -> [tickets, revenue]
+        self.__customers = {}  # customer id -> [tickets, revenue], without NumPy
+        self.__customer_codes = {}  # customer id -> position in the NumPy totals
+        self.__customer_tickets = None
+        self.__customer_revenue = None
+        self.__chunk_ids = None  # customer_ids list of the last chunk and its mapping to the codes
+        self.__chunk_codes = []
+        self.__chunk_code_array = None
+
+    def add_event(self, event, chunk_size=DEFAULT_CHUNK_SIZE):
+        '''
+        Folds the tickets sold by an event into the report.
+        :param event: a RacingCarEvent
+        :param chunk_size: number of tickets read from the ledger at a time
+        :return:
+        '''
+        ledger = event.get_ledger()
+        count = len(ledger)
+        self.add_columns((ledger.get_columns(start, min(start + chunk_size, count))
+                          for start in range(0, count, chunk_size)),
+                         event.get_event_id(), event.get_name(), event.get_location(), event.get_date())
+
+    def add_columns(self, chunks, event_id=None, name=None, location=None, date=None):
+        '''
+        Folds the tickets of one event given as chunks of columns into the
+        report, e.g. read from storage with SQLiteStorage.iter_ticket_columns
+        without loading the event.
+        :param chunks: iterable of dictionaries of columns, see ColumnarTicketLedger.get_columns
+        :param event_id: id of the event, the rest describe it in the report
+        :return:
+        '''
+        figures = {"tickets": 0, "revenue": 0, "cancelled": 0}
+        numpy = _load_numpy()
+        for columns in chunks:
+            if numpy is not None:
+                tickets, revenue, cancelled = self.__fold_numpy(numpy, columns)
+            else:
+                tickets, revenue, cancelled = self.__fold(columns)
+            figures["tickets"] += tickets
+            figures["revenue"] += revenue
+            figures["cancelled"] += cancelled
+
+        self.__tickets += figures["tickets"]
+        self.__revenue += figures["revenue"]
+        self.__cancelled += figures["cancelled"]
+        self.__events.append({"event_id": event_id, "name": name, "location": location, "date": date,
+                              **figures})
+
+    def get_event_count(self):
+        return len(self.__events)
+
+    def get_tickets(self):
+        return self.__tickets
+
+    def get_revenue_cents(self):
+        return self.__revenue
+
+    def get_cancelled(self):
+        return self.__cancelled
+
+    def get_top_customers(self):
+        '''
+        :return: list of (customer id, tickets, revenue in cents), the largest
+            revenue first, then the most tickets, then by customer id
+        '''
+        if self.__customer_revenue is None:
+            totals = ((customer_id, tickets, revenue) for customer_id, (tickets, revenue) in self.__customers.items())
+            return heapq.nsmallest(self.__top_customers, totals, key=_top_customer_order)
+
+        numpy = _load_numpy()
+        customers = len(self.__customer_codes)
+        revenue = self.__customer_revenue[:customers]
+        top = min(self.__top_customers, customers)
+        if top <= 0:
+            return []
+        # every customer tied with the last place is a candidate, the order is settled below
+        lowest = revenue[numpy.argpartition(revenue, customers - top)[customers - top]]
+        ids = list(self.__customer_codes)
+        rows = [(ids[code], int(self.__customer_tickets[code]), int(revenue[code]))
+                for code in numpy.flatnonzero(revenue >= lowest).tolist()]
+        return sorted(rows, key=_top_customer_order)[:top]
+
+    def to_dict(self):
+        '''
+        Returns the report as plain values with the amounts in dollars.
+        '''
+        import datetime
+
+        epoch = datetime.date(1970, 1, 1)
+        tickets, revenue, discount = self.__discounted
+        return {
+            "events": [dict(event, revenue=_dollars(event["revenue"])) for event in self.__events],
+            "totals": {
+                "tickets": self.__tickets,
+                "revenue": _dollars(self.__revenue),
+                "cancelled": self.__cancelled,
+                "discounted_tickets": tickets,
+                "discounted_revenue": _dollars(revenue),
+                "discount": _dollars(discount),
+                "discounted_share": tickets / self.__tickets if self.__tickets else 0.0,
+                "discounted_revenue_share": revenue / self.__revenue if self.__revenue else 0.0,
+            },
+            "ticket_types": [
+                {"ticket_type": TICKET_CLASSES[code].TICKET_TYPE, "tickets": figures[0],
+                 "revenue": _dollars(figures[1]), "discount": _dollars(figures[2])}
+                for code, figures in sorted(self.__types.items())],
+            "days": [
+                # day 0 holds the tickets of ledgers saved before the time of sale was recorded
+                {"day": (epoch + datetime.timedelta(days=day)).isoformat() if day else "unknown",
+                 "tickets": figures[0], "revenue": _dollars(figures[1])}
+                for day, figures in sorted(self.__days.items())],
+            "payment_methods": [
+                {"payment_method": PAYMENT_METHODS.get(code, "Not recorded"), "tickets": figures[0],
+                 "revenue": _dollars(figures[1])}
+                for code, figures in sorted(self.__payments.items())],
+            "top_customers": [
+                {"customer_id": customer_id, "tickets": tickets, "revenue": _dollars(revenue)}
+                for customer_id, tickets, revenue in self.get_top_customers()],
+        }
+
+    def to_rows(self):
+        '''
+        Returns the report as flat rows with the fields of CSV_FIELDS, one
+        section after the other.
+        '''
+        report = self.to_dict()
+        totals = report["totals"]
+        rows = [{"section": "totals", "key": "all", "tickets": totals["tickets"], "revenue": totals["revenue"],
+                 "discount": totals["discount"], "cancelled": totals["cancelled"]},
+                {"section": "discounted", "key": "discounted", "tickets": totals["discounted_tickets"],
+                 "revenue": totals["discounted_revenue"], "discount": totals["discount"]},
+                {"section": "discounted", "key": "full price",
+                 "tickets": totals["tickets"] - totals["discounted_tickets"],
+                 "revenue": round(totals["revenue"] - totals["discounted_revenue"], 2)}]
+        for event in report["events"]:
+            rows.append({"section": "event", "key": event["event_id"] if event["event_id"] is not None
+                         else event["name"], "tickets": event["tickets"], "revenue": event["revenue"],
+                         "cancelled": event["cancelled"]})
+        for figures in report["ticket_types"]:
+            rows.append({"section": "ticket_type", "key": figures["ticket_type"], "tickets": figures["tickets"],
+                         "revenue": figures["revenue"], "discount": figures["discount"]})
+        for figures in report["days"]:
+            rows.append({"section": "day", "key": figures["day"], "tickets": figures["tickets"],
+                         "revenue": figures["revenue"]})
+        for figures in report["payment_methods"]:
+            rows.append({"section": "payment_method", "key": figures["payment_method"],
+                         "tickets": figures["tickets"], "revenue": figures["revenue"]})
+        for figures in report["top_customers"]:
+            rows.append({"section": "customer", "key": figures["customer_id"], "tickets": figures["tickets"],
+                         "revenue": figures["revenue"]})
+        return rows
+
+    def __fold(self, columns):
+        # row by row, used without NumPy
+        if "paid_cents" in columns:
+            prices, paid = columns["price_cents"], columns["paid_cents"]
+        else:
+            prices = [int(round(price * 100)) for price in columns["price"]]
+            paid = [int(round(price * 100)) for price in columns["paid"]]
+        customer_ids = columns["customer_ids"]
+        tickets = revenue = cancelled = 0
+        for price, paid_cents, type_code, valid, payment_code, sold_at, customer in zip(
+                prices, paid, columns["type_code"], columns["valid"], columns["payment_code"],
+                columns["sold_at"], columns["customer"]):
+            if not valid:
+                cancelled += 1
+                continue
+            tickets += 1
+            revenue += paid_cents
+            discount = price - paid_cents
+            figures = self.__types.setdefault(type_code, [0, 0, 0])
+            figures[0] += 1
+            figures[1] += paid_cents
+            figures[2] += discount
+            if discount > 0:
+                self.__discounted[0] += 1
+                self.__discounted[1] += paid_cents
+                self.__discounted[2] += discount
+            figures = self.__days.setdefault(sold_at // SECONDS_PER_DAY, [0, 0])
+            figures[0] += 1
+            figures[1] += paid_cents
+            figures = self.__payments.setdefault(payment_code, [0, 0])
+            figures[0] += 1
+            figures[1] += paid_cents
+            if customer >= 0:
+                figures = self.__customers.setdefault(customer_ids[customer], [0, 0])
+                figures[0] += 1
+                figures[1] += paid_cents
+        return tickets, revenue, cancelled
+
+    def __fold_numpy(self, numpy, columns):
+        valid = numpy.asarray(columns["valid"], dtype=numpy.uint8) != 0
+        if "paid_cents" in columns:
+            prices = numpy.asarray(columns["price_cents"], dtype=numpy.int64)[valid]
+            paid = numpy.asarray(columns["paid_cents"], dtype=numpy.int64)[valid]
+        else:
+            prices = numpy.rint(numpy.asarray(columns["price"], dtype=numpy.float64)[valid] * 100).astype(numpy.int64)
+            paid = numpy.rint(numpy.asarray(columns["paid"], dtype=numpy.float64)[valid] * 100).astype(numpy.int64)
+        tickets = len(paid)
+        cancelled = len(valid) - tickets
+        if not tickets:
+            return 0, 0, cancelled
+        discounts = prices - paid
+        weights = paid.astype(numpy.float64)  # exact for sums below 2**53 cents
+
+        self.__add_groups(self.__types, numpy.asarray(columns["type_code"], dtype=numpy.intp)[valid],
+                          weights, discounts.astype(numpy.float64))
+        days = numpy.asarray(columns["sold_at"], dtype=numpy.int64)[valid] // SECONDS_PER_DAY
+        first_day = int(days.min())
+        self.__add_groups(self.__days, (days - first_day).astype(numpy.intp), weights, offset=first_day)
+        self.__add_groups(self.__payments, numpy.asarray(columns["payment_code"], dtype=numpy.intp)[valid],
+                          weights)
+
+        discounted = discounts > 0
+        self.__discounted[0] += int(discounted.sum())
+        self.__discounted[1] += int(paid[discounted].sum())
+        self.__discounted[2] += int(discounts[discounted].sum())
+
+        customers = numpy.asarray(columns["customer"], dtype=numpy.intp)[valid]
+        known = customers >= 0
+        if known.any():
+            codes = self.__map_customers(numpy, columns["customer_ids"])[customers[known]]
+            size = len(self.__customer_codes)
+            self.__customer_tickets[:size] += numpy.bincount(codes, minlength=size)
+            self.__customer_revenue[:size] += numpy.rint(
+                numpy.bincount(codes, weights=weights[known], minlength=size)).astype(numpy.int64)
+        return tickets, int(paid.sum()), cancelled
+
+    @staticmethod
+    def __add_groups(groups, keys, weights, discounts=None, offset=0):
+        # adds the counts and sums per key of one chunk to a dictionary of running totals
+        numpy = _load_numpy()
+        counts = numpy.bincount(keys)
+        sums = numpy.rint(numpy.bincount(keys, weights=weights)).astype(numpy.int64)
+        if discounts is not None:
+            discount_sums = numpy.rint(numpy.bincount(keys, weights=discounts)).astype(numpy.int64)
+        for key in numpy.flatnonzero(counts).tolist():
+            figures = groups.setdefault(key + offset, [0, 0, 0] if discounts is not None else [0, 0])
+            figures[0] += int(counts[key])
+            figures[1] += int(sums[key])
+            if discounts is not None:
+                figures[2] += int(discount_sums[key])
+
+    def __map_customers(self, numpy, customer_ids):
+        # Maps the customer indexes of a chunk to positions in the running totals.
+        # A ColumnarTicketLedger hands out the same growing list with every chunk,
+        # so only the customers added since the last chunk are looked up.
+        if customer_ids is not self.__chunk_ids:
+            self.__chunk_ids = customer_ids
+            self.__chunk_codes = []
+            self.__chunk_code_array = None
+        if len(self.__chunk_codes) < len(customer_ids) or self.__chunk_code_array is None:
+            codes = self.__customer_codes
+            for customer_id in customer_ids[len(self.__chunk_codes):]:
+                self.__chunk_codes.append(codes.setdefault(customer_id, len(codes)))
+            self.__chunk_code_array = numpy.asarray(self.__chunk_codes, dtype=numpy.intp)
+
+            size = len(self.__customer_codes)
+            if self.__customer_tickets is None:
+                self.__customer_tickets = numpy.zeros(size, dtype=numpy.int64)
+                self.__customer_revenue = numpy.zeros(size, dtype=numpy.int64)
+            elif len(self.__customer_tickets) < size:
+                grown = max(size, 2 * len(self.__customer_tickets))
+                self.__customer_tickets = numpy.concatenate(
+                    [self.__customer_tickets, numpy.zeros(grown - len(self.__customer_tickets), dtype=numpy.int64)])
+                self.__customer_revenue = numpy.concatenate(
+                    [self.__customer_revenue, numpy.zeros(grown - len(self.__customer_revenue), dtype=numpy.int64)])
+        return self.__chunk_code_array
+
+
+def build_report(events, top_customers=DEFAULT_TOP_CUSTOMERS, chunk_size=DEFAULT_CHUNK_SIZE):
+    '''
+    Builds the sales report of one event or of a season of events.
+    :param events: a RacingCarEvent, or an iterable of them such as an EventCatalog
+    :param top_customers: number of customers listed by revenue
+    :param chunk_size: number of tickets read from a ledger at a time
+    :return: a SalesReport
+    '''
+    if hasattr(events, "get_ledger"):
+        events = [events]
+    report = SalesReport(top_customers)
+    for event in events:
+        report.add_event(event, chunk_size)
+    return report
+
+
+def _file_format(path, file_format):
+    if file_format is None:
+        file_format = path.rsplit(".", 1)[-1].lower()
+    if file_format not in FORMATS:
+        raise ValueError("Unknown file format {}, use one of {}".format(file_format, ", ".join(FORMATS)))
+    return file_format
+
+
+def write_report(report, path, file_format=None):
+    '''
+    Writes a report as JSON, or as CSV with one row per figure (see CSV_FIELDS).
+    :param report: a SalesReport
+    :param file_format: "csv" or "json", taken from the file extension if None
+    :return:
+    '''
+    file_format = _file_format(path, file_format)
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        if file_format == "json":
+            json.dump(report.to_dict(), file, indent=2)
+            return
+        writer = csv.DictWriter(file, CSV_FIELDS)
+        writer.writeheader()
+        writer.writerows(report.to_rows())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sales report of an event or a season of events")
+    parser.add_argument("output", help="CSV or JSON file to write")
+    parser.add_argument("--format", choices=FORMATS, help="file format, taken from the extension by default")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--storage", help="SQLite database saved by storage.SQLiteStorage")
+    source.add_argument("--event-log", help="event log of the app, read with the snapshot next to it")
+    parser.add_argument("--snapshot", help="snapshot of the event log, event.snapshot by default")
+    parser.add_argument("--event-id", type=int, nargs="+", help="events to report on, all stored events by default")
+    parser.add_argument("--top", type=int, default=DEFAULT_TOP_CUSTOMERS, help="number of top customers")
+    parser.add_argument("--chunk-size", type=int,
+                        help="tickets read at a time, fewer by default from SQLite whose rows come as tuples")
+    args = parser.parse_args()
+
+    report = SalesReport(args.top)
+    if args.event_log:
+        event_log = EventLog(args.event_log, args.snapshot or "event.snapshot")
+        # the app may still be writing the log, so it is read without repairing it
+        event = event_log.recover(repair=False)
+        if not event:
+            parser.error("No event saved in {}".format(args.event_log))
+        report.add_event(event, args.chunk_size or DEFAULT_CHUNK_SIZE)
+    else:
+        from storage import DEFAULT_CHUNK_SIZE as STORAGE_CHUNK_SIZE, SQLiteStorage
+
+        storage = SQLiteStorage(args.storage, readers=1)
+        try:
+            events = {row[0]: row for row in storage.list_events()}
+            for event_id in args.event_id or list(events):
+                if event_id not in events:
+                    parser.error("No event {} in {}".format(event_id, args.storage))
+                # the tickets are folded chunk by chunk as they are read, no event is loaded
+                report.add_columns(storage.iter_ticket_columns(event_id, args.chunk_size or STORAGE_CHUNK_SIZE),
+                                   *events[event_id][:4])
+        finally:
+            storage.close()
+
+    write_report(report, args.output, args.format)
+    print("{} tickets, ${:.2f} from {} events written to {}".format(
+        report.get_tickets(), report.get_revenue_cents() / 100, report.get_event_count(), args.output))
+
+
+if __name__ == "__main__":
+    main()
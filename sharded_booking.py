@@ -0,0 +1,346 @@
+'''
+
+Sharded booking across a pool of worker processes
+
+Events are partitioned over worker processes, each holding its events with
+their customers, seat maps and ledgers in an EventCatalog of its own. A
+request is routed to the process owning its event, so bookings for different
+events run on different CPU cores instead of one interpreter thread.
+Totals such as the sales or the registered customers are asked from every
+shard and merged.
+
+Requests travel over one pipe per worker. submit_many() sends the requests of
+each shard in a single message, which keeps the cost of the pipe small next
+to the booking work.
+
+ShardError
+
+ShardedBookingPool
+
+'''
+
+
+
+import itertools
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future
+
+from booking_server import TICKET_TYPES, customer_to_dict, ticket_to_dict
+from racing_event_ticket_booking import Customer, DiscountPolicy, EventCatalog, RacingCarEvent
+
+
+class ShardError(Exception):
+    '''
+    Raised for a request that failed inside a worker process, or that could
+    not be sent because the worker process exited.
+    '''
+
+
+def merge_summaries(summaries):
+    '''
+    Adds up dictionaries of numbers, such as SalesAggregates.get_summary(),
+    key by key and level by level.
+    '''
+    merged = {}
+    for summary in summaries:
+        for key, value in summary.items():
+            if isinstance(value, dict):
+                merged[key] = merge_summaries([merged.get(key, {}), value])
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+class _Shard:
+    '''
+    The events of one worker process and the operations run on them.
+    '''
+    def __init__(self):
+        self.__catalog = EventCatalog()
+        self.__operations = {
+            "add_event": self.__add_event,
+            "register": self.__register,
+            "book": self.__book,
+            "cancel": self.__cancel,
+            "stats": self.__stats,
+            "totals": self.__totals,
+        }
+
+    def handle(self, request):
+        request_id, operation, args = request
+        try:
+            return request_id, True, self.__operations[operation](*args)
+        except Exception as error:
+            return request_id, False, "{}: {}".format(type(error).__name__, error)
+
+    def __event(self, event_id):
+        event = self.__catalog.get_event(event_id)
+        if not event:
+            raise KeyError("Event {} is not in this shard".format(event_id))
+        return event
+
+    def __add_event(self, event_id, name, location, date, capacity, discount_pct, discount_active):
+        event = RacingCarEvent(name, location, date, capacity, event_id=event_id)
+        event.set_discount_policy(DiscountPolicy(discount_pct, discount_active))
+        return self.__catalog.add_event(event)
+
+    def __register(self, event_id, id, name, email, phone):
+        customer = self.__catalog.register_customer(event_id, Customer(id, name, email, phone))
+        return customer_to_dict(customer) if customer else False
+
+    def __book(self, event_id, customer_id, ticket_type, quantity=1, payment_method=None, promo_code=None):
+        event = self.__event(event_id)
+        customer = event.get_customer_by_id(customer_id)
+        if not customer:
+            return False
+        if ticket_type not in TICKET_TYPES:
+            raise ValueError("Unknown ticket type {}".format(ticket_type))
+        ticket_class, price = TICKET_TYPES[ticket_type]
+        if quantity == 1:
+            ticket = event.sell_ticket(ticket_class, price, customer, payment_method=payment_method,
+                                       promo_code=promo_code)
+            tickets = [ticket] if ticket else False
+        else:
+            tickets = event.book_tickets(ticket_class, price, quantity, customer, payment_method=payment_method,
+                                         promo_code=promo_code)
+        return [ticket_to_dict(ticket) for ticket in tickets] if tickets else False
+
+    def __cancel(self, event_id, customer_id, ticket_id):
+        event = self.__event(event_id)
+        customer = event.get_customer_by_id(customer_id)
+        ticket = event.cancel_ticket_by_id(ticket_id, customer) if customer else False
+        return ticket_to_dict(ticket) if ticket else False
+
+    @staticmethod
+    def __event_stats(event):
+        return {
+            "total_sales": event.get_total_sales(),
+            "tickets_sold": event.get_total_tickets_sold(),
+            "customers": event.get_total_customers(),
+            "sales": event.get_sales_aggregates().get_summary(),
+        }
+
+    def __stats(self, event_id):
+        return self.__event_stats(self.__event(event_id))
+
+    def __totals(self):
+        totals = merge_summaries([self.__event_stats(event) for event in self.__catalog])
+        totals["events"] = len(self.__catalog)
+        return totals
+
+
+def _serve_shard(connection):
+    # main loop of a worker process: every message is a list of requests
+    shard = _Shard()
+    while True:
+        try:
+            requests = connection.recv()
+        except EOFError:
+            break
+        if requests is None:
+            break
+        connection.send([shard.handle(request) for request in requests])
+    connection.close()
+
+
+class _ShardConnection:
+    '''
+    Client side of one worker process. Requests get futures that a receiver
+    thread resolves as the responses come back.
+    '''
+    def __init__(self, context, index):
+        self.__connection, child = context.Pipe()
+        self.__process = context.Process(target=_serve_shard, args=(child,),
+                                         name="booking-shard-{}".format(index), daemon=True)
+        self.__process.start()
+        child.close()
+        self.__pending = {}  # request id -> future, added and failed under the send lock
+        self.__ids = itertools.count()
+        self.__send_lock = threading.Lock()
+        self.__exited = False
+        self.__receiver = threading.Thread(target=self.__receive, name="booking-shard-{}-receiver".format(index),
+                                           daemon=True)
+        self.__receiver.start()
+
+    def submit(self, requests):
+        '''
+        Sends several (operation, args) requests in one message.
+        :return: list of futures, in the order of the requests
+        :raises ShardError: if the worker process has exited
+        '''
+        futures = []
+        message = []
+        with self.__send_lock:
+            # The requests sent earlier are failed by the receiver once it has read
+            # every response the worker sent before exiting.
+            if self.__exited or not self.__process.is_alive():
+                raise ShardError("Worker process exited")
+            for operation, args in requests:
+                request_id = next(self.__ids)
+                future = Future()
+                self.__pending[request_id] = future
+                futures.append(future)
+                message.append((request_id, operation, args))
+            try:
+                self.__connection.send(message)
+            except (BrokenPipeError, OSError):
+                for request_id, _, _ in message:
+                    del self.__pending[request_id]
+                raise ShardError("Worker process exited") from None
+        return futures
+
+    def close(self):
+        with self.__send_lock:
+            try:
+                self.__connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        self.__process.join()
+        self.__receiver.join()
+        self.__connection.close()
+
+    def __receive(self):
+        while True:
+            try:
+                responses = self.__connection.recv()
+            except (EOFError, OSError):
+                break
+            for request_id, ok, result in responses:
+                future = self.__pending.pop(request_id)
+                if ok:
+                    future.set_result(result)
+                else:
+                    future.set_exception(ShardError(result))
+        with self.__send_lock:
+            self.__fail_pending()
+
+    def __fail_pending(self):
+        # called with the send lock held, once no response can come any more
+        self.__exited = True
+        for future in self.__pending.values():
+            if not future.done():
+                future.set_exception(ShardError("Worker process exited"))
+        self.__pending.clear()
+
+
+class ShardedBookingPool:
+    '''
+    Pool of worker processes, each owning a share of the events.
+
+    Events are placed round-robin when they are added and stay on their shard.
+    The methods mirror RacingCarEvent but take the event id, and return plain
+    dictionaries (see booking_server.ticket_to_dict) because tickets and
+    customers live in the worker processes.
+    '''
+    def __init__(self, workers=None, start_method="spawn"):
+        workers = workers or os.cpu_count() or 1
+        context = multiprocessing.get_context(start_method)
+        self.__shards = [_ShardConnection(context, index) for index in range(workers)]
+        self.__event_shards = {}  # event id -> shard index
+        self.__next_event_id = 1
+        self.__lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_workers(self):
+        return len(self.__shards)
+
+    def get_shard(self, event_id):
+        '''
+        Returns the index of the worker owning the event, otherwise False.
+        '''
+        return self.__event_shards.get(event_id, False)
+
+    def get_event_ids(self):
+        return list(self.__event_shards)
+
+    def add_event(self, name, location, date, capacity, discount_pct=0, discount_active=False):
+        '''
+        Creates an event on the next shard.
+        :return: the id of the event
+        '''
+        with self.__lock:
+            event_id = self.__next_event_id
+            self.__next_event_id += 1
+            shard = (event_id - 1) % len(self.__shards)
+        args = (event_id, name, location, date, capacity, discount_pct, discount_active)
+        result = self.__shards[shard].submit([("add_event", args)])[0].result()
+        # routed only once the shard holds the event
+        with self.__lock:
+            self.__event_shards[event_id] = shard
+        return result
+
+    def submit(self, event_id, operation, *args):
+        '''
+        Sends one request to the shard owning the event.
+        :param operation: "register", "book", "cancel" or "stats"
+        :return: a Future of the result
+        '''
+        return self.submit_many([(event_id, operation, args)])[0]
+
+    def submit_many(self, requests):
+        '''
+        Sends many requests, one message per shard involved.
+        :param requests: iterable of (event id, operation, args)
+        :return: list of futures, in the order of the requests
+        '''
+        batches = {}
+        for position, (event_id, operation, args) in enumerate(requests):
+            shard = self.__event_shards.get(event_id)
+            if shard is None:
+                raise KeyError("Unknown event {}".format(event_id))
+            batches.setdefault(shard, []).append((position, (operation, (event_id,) + tuple(args))))
+
+        futures = {}
+        for shard, batch in batches.items():
+            for (position, _), future in zip(batch, self.__shards[shard].submit([request for _, request in batch])):
+                futures[position] = future
+        return [futures[position] for position in range(len(futures))]
+
+    def register_customer(self, event_id, customer):
+        '''
+        :return: the registered customer as a dictionary, otherwise False
+        '''
+        return self.submit(event_id, "register", customer.get_id(), customer.get_name(), customer.get_email(),
+                           customer.get_phone()).result()
+
+    def book(self, event_id, customer_id, ticket_type, quantity=1, payment_method=None, promo_code=None):
+        '''
+        :param ticket_type: a key of booking_server.TICKET_TYPES, e.g. "SINGLE_RACE"
+        :return: list of the tickets sold as dictionaries, otherwise False
+        '''
+        return self.submit(event_id, "book", customer_id, ticket_type, quantity, payment_method,
+                           promo_code).result()
+
+    def cancel(self, event_id, customer_id, ticket_id):
+        return self.submit(event_id, "cancel", customer_id, ticket_id).result()
+
+    def get_event_stats(self, event_id):
+        return self.submit(event_id, "stats").result()
+
+    def get_totals(self):
+        '''
+        Returns the totals of all shards merged: total_sales, tickets_sold,
+        customers (registrations over all events), events and the sales summary.
+        '''
+        futures = [shard.submit([("totals", ())])[0] for shard in self.__shards]
+        return merge_summaries([future.result() for future in futures])
+
+    def get_total_sales(self):
+        return self.get_totals().get("total_sales", 0)
+
+    def get_total_customers(self):
+        return self.get_totals().get("customers", 0)
+
+    def get_total_tickets_sold(self):
+        return self.get_totals().get("tickets_sold", 0)
+
+    def close(self):
+        for shard in self.__shards:
+            shard.close()
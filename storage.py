@@ -0,0 +1,446 @@
+'''
+
+Storage backends for the racing event booking model
+
+StorageBackend (interface)
+
+SQLiteStorage
+
+Customer.save/load and RacingCarEvent.save/load go through one of these.
+
+'''
+
+
+
+import json
+import queue
+import sqlite3
+import threading
+import weakref
+from array import array
+from contextlib import contextmanager
+
+from racing_event_ticket_booking import (Customer, DiscountPolicy, PricingPolicy, RacingCarEvent,
+                                         PAYMENT_METHOD_CODES, PAYMENT_METHODS, TICKET_CLASSES,
+                                         TICKET_TYPE_CODES)
+
+
+class StorageBackend:
+    '''
+    Interface of a storage backend. Customers are shared by all events; an
+    event is stored with its discount policy, its registered customers and
+    the tickets of its ledger.
+    '''
+    def save_customer(self, customer):
+        self.save_customers([customer])
+
+    def save_customers(self, customers):
+        raise NotImplementedError
+
+    def load_customer(self, id):
+        raise NotImplementedError
+
+    def load_customers(self):
+        raise NotImplementedError
+
+    def delete_customer(self, id):
+        raise NotImplementedError
+
+    def find_customers_by_email(self, email):
+        raise NotImplementedError
+
+    def find_customers_by_phone(self, phone):
+        raise NotImplementedError
+
+    def save_event(self, event):
+        raise NotImplementedError
+
+    def save_registrations(self, event_id, customers):
+        raise NotImplementedError
+
+    def save_new_tickets(self, event):
+        raise NotImplementedError
+
+    def load_event(self, event_id):
+        raise NotImplementedError
+
+    def list_events(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS customers (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    email TEXT NOT NULL,
+    phone TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS customers_email ON customers (email);
+CREATE INDEX IF NOT EXISTS customers_phone ON customers (phone);
+
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    location TEXT NOT NULL,
+    date TEXT NOT NULL,
+    capacity INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS discount_policies (
+    event_id INTEGER PRIMARY KEY REFERENCES events (id),
+    percentage REAL NOT NULL,
+    active INTEGER NOT NULL,
+    rules TEXT
+);
+
+CREATE TABLE IF NOT EXISTS registrations (
+    event_id INTEGER NOT NULL REFERENCES events (id),
+    customer_id TEXT NOT NULL REFERENCES customers (id),
+    PRIMARY KEY (event_id, customer_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS tickets (
+    event_id INTEGER NOT NULL REFERENCES events (id),
+    ledger_index INTEGER NOT NULL,
+    type_code INTEGER NOT NULL,
+    seat_number INTEGER NOT NULL,
+    price REAL NOT NULL,
+    paid REAL NOT NULL,
+    customer_id TEXT,
+    valid INTEGER NOT NULL,
+    payment_code INTEGER NOT NULL DEFAULT 0,
+    sold_at INTEGER,
+    PRIMARY KEY (event_id, ledger_index)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tickets_customer ON tickets (customer_id);
+"""
+
+# columns added to existing tables after their first release: table -> [(column, definition)]
+MIGRATIONS = {
+    "discount_policies": [("rules", "TEXT")],
+    "tickets": [("payment_code", "INTEGER NOT NULL DEFAULT 0"), ("sold_at", "INTEGER")],
+}
+
+# The statements are kept as constants: sqlite3 caches the prepared statement
+# of every SQL string per connection, so each one is compiled only once.
+UPSERT_CUSTOMER = ("INSERT INTO customers (id, name, email, phone) VALUES (?, ?, ?, ?) "
+                   "ON CONFLICT (id) DO UPDATE SET name = excluded.name, "
+                   "email = excluded.email, phone = excluded.phone")
+SELECT_CUSTOMER = "SELECT id, name, email, phone FROM customers WHERE id = ?"
+SELECT_CUSTOMERS = "SELECT id, name, email, phone FROM customers"
+SELECT_CUSTOMERS_BY_EMAIL = "SELECT id, name, email, phone FROM customers WHERE email = ?"
+SELECT_CUSTOMERS_BY_PHONE = "SELECT id, name, email, phone FROM customers WHERE phone = ?"
+DELETE_CUSTOMER = "DELETE FROM customers WHERE id = ?"
+DELETE_CUSTOMER_REGISTRATIONS = "DELETE FROM registrations WHERE customer_id = ?"
+DETACH_CUSTOMER_TICKETS = "UPDATE tickets SET customer_id = NULL WHERE customer_id = ?"
+
+INSERT_EVENT = "INSERT INTO events (name, location, date, capacity) VALUES (?, ?, ?, ?)"
+UPSERT_EVENT = ("INSERT INTO events (id, name, location, date, capacity) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET name = excluded.name, location = excluded.location, "
+                "date = excluded.date, capacity = excluded.capacity")
+SELECT_EVENT = "SELECT id, name, location, date, capacity FROM events WHERE id = ?"
+SELECT_EVENTS = "SELECT id, name, location, date, capacity FROM events ORDER BY id"
+
+UPSERT_POLICY = ("INSERT INTO discount_policies (event_id, percentage, active, rules) VALUES (?, ?, ?, ?) "
+                 "ON CONFLICT (event_id) DO UPDATE SET percentage = excluded.percentage, "
+                 "active = excluded.active, rules = excluded.rules")
+DELETE_POLICY = "DELETE FROM discount_policies WHERE event_id = ?"
+SELECT_POLICY = "SELECT percentage, active, rules FROM discount_policies WHERE event_id = ?"
+
+DELETE_REGISTRATIONS = "DELETE FROM registrations WHERE event_id = ?"
+INSERT_REGISTRATION = "INSERT INTO registrations (event_id, customer_id) VALUES (?, ?)"
+INSERT_REGISTRATION_IF_MISSING = "INSERT OR IGNORE INTO registrations (event_id, customer_id) VALUES (?, ?)"
+SELECT_REGISTERED_CUSTOMERS = ("SELECT c.id, c.name, c.email, c.phone FROM registrations r "
+                               "JOIN customers c ON c.id = r.customer_id WHERE r.event_id = ?")
+
+# ledger indexes run from 0 without gaps, so the count is the last index + 1, found in the primary key
+COUNT_TICKETS = "SELECT COALESCE(MAX(ledger_index) + 1, 0) FROM tickets WHERE event_id = ?"
+INSERT_TICKET = ("INSERT INTO tickets (event_id, ledger_index, type_code, seat_number, price, paid, "
+                 "customer_id, valid, payment_code, sold_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+INVALIDATE_TICKET = "UPDATE tickets SET valid = 0 WHERE event_id = ? AND ledger_index = ? AND valid = 1"
+SELECT_TICKETS = ("SELECT type_code, seat_number, price, paid, customer_id, valid, payment_code, sold_at "
+                  "FROM tickets "
+                  "WHERE event_id = ? ORDER BY ledger_index")
+# tickets saved before the time of sale was recorded read as 0, the unknown day of the reports
+SELECT_TICKET_COLUMNS = ("SELECT type_code, price, paid, customer_id, valid, payment_code, COALESCE(sold_at, 0) "
+                         "FROM tickets "
+                         "WHERE event_id = ? ORDER BY ledger_index")
+
+# rows are fetched as tuples before they become columns, so the chunks are smaller than those of a ledger
+DEFAULT_CHUNK_SIZE = 1 << 14
+
+
+class SQLiteStorage(StorageBackend):
+    '''
+    Storage backend on a SQLite database in WAL mode.
+
+    Writes go through a single connection and every save is one transaction,
+    with executemany for the rows of customers, registrations and tickets.
+    Reads are served by a small pool of connections, which WAL lets run
+    alongside the writer. Lookups by email, phone and customer use indexes.
+    The ledger of an event only grows, so saving an event again inserts the
+    tickets sold since the last save and marks the cancelled ones.
+    '''
+    def __init__(self, path, readers=4):
+        self.__path = path
+        self.__memory = path == ":memory:"
+        self.__write_lock = threading.Lock()
+        self.__writer = self.__connect()
+        self.__writer.executescript(SCHEMA)
+        self.__migrate()
+        # event -> number of its cancellations already saved, see RacingCarEvent.get_cancelled_since
+        self.__saved_cancellations = weakref.WeakKeyDictionary()
+        self.__readers = queue.Queue()
+        if not self.__memory:
+            for _ in range(readers):
+                self.__readers.put(self.__connect())
+
+    def get_path(self):
+        return self.__path
+
+    def __connect(self):
+        connection = sqlite3.connect(self.__path, check_same_thread=False)
+        if not self.__memory:
+            connection.execute("PRAGMA journal_mode = WAL")
+            connection.execute("PRAGMA synchronous = NORMAL")
+        connection.execute("PRAGMA foreign_keys = ON")
+        return connection
+
+    def __migrate(self):
+        # databases created before a column was added get it with its default
+        with self.__writer as connection:
+            for table, columns in MIGRATIONS.items():
+                existing = {row[1] for row in connection.execute("PRAGMA table_info ({})".format(table))}
+                for column, definition in columns:
+                    if column not in existing:
+                        connection.execute("ALTER TABLE {} ADD COLUMN {} {}".format(table, column, definition))
+
+    @contextmanager
+    def __transaction(self):
+        with self.__write_lock:
+            with self.__writer:
+                yield self.__writer
+
+    @contextmanager
+    def __reader(self):
+        # an in-memory database is private to its connection, so it has no pool
+        if self.__memory:
+            with self.__write_lock:
+                yield self.__writer
+            return
+
+        connection = self.__readers.get()
+        try:
+            yield connection
+        finally:
+            self.__readers.put(connection)
+
+    def close(self):
+        with self.__write_lock:
+            self.__writer.close()
+        while not self.__readers.empty():
+            self.__readers.get().close()
+
+    # customers
+    def save_customers(self, customers):
+        rows = [(customer.get_id(), customer.get_name(), customer.get_email(), customer.get_phone())
+                for customer in customers]
+        with self.__transaction() as connection:
+            connection.executemany(UPSERT_CUSTOMER, rows)
+
+    def load_customer(self, id):
+        with self.__reader() as connection:
+            row = connection.execute(SELECT_CUSTOMER, (id,)).fetchone()
+        if row is None:
+            return False
+        return Customer(*row)
+
+    def load_customers(self):
+        with self.__reader() as connection:
+            rows = connection.execute(SELECT_CUSTOMERS).fetchall()
+        return [Customer(*row) for row in rows]
+
+    def delete_customer(self, id):
+        with self.__transaction() as connection:
+            connection.execute(DELETE_CUSTOMER_REGISTRATIONS, (id,))
+            connection.execute(DETACH_CUSTOMER_TICKETS, (id,))
+            return connection.execute(DELETE_CUSTOMER, (id,)).rowcount > 0
+
+    def find_customers_by_email(self, email):
+        with self.__reader() as connection:
+            rows = connection.execute(SELECT_CUSTOMERS_BY_EMAIL, (email,)).fetchall()
+        return [Customer(*row) for row in rows]
+
+    def find_customers_by_phone(self, phone):
+        with self.__reader() as connection:
+            rows = connection.execute(SELECT_CUSTOMERS_BY_PHONE, (phone,)).fetchall()
+        return [Customer(*row) for row in rows]
+
+    # events
+    def save_event(self, event):
+        '''
+        Saves the event in one transaction. An event without an id gets the
+        id of its new row. Only the tickets sold since the last save are
+        inserted, and only the tickets cancelled since then are updated, so the
+        cost does not grow with the tickets already stored.
+        :return: the id of the event
+        '''
+        customers = event.get_registered_customers()
+        ledger = event.get_ledger()
+        policy = event.get_discount_policy()
+        cancelled, position = event.get_cancelled_since(self.__saved_cancellations.get(event, 0))
+
+        with self.__transaction() as connection:
+            event_id = event.get_event_id()
+            values = (event.get_name(), event.get_location(), event.get_date(), event.get_capacity())
+            if event_id is None:
+                event_id = connection.execute(INSERT_EVENT, values).lastrowid
+                event.set_event_id(event_id)
+            else:
+                connection.execute(UPSERT_EVENT, (event_id,) + values)
+
+            if policy is None:
+                connection.execute(DELETE_POLICY, (event_id,))
+            else:
+                # the rules of a PricingPolicy are kept as JSON, NULL for a plain DiscountPolicy
+                rules = json.dumps(policy.get_rules()) if isinstance(policy, PricingPolicy) else None
+                connection.execute(UPSERT_POLICY, (event_id, policy.get_discount_percentage(),
+                                                   int(policy.is_discount_active()), rules))
+
+            connection.executemany(UPSERT_CUSTOMER, [
+                (customer.get_id(), customer.get_name(), customer.get_email(), customer.get_phone())
+                for customer in customers])
+            connection.execute(DELETE_REGISTRATIONS, (event_id,))
+            connection.executemany(INSERT_REGISTRATION, [(event_id, customer.get_id())
+                                                         for customer in customers])
+
+            stored = connection.execute(COUNT_TICKETS, (event_id,)).fetchone()[0]
+            # tickets not stored yet are inserted as they are now, cancelled or not
+            connection.executemany(INVALIDATE_TICKET, [(event_id, index) for index in cancelled if index < stored])
+            connection.executemany(INSERT_TICKET, [
+                self.__ticket_row(event_id, ledger, index) for index in range(stored, len(ledger))])
+        self.__saved_cancellations[event] = position
+        return event_id
+
+    def save_registrations(self, event_id, customers):
+        '''
+        Saves customers and registers them for a stored event in one
+        transaction, without saving the rest of the event. Used by bulk imports.
+        '''
+        customers = list(customers)
+        with self.__transaction() as connection:
+            connection.executemany(UPSERT_CUSTOMER, [
+                (customer.get_id(), customer.get_name(), customer.get_email(), customer.get_phone())
+                for customer in customers])
+            connection.executemany(INSERT_REGISTRATION_IF_MISSING, [(event_id, customer.get_id())
+                                                                    for customer in customers])
+
+    def save_new_tickets(self, event):
+        '''
+        Inserts the tickets sold since the stored event was last saved, in one
+        transaction. Unlike save_event it does not look at the earlier tickets,
+        so its cost only depends on the number of new tickets.
+        :return: the number of tickets inserted
+        '''
+        event_id = event.get_event_id()
+        ledger = event.get_ledger()
+        with self.__transaction() as connection:
+            stored = connection.execute(COUNT_TICKETS, (event_id,)).fetchone()[0]
+            connection.executemany(INSERT_TICKET, [
+                self.__ticket_row(event_id, ledger, index) for index in range(stored, len(ledger))])
+        return len(ledger) - stored
+
+    @staticmethod
+    def __ticket_row(event_id, ledger, index):
+        ticket = ledger.get_ticket(index)
+        return (event_id, index, TICKET_TYPE_CODES[ticket.get_ticket_type()], ticket.get_seat_number(),
+                ticket.get_price(), ledger.get_paid_price(index), ledger.get_customer_id(index),
+                int(ticket.is_valid()), PAYMENT_METHOD_CODES.get(ledger.get_payment_method(index), 0),
+                ledger.get_sold_at(index))
+
+    def load_event(self, event_id, ledger=None):
+        '''
+        Loads an event with its discount policy, registered customers and
+        tickets. The tickets are also put back into the purchases of their
+        customers.
+        :param ledger: optional empty ledger for the event, e.g. a ColumnarTicketLedger
+        :return: the event, otherwise False if it is not stored
+        '''
+        with self.__reader() as connection:
+            row = connection.execute(SELECT_EVENT, (event_id,)).fetchone()
+            if row is None:
+                return False
+            policy = connection.execute(SELECT_POLICY, (event_id,)).fetchone()
+            customers = connection.execute(SELECT_REGISTERED_CUSTOMERS, (event_id,)).fetchall()
+            tickets = connection.execute(SELECT_TICKETS, (event_id,)).fetchall()
+
+        event = RacingCarEvent(row[1], row[2], row[3], row[4], ledger=ledger, event_id=row[0])
+        if policy is not None and policy[2] is not None:
+            event.set_discount_policy(PricingPolicy.from_rules(policy[0], bool(policy[1]), json.loads(policy[2])))
+        elif policy is not None:
+            event.set_discount_policy(DiscountPolicy(policy[0], bool(policy[1])))
+        for customer_row in customers:
+            event.register_customer(Customer(*customer_row))
+
+        for type_code, seat_number, price, paid, customer_id, valid, payment_code, sold_at in tickets:
+            ticket = TICKET_CLASSES[type_code](price, seat_number)
+            if not valid:
+                ticket.invalidate()
+            customer = event.get_customer_by_id(customer_id) if customer_id is not None else None
+            # tickets saved before the time of sale was recorded keep 0, not the time they are loaded
+            event.restore_ticket_sale(ticket, paid, customer or None, PAYMENT_METHODS.get(payment_code),
+                                      sold_at or 0)
+        return event
+
+    def iter_ticket_columns(self, event_id, chunk_size=DEFAULT_CHUNK_SIZE):
+        '''
+        Reads the tickets of a stored event in ledger order, `chunk_size` rows
+        at a time, as columns like ColumnarTicketLedger.get_columns, e.g. for
+        reporting.py. No event is built, so memory depends on the chunk size
+        and the number of distinct customers only. customer_ids is the same
+        list for every chunk and grows as new customers are read.
+        A connection of the pool is held until the iteration ends.
+        :return: generator of dictionaries of columns
+        '''
+        customer_ids = []
+        customer_index = {}
+        with self.__reader() as connection:
+            cursor = connection.execute(SELECT_TICKET_COLUMNS, (event_id,))
+            try:
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        return
+                    type_codes, prices, paid, customers, valid, payment_codes, sold_at = zip(*rows)
+                    indexes = array("l")
+                    for customer_id in customers:
+                        if customer_id is None:
+                            indexes.append(-1)
+                            continue
+                        index = customer_index.get(customer_id)
+                        if index is None:
+                            index = customer_index[customer_id] = len(customer_ids)
+                            customer_ids.append(customer_id)
+                        indexes.append(index)
+                    yield {
+                        "price": array("d", prices),
+                        "paid": array("d", paid),
+                        "type_code": array("b", type_codes),
+                        "valid": bytearray(valid),
+                        "payment_code": array("b", payment_codes),
+                        "sold_at": array("q", sold_at),
+                        "customer": indexes,
+                        "customer_ids": customer_ids,
+                    }
+            finally:
+                cursor.close()
+
+    def list_events(self):
+        '''
+        :return: list of (id, name, location, date, capacity) of the stored events
+        '''
+        with self.__reader() as connection:
+            return connection.execute(SELECT_EVENTS).fetchall()